@@ -1,22 +1,52 @@
 
-from flask import Flask, render_template, request, url_for, session, g, redirect, flash, jsonify
+from flask import Flask, render_template, request, url_for, session, g, redirect, flash, jsonify, abort, send_from_directory, send_file, Response
+from markupsafe import Markup
 from sqlalchemy.exc import IntegrityError
-from models import db, connect_db, User, Melody, Favorited_Track, User_Favorited_Track
+from models import db, connect_db, User, Melody, Favorited_Track, User_Favorited_Track, Server_Session, Cache_Version, Catalog_Track, Track_Recommendation, encode_notes
 from forms import UserAddForm, LoginForm, UserEditForm, SearchTrackForm, SearchGenreForm, SaveMelodyForm
-from secrets_1 import API_CLIENT_ID, API_SECRET_KEY
+from spotify import SpotifyClient, SpotifyUnavailable
+from rate_limit import SharedTokenBucket
+from cache import TTLCache, PeriodicRefresh
+from sessions import ServerSideSessionInterface, SQLSessionStore, MemorySessionStore
+from identity import CurrentUser
+from hashing import hasher, HashingOverloaded
+from audio_sprite import load_sprite, AUDIO_DIR, SPRITE_NAME
+from melody_audio import MelodyRenderer, RenderUnavailable
+from search import search_melodies, search_favorite_tracks
+from similarity import SimilarityIndex, AVAILABLE as similarity_available
+from static_assets import load_assets, STATIC_DIR, BUILD_DIR_NAME, ASSETS_URL
+from metrics import Metrics, QueryStats, track_queries, QUERY_COUNT_BUCKETS
+from sqlalchemy.engine import Engine
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 
 
-import requests
+import hashlib
+import mimetypes
 import os
+import re
+import time
+
+
+try:
+    from secrets_1 import API_CLIENT_ID, API_SECRET_KEY
+except ImportError:  # no local secrets file: read the Spotify credentials from the environment
+    API_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', '')
+    API_SECRET_KEY = os.environ.get('SPOTIFY_CLIENT_SECRET', '')
 
 
 CURR_USER_KEY = "curr_user"
-AUTH_BASE_URL = "https://accounts.spotify.com/api/token"
-API_SEARCH_BASE_URL = "https://api.spotify.com/v1/search"
-API_REC_BASE_URL = "https://api.spotify.com/v1/recommendations"
-API_TOP_BASE_URL = "https://api.spotify.com/v1/artists"
-API_DISNEY_BASE_URL = "https://api.spotify.com/v1/playlists"
+PAGE_SIZE = 20
+
+# Point SPOTIFY_API_URL and SPOTIFY_AUTH_URL at the offline stand-in (see spotify_standin.py) to run without Spotify
+API_BASE_URL = os.environ.get('SPOTIFY_API_URL', "https://api.spotify.com/v1").rstrip('/')
+AUTH_BASE_URL = os.environ.get('SPOTIFY_AUTH_URL', "https://accounts.spotify.com/api/token")
+API_SEARCH_BASE_URL = f"{API_BASE_URL}/search"
+API_REC_BASE_URL = f"{API_BASE_URL}/recommendations"
+API_TOP_BASE_URL = f"{API_BASE_URL}/artists"
+API_DISNEY_BASE_URL = f"{API_BASE_URL}/playlists"
+API_TRACKS_BASE_URL = f"{API_BASE_URL}/tracks"
 
 
 app = Flask(__name__)
@@ -25,7 +55,7 @@ uri = (
     os.environ.get('DATABASE_URL', 'postgres:///melodic'))
 if uri.startswith("postgres://"):
     uri = uri.replace("postgres://", "postgresql://", 1)
-    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+app.config['SQLALCHEMY_DATABASE_URI'] = uri
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
@@ -35,20 +65,201 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 
 connect_db(app)
 
-
-# Acquire spotify API token at start of application
-res = requests.post(AUTH_BASE_URL, {
-    'grant_type': 'client_credentials',
-    'client_id': API_CLIENT_ID,
-    'client_secret': API_SECRET_KEY
-})
-data = res.json()
-access_token = f'Bearer {data["access_token"]}'
+# Keep session data on the server and only the session id in the cookie. SESSION_BACKEND=memory is meant for tests
+# and single-worker local runs, SESSION_BACKEND=cookie restores Flask's signed-cookie sessions.
+session_backend = os.environ.get('SESSION_BACKEND', 'sql')
+# Static files, built assets, audio and metrics never use the session, so their requests don't touch the store.
+SESSIONLESS_PATHS = (f'{app.static_url_path}/', ASSETS_URL, '/audio/', '/metrics')
+if session_backend == 'sql':
+    app.session_interface = ServerSideSessionInterface(
+        SQLSessionStore(db, Server_Session), skip_prefixes=SESSIONLESS_PATHS)
+elif session_backend == 'memory':
+    app.session_interface = ServerSideSessionInterface(MemorySessionStore(), skip_prefixes=SESSIONLESS_PATHS)
+
+
+# Password hashing runs on HASHING_WORKERS threads at BCRYPT_LOG_ROUNDS cost. When HASHING_MAX_PENDING hashes are
+# already running or queued, signups and logins are turned away with a 503 instead of tying up the worker. Each
+# gunicorn worker serves WEB_THREADS requests at once (see the Procfile), so by default at most half of them can be
+# waiting on a hash and the rest stay free for other pages.
+web_threads = int(os.environ.get('WEB_THREADS', 8))
+hasher.configure(rounds=int(os.environ.get('BCRYPT_LOG_ROUNDS', 12)),
+                 workers=int(os.environ.get('HASHING_WORKERS', 2)),
+                 max_pending=int(os.environ.get('HASHING_MAX_PENDING', max(1, web_threads // 2))))
+
+HASHING_OVERLOADED_MESSAGE = "Too many sign-ins right now, please try again in a moment."
+
+SPOTIFY_UNAVAILABLE_MESSAGE = "Spotify isn't responding right now, please try again in a moment."
+
+# Spotify track ids are 22 base-62 characters
+SPOTIFY_TRACK_ID = re.compile(r'[0-9A-Za-z]{22}')
+
+# Pooled, keep-alive HTTP client shared by every Spotify API request made by this worker. Failed requests are retried
+# with jittered backoff, and an endpoint that keeps failing is cut off for SPOTIFY_BREAKER_RESET seconds, raising
+# SpotifyUnavailable, so pages render without Spotify's results instead of waiting on it.
+spotify = SpotifyClient.from_env()
+
+# Spotify API token is fetched on the first API request, and refreshed shortly before it expires
+spotify.configure_auth(AUTH_BASE_URL, API_CLIENT_ID, API_SECRET_KEY)
+
+# Spotify API requests of every worker on this machine share one token bucket (kept in SPOTIFY_RATE_LIMIT_DB) of
+# SPOTIFY_RATE requests a second, in bursts of up to SPOTIFY_BURST. A 429 pauses the bucket for its Retry-After, and
+# requests give up after waiting SPOTIFY_RATE_LIMIT_WAIT seconds. SPOTIFY_RATE=0 turns the limiter off.
+spotify_rate = float(os.environ.get('SPOTIFY_RATE', 10))
+if spotify_rate > 0:
+    spotify.limiter = SharedTokenBucket(os.environ.get('SPOTIFY_RATE_LIMIT_DB'), rate=spotify_rate,
+                                        burst=int(os.environ.get('SPOTIFY_BURST', 20)))
+
+# Cache of Spotify API results, shared by all requests handled by this worker. Set SPOTIFY_CACHE=0 to bypass it.
+spotify_cache = TTLCache(maxsize=int(os.environ.get('SPOTIFY_CACHE_SIZE', 512)),
+                         enabled=os.environ.get('SPOTIFY_CACHE', '1') != '0')
+
+# Seconds that the results of each Spotify API request stay cached
+SPOTIFY_CACHE_TTLS = {
+    'search': 10 * 60,
+    'artist_top_tracks': 60 * 60,
+    'recommendations': 15 * 60,
+    'genre_recommendations': 15 * 60,
+    'disney': 6 * 60 * 60
+}
 
 
 # Spotify-Track-Id that inform the initial track recommendations
 recommended_track_id = '6tHtqQ2VYGqgcjh5TAMunF'
 
+# Starter recommendations for the default seed track, computed in the background when the worker boots and
+# refreshed every STARTER_TRACKS_REFRESH seconds, so the search page never waits on Spotify for them.
+starter_tracks = PeriodicRefresh(
+    lambda: API_recommended_tracks.uncached(recommended_track_id, limit=6),
+    interval=int(os.environ.get('STARTER_TRACKS_REFRESH', 60 * 60)))
+
+# Usernames of recently seen users, so most requests from a logged-in user don't query the users table.
+# Entries are dropped when the user is edited; IDENTITY_CACHE_TTL=0 disables the cache.
+identity_cache = TTLCache(maxsize=1024,
+                          ttl=int(os.environ.get('IDENTITY_CACHE_TTL', 60)),
+                          enabled=os.environ.get('IDENTITY_CACHE_TTL', '60') != '0')
+
+# Rendered shared-melody lists of the home page, keyed by feed version and page cursor. Any change to a shared melody
+# bumps the 'feed' Cache_Version, so workers never serve a list rendered before the change.
+feed_cache = TTLCache(maxsize=64, ttl=10 * 60)
+FEED_CONTROLS = re.compile(r'<!--melody-controls:(\d+)-->')
+
+# Every piano note in one content-hashed WAV (see audio_sprite.py), built here if it hasn't been built yet. Its
+# manifest is inlined in each page that plays piano notes.
+piano_sprite = load_sprite()
+
+# Fingerprinted, gzipped copies of the static files (see static_assets.py), rebuilt here when a static file changed.
+# Templates link to them with static_url().
+static_assets = load_assets()
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# WAV files of saved melodies, rendered on first request and kept in MELODY_RENDER_DIR
+melody_renderer = MelodyRenderer(os.environ.get('MELODY_RENDER_DIR'))
+
+# Feature vectors of every melody, for finding similar shared melodies: about 0.7 KB a melody in every worker, so
+# SIMILAR_MELODIES=0 turns it off where memory is tight. Loaded in the background when the worker boots, and every
+# SIMILARITY_REFRESH seconds caught up on melodies saved by other workers. It is kept up to date as this worker saves
+# and deletes melodies, and each query catches up on at most SIMILARITY_CATCH_UP melodies itself.
+similarity_index = (SimilarityIndex() if similarity_available and os.environ.get('SIMILAR_MELODIES', '1') != '0'
+                    else None)
+SIMILARITY_CATCH_UP = int(os.environ.get('SIMILARITY_CATCH_UP', 1000))
+
+
+def refresh_similarity_index():
+    """Load the melodies the similarity index doesn't have yet."""
+
+    with app.app_context():
+        similarity_index.build()
+    return similarity_index
+
+
+similarity_refresh = PeriodicRefresh(refresh_similarity_index,
+                                     interval=int(os.environ.get('SIMILARITY_REFRESH', 60)))
+
+# Latency histograms of requests, database queries and Spotify API requests, served on /metrics. Every worker writes
+# its own to a file in METRICS_DIR each second, and /metrics adds up the files of all the workers of the server.
+metrics = Metrics(os.environ.get('METRICS_DIR'))
+metrics.histogram('melodic_request_duration_seconds', 'Time taken to handle a request.')
+metrics.histogram('melodic_request_db_queries', 'Database queries made by a request.', buckets=QUERY_COUNT_BUCKETS)
+metrics.histogram('melodic_request_db_seconds', 'Total time a request spent in database queries.')
+metrics.histogram('melodic_spotify_request_duration_seconds', 'Time taken by a Spotify API request.')
+
+query_stats = QueryStats()
+track_queries(Engine, query_stats)
+spotify.on_response = lambda helper, status, seconds: metrics.observe(
+    'melodic_spotify_request_duration_seconds', seconds, helper=helper, status=status)
+
+
+########################################################################################################
+# Metrics
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    query_stats.reset()
+
+
+@app.after_request
+def add_request_status(resp):
+    g.response_status = resp.status_code
+    return resp
+
+
+@app.teardown_request
+def record_request_metrics(exc):
+    """Record the latency and database queries of the request (as a 500 if it raised), and write out this worker's
+    metrics if they haven't been for a second."""
+
+    if 'request_started' not in g:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('melodic_request_duration_seconds', time.perf_counter() - g.request_started,
+                    endpoint=endpoint, method=request.method, status=g.get('response_status', 500))
+    metrics.observe('melodic_request_db_queries', query_stats.count, endpoint=endpoint)
+    metrics.observe('melodic_request_db_seconds', query_stats.seconds, endpoint=endpoint)
+    metrics.flush()
+
+
+@app.route('/metrics')
+def show_metrics():
+    """Metrics of every worker, in the Prometheus text format."""
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+########################################################################################################
+# Static assets
+
+
+@app.template_global()
+def static_url(path):
+    """URL of a file under static/: its fingerprinted copy if it has one, otherwise the file itself."""
+
+    fingerprinted = static_assets.get(path)
+    if fingerprinted is None:
+        return f'/static/{path}'
+    return ASSETS_URL + fingerprinted
+
+
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    """Serve a fingerprinted static file, gzipped if the browser accepts it. Its name changes with its content, so
+    browsers may cache it forever."""
+
+    build_dir = os.path.join(STATIC_DIR, BUILD_DIR_NAME)
+    gzipped = safe_join(build_dir, f'{filename}.gz')
+
+    if request.accept_encodings.quality('gzip') and gzipped and os.path.isfile(gzipped):
+        resp = send_from_directory(build_dir, f'{filename}.gz', max_age=ASSET_MAX_AGE,
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        resp.content_encoding = 'gzip'
+    else:
+        resp = send_from_directory(build_dir, filename, max_age=ASSET_MAX_AGE)
+    resp.vary.add('Accept-Encoding')
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
 
 ########################################################################################################
 # User signup/login/logout
@@ -56,29 +267,28 @@ recommended_track_id = '6tHtqQ2VYGqgcjh5TAMunF'
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global. The users row is only loaded if a view needs more than the user's id and username."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = CurrentUser(session[CURR_USER_KEY], identity_cache, on_missing=forget_deleted_user)
 
     else:
         g.user = None
 
 
+def forget_deleted_user():
+    """Log out a session whose user has been deleted; the rest of the request carries on as a logged out user."""
+
+    session.pop(CURR_USER_KEY, None)
+
+
 def do_login(user):
     """Log in user and get the spotify ids of their favorite tracks . Prep the session keys to empty arrays"""
     session.clear()
     session[CURR_USER_KEY] = user.id
     session['recommended_tracks'] = []
-
-    favorite_track = [Favorited_Track.query.get(
-        track.track_id) for track in User_Favorited_Track.query.filter(User_Favorited_Track.user_id == user.id)]
-
-    if favorite_track != None:
-        session['favorite_track_ids'] = [
-            track.spotify_track_id for track in favorite_track]
-    else:
-        session['favorite_track_ids'] = []
+    session['favorite_track_ids'] = Favorited_Track.spotify_ids_for_user(
+        user.id)
 
 
 def do_logout():
@@ -114,6 +324,10 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except HashingOverloaded:
+            flash(HASHING_OVERLOADED_MESSAGE, 'danger')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
 
         return redirect("/")
@@ -133,10 +347,15 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except HashingOverloaded:
+            flash(HASHING_OVERLOADED_MESSAGE, 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            db.session.commit()  # keeps the password hash if it was upgraded to the current cost
             do_login(user)
             return redirect("/")
 
@@ -162,11 +381,24 @@ def home():
     """Show home page with list of user-shared melodies"""
     session['last_url'] = '/'
 
-    melodies = list(Melody.query.filter(
-        Melody.visibility == True).order_by(Melody.id))
-    melodies.reverse()
+    before = request.args.get('before', type=int)
+    key = (Cache_Version.get('feed'), before)
+    cached = feed_cache.get(key)
+    if cached is None:
+        melodies, older = Melody.shared(before=before, per_page=PAGE_SIZE)
+        cached = (render_template("melodies/shared-feed.html", melodies=melodies, older=older),
+                  {melody.id: melody.user_id for melody in melodies})
+        feed_cache.set(key, cached)
+    feed, owners = cached
+
+    # Overlay the visibility and delete controls on the current user's own melodies
+    def controls(match):
+        melody_id = int(match.group(1))
+        if g.user and (owners[melody_id] == g.user.id or g.user.username == "phoenix"):
+            return render_template("melodies/melody-controls.html", melody_id=melody_id)
+        return ''
 
-    return render_template("home.html", melodies=melodies)
+    return render_template("home.html", feed=Markup(FEED_CONTROLS.sub(controls, feed)))
 
 
 ########################################################################################################
@@ -185,13 +417,22 @@ def search_form():
         session['recommendation'] = True
 
     if 'search_tracks' not in session:
-        session['search_tracks'] = API_recommended_tracks(
-            recommended_track_id, limit=6)
+        tracks = starter_tracks.get()
+        if tracks:  # starter tracks are only stored once they have been computed
+            session['search_tracks'] = tracks
 
     if 'favorite_track_ids' not in session:
         session['favorite_track_ids'] = []
 
-    return render_template('spotify/search-tracks.html', form_search=form_search, form_genre=form_genre, tracks=session['search_tracks'], recommendation=session['recommendation'], favorites=session['favorite_track_ids'])
+    return render_template('spotify/search-tracks.html', form_search=form_search, form_genre=form_genre, tracks=session.get('search_tracks', []), recommendation=session['recommendation'], favorites=session['favorite_track_ids'])
+
+
+@app.errorhandler(SpotifyUnavailable)
+def spotify_unavailable(e):
+    """When a search can't reach Spotify, go back to the search page (and the tracks found before) with a message."""
+
+    flash(SPOTIFY_UNAVAILABLE_MESSAGE, 'danger')
+    return redirect('/search-tracks')
 
 
 @app.route('/search-tracks/search', methods=["POST"])
@@ -284,19 +525,46 @@ def spotify_player(track_id):
 
     session['last_url'] = f'/jam/{track_id}'
 
-    limit = '6'
+    limit = 6
     embed_link = f'https://open.spotify.com/embed/track/{track_id}?utm_source=generator'
 
-    session['recommended_tracks'] = API_recommended_tracks(
-        track_id, limit=limit)
+    # Recommendations stored in the last SPOTIFY_CACHE_TTLS['recommendations'] seconds, by any worker, are reused
+    tracks = Track_Recommendation.for_seed(
+        track_id, max_age=SPOTIFY_CACHE_TTLS['recommendations'])
+    if tracks is None:
+        try:
+            tracks = API_recommended_tracks(track_id, limit=limit)
+            Track_Recommendation.save(track_id, tracks)
+            db.session.commit()
+        except SpotifyUnavailable:  # the player still works; show the last recommendations stored, if any
+            flash(SPOTIFY_UNAVAILABLE_MESSAGE, 'danger')
+            tracks = Track_Recommendation.for_seed(track_id) or []
+    session['recommended_tracks'] = tracks
 
-    return render_template("spotify/spotify-player.html", track_id=track_id, embed_link=embed_link, tracks=session['recommended_tracks'], favorites=session['favorite_track_ids'])
+    return render_template("spotify/spotify-player.html", track_id=track_id, track=Catalog_Track.lookup(track_id), embed_link=embed_link, tracks=session['recommended_tracks'], favorites=session['favorite_track_ids'])
 
 
 ########################################################################################################
 # Recording
 
 
+@app.context_processor
+def add_piano_sprite():
+    return {'piano_sprite': piano_sprite}
+
+
+@app.route('/audio/<filename>')
+def audio_sprite(filename):
+    """Serve the piano audio sprite. Its name changes with its content, so browsers may cache it forever."""
+
+    if not filename.startswith(f'{SPRITE_NAME}.'):
+        abort(404)
+    resp = send_from_directory(AUDIO_DIR, filename, max_age=ASSET_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
 @app.route('/record')
 def record_melody():
     """Show page with keyboard instrument"""
@@ -305,11 +573,14 @@ def record_melody():
 
 @app.route('/get-melody', methods=['POST'])
 def get_melody():
-    """Route for recieving a melody object from JS as JSON if user saves a recorded melody. Save the recieved object of melody notes in session"""
+    """Route for recieving a melody object from JS as JSON if user saves a recorded melody. Save the recieved melody notes in session, in the compact melody encoding"""
 
     if request.method == 'POST':
 
-        session['melody'] = str(request.get_json())
+        try:
+            session['melody'] = encode_notes(request.get_json()['song'])
+        except (KeyError, TypeError, ValueError):
+            return "Invalid melody", 400
 
         return "OK", 200
 
@@ -322,7 +593,7 @@ def save_melody():
         flash("Log-in to save melodies.", "danger")
         return redirect("/login")
     if 'melody' not in session:
-        session['melody'] = " "
+        session['melody'] = encode_notes([])
     form = SaveMelodyForm()
 
     if form.validate_on_submit():
@@ -336,13 +607,113 @@ def save_melody():
                             music_notes=session['melody'], visibility=melody_visibility, timestamp=date_time_str)
 
         db.session.add(new_melody)
+        if melody_visibility:
+            Cache_Version.bump('feed')
         db.session.commit()
-        session['melody'] = "-"
+        if similarity_index is not None:
+            similarity_index.add(new_melody.id, new_melody.notes())
+        session['melody'] = encode_notes([])
         return redirect('record')
     else:
         return render_template('/users/save-melody.html', form=form)
 
 
+@app.route('/melodies/<int:melody_id>/notes')
+def melody_notes(melody_id):
+    """Return the music-note objects of a shared melody (or one of the current user's own melodies) as JSON, so listing pages don't have to inline them.
+    A melody's notes never change, so responses carry an ETag and shared melodies may be cached by the browser.
+    """
+
+    melody = Melody.query.get_or_404(melody_id)
+
+    if not melody.visibility and (not g.user or melody.user_id != g.user.id):
+        return jsonify(error="Access unauthorized."), 403
+
+    resp = jsonify(id=melody.id, song=melody.notes())
+    resp.set_etag(hashlib.sha1(melody.music_notes.encode()).hexdigest())
+    if melody.visibility:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = 24 * 60 * 60
+    else:
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+@app.route('/melodies/<int:melody_id>/audio.wav')
+def melody_audio(melody_id):
+    """Return a shared melody (or one of the current user's own melodies) rendered to a WAV file, as a download if
+    ?download=1. The file is rendered once and then served from the render cache.
+    """
+
+    melody = Melody.query.get_or_404(melody_id)
+
+    if not melody.visibility and (not g.user or melody.user_id != g.user.id):
+        return jsonify(error="Access unauthorized."), 403
+
+    try:
+        path = melody_renderer.path_for(melody)
+    except RenderUnavailable:
+        return jsonify(error="Melody audio is unavailable."), 503
+
+    resp = send_file(path, mimetype='audio/wav', conditional=True,
+                     as_attachment=request.args.get('download') == '1',
+                     download_name=f'{secure_filename(melody.name) or "melody"}.wav',
+                     max_age=24 * 60 * 60 if melody.visibility else None)
+    if melody.visibility:
+        resp.cache_control.public = True
+    else:
+        resp.cache_control.private = True
+    return resp
+
+
+@app.route('/melodies/<int:melody_id>/similar')
+def similar_melodies(melody_id):
+    """Return the shared melodies most similar to a shared melody (or to one of the current user's own melodies) as
+    JSON, most similar first. ?k= sets how many, up to 50.
+    """
+
+    melody = Melody.query.get_or_404(melody_id)
+
+    if not melody.visibility and (not g.user or melody.user_id != g.user.id):
+        return jsonify(error="Access unauthorized."), 403
+    if similarity_index is None:
+        return jsonify(error="Similar melodies are unavailable."), 503
+    if not similarity_index.ready:
+        return jsonify(error="Similar melodies are still loading, please try again in a moment."), 503
+
+    k = min(max(request.args.get('k', 10, type=int), 1), 50)
+    similar = [{'id': found.id, 'name': found.name, 'username': found.users.username, 'similarity': round(score, 4)}
+               for found, score in similarity_index.similar(melody, k, catch_up_limit=SIMILARITY_CATCH_UP)]
+    return jsonify(id=melody.id, similar=similar)
+
+
+@app.route('/search')
+def search():
+    """Return one page of ranked search results as JSON: shared melodies (and the current user's own) by name or
+    username, or with ?type=tracks the current user's favorited tracks by track or artist name. ?page= picks the page.
+    """
+
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    if request.args.get('type', 'melodies') == 'tracks':
+        if not g.user:
+            return jsonify(error="Access unauthorized."), 403
+        tracks, next_page = search_favorite_tracks(g.user.id, q, page, PAGE_SIZE)
+        results = [{'track_id': track.spotify_track_id, 'track_name': track.track_name,
+                    'artist_name': track.artist_name, 'album_name': track.album_name,
+                    'album_image': track.track_photo, 'rank': rank}
+                   for track, rank in tracks]
+    else:
+        melodies, next_page = search_melodies(q, g.user.id if g.user else None, page, PAGE_SIZE)
+        results = [{'id': melody.id, 'name': melody.name, 'username': melody.users.username,
+                    'timestamp': melody.timestamp, 'rank': rank}
+                   for melody, rank in melodies]
+
+    return jsonify(q=q, page=page, next_page=next_page, results=results)
+
+
 @app.route('/delete-melody/<int:melody_id>', methods=['POST'])
 def delete_melody(melody_id):
     """Delete a user's melody. If deleted form home-page, redirect back to home-page. If deleted form user page, redirect back to user page.  """
@@ -357,7 +728,12 @@ def delete_melody(melody_id):
         return redirect("/login")
 
     db.session.delete(melody)
+    if melody.visibility:
+        Cache_Version.bump('feed')
     db.session.commit()
+    melody_renderer.forget(melody_id)
+    if similarity_index is not None:
+        similarity_index.remove(melody_id)
 
     if session['last_url'] == '/':
         return redirect('/')
@@ -386,9 +762,8 @@ def edit_melody(melody_id):
     else:
         visibility = True
 
-    print(visibility)
-
     melody.visibility = visibility
+    Cache_Version.bump('feed')
     db.session.commit()
     if session['last_url'] == '/':
         return redirect('/')
@@ -411,13 +786,20 @@ def edit_profle():
     form = UserEditForm(obj=g.user)
 
     if form.validate_on_submit():
-        user = User.authenticate(g.user.username,
-                                 form.password.data)
+        try:
+            user = User.authenticate(g.user.username,
+                                     form.password.data)
+        except HashingOverloaded:
+            flash(HASHING_OVERLOADED_MESSAGE, 'danger')
+            return render_template('/users/edit-profile.html', form=form), 503
+
         if user:
 
             try:
                 g.user.username = form.username.data
+                Cache_Version.bump('feed')  # usernames are shown on the home page
                 db.session.commit()
+                identity_cache.delete(g.user.id)
                 return redirect(f'profile/{g.user.id}')
 
             except IntegrityError:
@@ -444,81 +826,58 @@ def user_profle(user_id):
 
     session['last_url'] = f'/profile/{user_id}'
 
-    favorite_tracks = [Favorited_Track.query.get(
-        track.track_id) for track in User_Favorited_Track.query.filter(User_Favorited_Track.user_id == g.user.id)]
-    session['last_url'] = f'/profile/{user_id}'
-    favorite_tracks.reverse()
+    tracks_before = request.args.get('tracks_before', type=int)
+    melodies_before = request.args.get('melodies_before', type=int)
+
+    favorite_tracks, older_tracks = Favorited_Track.for_user(
+        g.user.id, before=tracks_before, per_page=PAGE_SIZE)
+    melodies, older_melodies = Melody.for_user(
+        g.user.id, before=melodies_before, per_page=PAGE_SIZE)
 
-    melodies = list(Melody.query.filter(
-        Melody.user_id == g.user.id).order_by(Melody.id))
-    melodies.reverse()
-    return render_template("users/user-profile.html", tracks=favorite_tracks, melodies=melodies)
+    return render_template("users/user-profile.html", tracks=favorite_tracks, melodies=melodies,
+                           tracks_before=tracks_before, melodies_before=melodies_before,
+                           older_tracks=older_tracks, older_melodies=older_melodies)
 
 
 @app.route('/track/favorite', methods=['POST'])
 def toggle_favorite():
     """Recieve post request from JS with the spotify-track-id of the track a user has toggled the favorited status of. Update the user-favorited-tracks """
 
-    if request.method == 'POST':
-        data = request.get_json()
-        track_id = data['trackId']
+    data = request.get_json()
+    track_id = data['trackId']
 
-        if not g.user:
-            flash("Access unauthorized.", "danger")
-            return redirect("/")
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
-    # If the track Id is in the session as one of the favorited_track_ids, remove track from users favorites.
-    if session['favorite_track_ids'] != None and track_id in session['favorite_track_ids']:
-        favorited_track = Favorited_Track.query.filter(
-            Favorited_Track.spotify_track_id == track_id).first()
-        track = User_Favorited_Track.query.filter(
-            User_Favorited_Track.track_id == favorited_track.id).first()
+    favorite_track_ids = session.get('favorite_track_ids') or []
 
-        db.session.delete(track)
+    # If the track Id is in the session as one of the favorited_track_ids, remove track from users favorites.
+    if track_id in favorite_track_ids:
+        User_Favorited_Track.remove(g.user.id, track_id)
         db.session.commit()
 
-        #   update favorited_track_ids in session
-        favorite_tracks = [Favorited_Track.query.get(
-            track.track_id) for track in User_Favorited_Track.query.filter(User_Favorited_Track.user_id == g.user.id)]
-
         session['favorite_track_ids'] = [
-            track.spotify_track_id for track in favorite_tracks]
-
-    else:  # If track is not in the session as one of the favorited_track_ids, add it to favorites
-
-        # check if track is already in the favorited_tracks table. If it is, add it as a user_favorited_track for current user.
-        favorited_track = Favorited_Track.query.filter(
-            Favorited_Track.spotify_track_id == track_id).first()
-        if favorited_track != None:
-            user_favorited_track = User_Favorited_Track(
-                track_id=favorited_track.id, user_id=g.user.id)
-            db.session.add(user_favorited_track)
-            db.session.commit()
+            id for id in favorite_track_ids if id != track_id]
 
-        else:  # if track is not already in the favorited_Tracks table, add it there, and then add it as a user_favorited_track for the current user.
+    else:  # If track is not in the session as one of the favorited_track_ids, add it to favorites, along with the track's details from the track catalog if it isn't in the favorited_tracks table yet.
+        track = Catalog_Track.lookup(track_id)
 
-            for track in session['search_tracks']+session['recommended_tracks']:
-                if track_id == track['track_id']:
-                    favorited_track = Favorited_Track(
-                        track_name=track['track_name'],
-                        artist_name=track['artist_name'],
-                        track_photo=track['album_image'],
-                        spotify_track_id=track['track_id']
-                    )
-
-                    db.session.add(favorited_track)
-                    db.session.commit()
-                    user_favorited_track = User_Favorited_Track(
-                        track_id=favorited_track.id, user_id=g.user.id)
-                    db.session.add(user_favorited_track)
-                    db.session.commit()
-
-        # After making toggling the track's favorite status, update the user favorited_tracks_ids in the session.
-        favorite_track = [Favorited_Track.query.get(
-            track.track_id) for track in User_Favorited_Track.query.filter(User_Favorited_Track.user_id == g.user.id)]
+        if not User_Favorited_Track.add(g.user.id, track_id, track):
+            # Neither table knows the track, so get its details from Spotify; nothing is saved for an unknown track
+            if not SPOTIFY_TRACK_ID.fullmatch(track_id):
+                return 'Track not found', 404
+            db.session.rollback()  # don't hold the transaction open while waiting on Spotify
+            try:
+                tracks = API_several_tracks([track_id])
+            except SpotifyUnavailable:
+                return SPOTIFY_UNAVAILABLE_MESSAGE, 503
+            if not tracks:
+                return 'Track not found', 404
+            User_Favorited_Track.add(g.user.id, track_id, tracks[0])
 
-        session['favorite_track_ids'] = [
-            track.spotify_track_id for track in favorite_track]
+        db.session.commit()
+        session['favorite_track_ids'] = favorite_track_ids + [track_id]
 
     return 'OK', 200
 
@@ -526,155 +885,155 @@ def toggle_favorite():
 #########################################################################################################
 # definitions for Spotify API requests
 
+@spotify_cache.memoize(ttl=SPOTIFY_CACHE_TTLS['search'])
 def API_search_by_track(q, limit):
     """Make a request to Spotify's search API to get a list of tracks based on track name. If the auth token is no longer valid, request a new token and make the API request again."""
 
-    res = requests.get(API_SEARCH_BASE_URL,
-                       headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                'Authorization': access_token},
-                       params={'q': q.replace(" ", "+"), 'type': 'track', 'limit': limit})
-
-    data = res.json()
+    params = {'q': q.replace(" ", "+"), 'type': 'track', 'limit': limit}
+    data = spotify.get(API_SEARCH_BASE_URL, params=params, endpoint='search_by_track')
     check = API_check_auth(data)
     if check == False:
-        res = requests.get(API_SEARCH_BASE_URL,
-                           headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                    'Authorization': access_token},
-                           params={'q': q.replace(" ", "+"), 'type': 'track', 'limit': limit})
-        data = res.json()
+        data = spotify.get(API_SEARCH_BASE_URL, params=params, endpoint='search_by_track')
 
     track_data = [track for track in data['tracks']['items']]
     tracks = [{"track_id": track['id'],
                "track_name":track['name'],
               "artist_name":track['artists'][0]['name'],
                "artist_id": track['artists'][0]['id'],
+               "album_name": track['album']['name'],
                "album_image":track['album']['images'][0]['url']} for track in track_data]
-    return tracks
+    return catalog_tracks(tracks)
 
 
+@spotify_cache.memoize(ttl=SPOTIFY_CACHE_TTLS['search'])
 def API_search_by_artist(q, limit):
     """Make a request to Spotify's search API to get a list of tracks based on artist name. If the auth token is no longer valid, request a new token and make the API request again."""
 
-    res = requests.get(API_SEARCH_BASE_URL,
-                       headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                'Authorization': access_token},
-                       params={'q': q.replace(" ", "+"), 'type': 'artist', 'limit': limit})
-
-    data = res.json()
+    params = {'q': q.replace(" ", "+"), 'type': 'artist', 'limit': limit}
+    data = spotify.get(API_SEARCH_BASE_URL, params=params, endpoint='search_by_artist')
 
     check = API_check_auth(data)
     if check == False:
-        res = requests.get(API_SEARCH_BASE_URL,
-                           headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                    'Authorization': access_token},
-                           params={'q': q.replace(" ", "+"), 'type': 'artist', 'limit': limit})
-
-        data = res.json()
+        data = spotify.get(API_SEARCH_BASE_URL, params=params, endpoint='search_by_artist')
 
     artist_id = data['artists']['items'][0]['id']
     return artist_id
 
 
+@spotify_cache.memoize(ttl=SPOTIFY_CACHE_TTLS['artist_top_tracks'])
 def API_artist_top_tracks(artist_id):
     """Make a request to Spotify's API for an artist's top tracks. If the auth token is no longer valid, request a new token and make the API request again."""
 
-    res = requests.get(f'{API_TOP_BASE_URL}/{artist_id}/top-tracks',
-                       headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                'Authorization': access_token},
-                       params={'market': 'us'})
-
-    data = res.json()
+    url = f'{API_TOP_BASE_URL}/{artist_id}/top-tracks'
+    params = {'market': 'us'}
+    data = spotify.get(url, params=params, endpoint='artist_top_tracks')
 
     check = API_check_auth(data)
     if check == False:
-        res = requests.get(f'{API_TOP_BASE_URL}/{artist_id}/top-tracks',
-                           headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                    'Authorization': access_token},
-                           params={'market': 'us'})
-        data = res.json()
+        data = spotify.get(url, params=params, endpoint='artist_top_tracks')
 
     track_data = [track for track in data['tracks']]
     tracks = [{"track_id": track['id'],
                "track_name":track['name'],
               "artist_name":track['artists'][0]['name'],
+               "artist_id": track['artists'][0]['id'],
+               "album_name": track['album']['name'],
                "album_image":track['album']['images'][0]['url']} for track in track_data]
-    return tracks
+    return catalog_tracks(tracks)
 
 
+@spotify_cache.memoize(ttl=SPOTIFY_CACHE_TTLS['recommendations'])
 def API_recommended_tracks(track_id, limit):
     """Make a request to Spotify's API for track recommendations based on a given track id. If the auth token is no longer valid, request a new token and make the API request again."""
-    res = requests.get(API_REC_BASE_URL,
-                       headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                'Authorization': access_token},
-                       params={'seed_tracks': track_id, 'limit': limit, 'market': "us"})
 
-    data = res.json()
+    params = {'seed_tracks': track_id, 'limit': limit, 'market': "us"}
+    data = spotify.get(API_REC_BASE_URL, params=params, endpoint='recommended_tracks')
 
     check = API_check_auth(data)
     if check == False:
-        res = requests.get(API_REC_BASE_URL,
-                           headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                    'Authorization': access_token},
-                           params={'seed_tracks': track_id, 'limit': limit, 'market': "us"})
-
-        data = res.json()
+        data = spotify.get(API_REC_BASE_URL, params=params, endpoint='recommended_tracks')
 
     track_data = [track for track in data['tracks']]
     tracks = [{"track_id": track['id'],
                "track_name":track['name'],
               "artist_name":track['artists'][0]['name'],
+               "artist_id": track['artists'][0]['id'],
+               "album_name": track['album']['name'],
                "album_image":track['album']['images'][0]['url']} for track in track_data]
-    return tracks
+    return catalog_tracks(tracks)
 
 
+@spotify_cache.memoize(ttl=SPOTIFY_CACHE_TTLS['genre_recommendations'])
 def API_genre_recommended_tracks(genre, limit):
     """Make a request to Spotify's API to get a list of recommended tracks based on a genre. If the auth token is no longer valid, request a new token and make the API request again."""
-    res = requests.get(API_REC_BASE_URL,
-                       headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                'Authorization': access_token},
-                       params={'seed_genres': genre.replace(" ", "+"), 'limit': limit})
 
-    data = res.json()
+    params = {'seed_genres': genre.replace(" ", "+"), 'limit': limit}
+    data = spotify.get(API_REC_BASE_URL, params=params, endpoint='genre_recommended_tracks')
 
     check = API_check_auth(data)
     if check == False:
-        res = requests.get(API_REC_BASE_URL,
-                           headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                    'Authorization': access_token},
-                           params={'seed_genres': genre.replace(" ", "+"), 'limit': limit})
-
-        data = res.json()
+        data = spotify.get(API_REC_BASE_URL, params=params, endpoint='genre_recommended_tracks')
 
     track_data = [track for track in data['tracks']]
     tracks = [{"track_id": track['id'],
                "track_name":track['name'],
               "artist_name":track['artists'][0]['name'],
+               "artist_id": track['artists'][0]['id'],
+               "album_name": track['album']['name'],
                "album_image":track['album']['images'][0]['url']} for track in track_data]
-    return tracks
+    return catalog_tracks(tracks)
 
 
+@spotify_cache.memoize(ttl=SPOTIFY_CACHE_TTLS['disney'])
 def API_disney_tracks():
     """Make a request to Spotify's API get tracks from a pre-selected disney playlist. If the auth token is no longer valid, request a new token and make the API request again."""
-    res = requests.get(f'{API_DISNEY_BASE_URL}/37i9dQZF1DX8C9xQcOrE6T/tracks',
-                       headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                'Authorization': access_token},
-                       params={'limit': 12, 'market': 'us'})
 
-    data = res.json()
+    url = f'{API_DISNEY_BASE_URL}/37i9dQZF1DX8C9xQcOrE6T/tracks'
+    params = {'limit': 12, 'market': 'us'}
+    data = spotify.get(url, params=params, endpoint='disney_tracks')
+
     check = API_check_auth(data)
     if check == False:
-        res = requests.get(f'{API_DISNEY_BASE_URL}/37i9dQZF1DX8C9xQcOrE6T/tracks',
-                           headers={'Accept': 'application/json', 'Content-Type': 'application/json',
-                                    'Authorization': access_token},
-                           params={'limit': 12, 'market': 'us'})
-
-        data = res.json()
+        data = spotify.get(url, params=params, endpoint='disney_tracks')
 
     track_data = [item['track'] for item in data['items']]
     tracks = [{"track_id": track['id'],
                "track_name":track['name'],
               "artist_name":track['artists'][0]['name'],
+               "artist_id": track['artists'][0]['id'],
+               "album_name": track['album']['name'],
                "album_image":track['album']['images'][0]['url']} for track in track_data]
+    return catalog_tracks(tracks)
+
+
+def API_several_tracks(track_ids):
+    """Make a single request to Spotify's API for the current metadata of up to 50 tracks. Tracks Spotify no longer has are left out. If the auth token is no longer valid, request a new token and make the API request again."""
+
+    # No market, so Spotify answers with the requested tracks rather than relinking them to ones playable there
+    params = {'ids': ','.join(track_ids)}
+    data = spotify.get(API_TRACKS_BASE_URL, params=params, endpoint='several_tracks')
+
+    check = API_check_auth(data)
+    if check == False:
+        data = spotify.get(API_TRACKS_BASE_URL, params=params, endpoint='several_tracks')
+
+    track_data = [track for track in data['tracks'] if track]
+    tracks = [{"track_id": track['id'],
+               "track_name":track['name'],
+              "artist_name":track['artists'][0]['name'],
+               "artist_id": track['artists'][0]['id'],
+               "album_name": track['album']['name'],
+               "album_image":track['album']['images'][0]['url'] if track['album']['images'] else None} for track in track_data]
+    return catalog_tracks(tracks)
+
+
+def catalog_tracks(tracks):
+    """Add the tracks returned by a Spotify helper to the track catalog (or refresh them there), committed in a
+    transaction of their own, and return them."""
+
+    with app.app_context():
+        Catalog_Track.upsert_many(tracks)
+        db.session.commit()
     return tracks
 
 
@@ -682,14 +1041,12 @@ def API_check_auth(data):
     """Check a Spotify API resonse to determine if the access-token is still valid. Request a new access-token if the current token has expired."""
     if 'error' in data:
         if ('msg' in data['error'] and data['error']['msg'] == 'The access token expired') or ('message' in data['error'] and data['error']['message'] == 'The access token expired'):
-            res = requests.post(AUTH_BASE_URL, {
-                'grant_type': 'client_credentials',
-                'client_id': API_CLIENT_ID,
-                'client_secret': API_SECRET_KEY
-            })
-
-        data = res.json()
-        global access_token
-        access_token = f'Bearer {data["access_token"]}'
-        return False
+            spotify.token_expired()
+            return False
     return True
+
+
+# Compute the starter recommendations and load the similarity index as soon as the worker boots
+starter_tracks.start()
+if similarity_index is not None:
+    similarity_refresh.start()
@@ -0,0 +1,116 @@
+"""Piano audio sprite: every piano note WAV concatenated into one file, with a JSON manifest of where each note starts.
+
+Build (or rebuild, after changing a note's WAV) the sprite like:
+
+    python audio_sprite.py
+
+The sprite is written as static/audio/piano-sprite.<content hash>.wav, so its URL changes whenever its content does
+and it can be cached forever. The manifest, static/audio/piano-sprite.json, holds the URL and each note's offsets.
+"""
+
+import hashlib
+import io
+import json
+import os
+import wave
+
+AUDIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'audio')
+SPRITE_NAME = 'piano-sprite'
+SPRITE_URL = '/audio/'
+
+# WAV file of each piano note player in recording.js, playback.js and jam.js, in the order they go in the sprite
+PIANO_NOTES = {
+    'piano_c': 'c5.wav',
+    'piano_csh': 'c-5.wav',
+    'piano_d': 'd5.wav',
+    'piano_eb': 'd-5.wav',
+    'piano_e': 'e5.wav',
+    'piano_f': 'f4.wav',
+    'piano_fsh': 'f-4.wav',
+    'piano_g': 'g4.wav',
+    'piano_gsh': 'g-4.wav',
+    'piano_a': 'a5.wav',
+    'piano_bb': 'a-5.wav',
+    'piano_b': 'b5.wav',
+}
+
+
+def manifest_path(audio_dir=AUDIO_DIR):
+    return os.path.join(audio_dir, f'{SPRITE_NAME}.json')
+
+
+def write_atomic(path, data):
+    """Write data to path through a temporary file, so workers building the sprite at once never read a partial file."""
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_sprite(audio_dir=AUDIO_DIR, notes=PIANO_NOTES):
+    """Concatenate the note WAVs in audio_dir/piano into one sprite WAV in audio_dir and write its manifest.
+
+    All notes must share channels, sample width and frame rate. Sprites left from earlier builds are removed.
+    Returns the manifest.
+    """
+
+    params = None
+    frames = []
+    offsets = {}
+    position = 0
+    for name, filename in notes.items():
+        with wave.open(os.path.join(audio_dir, 'piano', filename), 'rb') as note:
+            note_params = (note.getnchannels(), note.getsampwidth(), note.getframerate())
+            if params is None:
+                params = note_params
+            elif note_params != params:
+                raise ValueError(f'{filename} is {note_params} (channels, sample width, rate), expected {params}')
+            count = note.getnframes()
+            frames.append(note.readframes(count))
+        offsets[name] = (position, count)
+        position += count
+
+    channels, sample_width, rate = params
+    sprite = io.BytesIO()
+    with wave.open(sprite, 'wb') as out:
+        out.setnchannels(channels)
+        out.setsampwidth(sample_width)
+        out.setframerate(rate)
+        out.writeframes(b''.join(frames))
+    data = sprite.getvalue()
+
+    filename = f'{SPRITE_NAME}.{hashlib.sha1(data).hexdigest()[:12]}.wav'
+    for old in os.listdir(audio_dir):
+        if old.startswith(f'{SPRITE_NAME}.') and old.endswith('.wav') and old != filename:
+            try:
+                os.remove(os.path.join(audio_dir, old))
+            except FileNotFoundError:
+                pass
+    write_atomic(os.path.join(audio_dir, filename), data)
+
+    manifest = {
+        'url': SPRITE_URL + filename,
+        'notes': {name: {'start': start / rate, 'duration': count / rate}
+                  for name, (start, count) in offsets.items()},
+    }
+    write_atomic(manifest_path(audio_dir), json.dumps(manifest, indent=2).encode())
+    return manifest
+
+
+def load_sprite(audio_dir=AUDIO_DIR):
+    """Return the sprite manifest, building the sprite first if it hasn't been built (or its file is missing)."""
+
+    try:
+        with open(manifest_path(audio_dir)) as f:
+            manifest = json.load(f)
+        if os.path.exists(os.path.join(audio_dir, manifest['url'][len(SPRITE_URL):])):
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_sprite(audio_dir)
+
+
+if __name__ == '__main__':
+    manifest = build_sprite()
+    print(f'built {manifest["url"]} with {len(manifest["notes"])} notes')
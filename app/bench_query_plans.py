@@ -0,0 +1,122 @@
+"""Benchmark of the hot favorites and melodies queries, before and after the access-path indexes.
+
+Seeds a large dataset into the given (scratch!) database, then prints the query plan and the average time of each
+query without the indexes and again with them. Run it like:
+
+    python bench_query_plans.py postgresql:///melodic-bench
+    python bench_query_plans.py sqlite:////tmp/melodic-bench.db --users 2000 --melodies 200000
+"""
+
+from flask import Flask
+from sqlalchemy import insert, text
+from models import db, User, Melody, Favorited_Track, User_Favorited_Track
+from migrations import access_path_indexes
+
+import argparse
+import random
+import time
+
+
+def seed(users, melodies, tracks, favorites_per_user, chunk_size=10000):
+    """Drop and recreate all tables, then fill them with generated rows."""
+
+    db.drop_all()
+    db.create_all()
+    rand = random.Random(0)
+
+    def insert_chunks(model, rows):
+        for i in range(0, len(rows), chunk_size):
+            db.session.execute(insert(model.__table__), rows[i:i + chunk_size])
+        db.session.commit()
+
+    insert_chunks(User, [{'id': i, 'username': f'user{i}', 'password': 'HASHED_PASSWORD'}
+                         for i in range(1, users + 1)])
+    insert_chunks(Favorited_Track, [{'id': i, 'track_name': f'track{i}', 'artist_name': f'artist{i % 500}',
+                                     'spotify_track_id': f'spotify{i}'} for i in range(1, tracks + 1)])
+    insert_chunks(Melody, [{'id': i, 'user_id': rand.randint(1, users), 'name': f'melody{i}', 'timestamp': 'now',
+                            'music_notes': 'AQ==', 'visibility': rand.random() < 0.3}
+                           for i in range(1, melodies + 1)])
+    insert_chunks(User_Favorited_Track, [{'user_id': user_id, 'track_id': track_id}
+                                         for user_id in range(1, users + 1)
+                                         for track_id in rand.sample(range(1, tracks + 1), favorites_per_user)])
+
+
+def hot_queries(user_id, cursor):
+    """The queries behind the home feed, the profile page and the favorite toggle, as SQL strings."""
+
+    queries = {
+        'home feed page': Melody.query.filter(Melody.visibility == True, Melody.id < cursor)
+        .order_by(Melody.id.desc()).limit(21),
+        'profile melodies page': Melody.query.filter(Melody.user_id == user_id)
+        .order_by(Melody.id.desc()).limit(21),
+        'profile favorites page': db.session.query(Favorited_Track, User_Favorited_Track.id)
+        .join(User_Favorited_Track, User_Favorited_Track.track_id == Favorited_Track.id)
+        .filter(User_Favorited_Track.user_id == user_id)
+        .order_by(User_Favorited_Track.id.desc()).limit(21),
+        'favorite toggle lookup': User_Favorited_Track.query.filter(User_Favorited_Track.user_id == user_id,
+                                                                    User_Favorited_Track.track_id == 1),
+    }
+    dialect = db.engine.dialect
+    return {name: str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+            for name, query in queries.items()}
+
+
+def explain(sql):
+    """Return the database's query plan for sql."""
+
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(text(f'EXPLAIN ANALYZE {sql}'))
+        return '\n'.join(row[0] for row in rows)
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))
+    return '\n'.join(row[-1] for row in rows)
+
+
+def measure(sql, repeat):
+    """Average milliseconds taken to run sql."""
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        db.session.execute(text(sql)).fetchall()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def report(label, queries, repeat):
+    print(f'\n==== {label} ====')
+    for name, sql in queries.items():
+        print(f'\n-- {name}: {measure(sql, repeat):.3f} ms')
+        print(explain(sql))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('database_url', help='scratch database; all of its tables are dropped')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--melodies', type=int, default=100000)
+    parser.add_argument('--tracks', type=int, default=20000)
+    parser.add_argument('--favorites-per-user', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    bench_app = Flask(__name__)
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    db.init_app(bench_app)
+
+    with bench_app.app_context():
+        seed(args.users, args.melodies, args.tracks, args.favorites_per_user)
+        queries = hot_queries(user_id=args.users // 2, cursor=args.melodies // 2)
+
+        for index in access_path_indexes():
+            index.drop(db.engine, checkfirst=True)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        report('without access-path indexes', queries, args.repeat)
+
+        for index in access_path_indexes():
+            index.create(db.engine, checkfirst=True)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        report('with access-path indexes', queries, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
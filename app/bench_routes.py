@@ -0,0 +1,174 @@
+"""End-to-end benchmark of the main routes, with Spotify replaced by the offline stand-in (see spotify_standin.py).
+
+Seeds the given (scratch!) database, serves the app and the stand-in from this process, logs in one user per
+concurrent client, then sends each route its share of requests and prints the p50/p95/p99 latency and throughput of
+every route. The app runs on Werkzeug's threaded server, so compare numbers between runs rather than with production.
+Run it like:
+
+    python bench_routes.py sqlite:////tmp/melodic-bench.db
+    python bench_routes.py postgresql:///melodic-bench --requests 500 --concurrency 8 --spotify-latency 80
+"""
+
+from bench_query_plans import seed
+from spotify_standin import FIXTURES_DIR, create_app, start_server
+from threading import Thread
+
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import time
+
+import requests
+
+PASSWORD = 'bench-password'
+SEARCHES = ['piano', 'stand-in', 'track', 'jam', 'melody', 'keys', 'chord', 'tune']
+
+
+def load_track_ids(name, path):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        data = json.load(f)
+    for key in path:
+        data = data[key]
+    return [track['id'] for track in data]
+
+
+def routes():
+    """(name, request maker) of each route benchmarked, in order. A request maker turns a user id and a request number
+    into the method, path and keyword arguments of a request."""
+
+    jam_ids = load_track_ids('search-track.json', ['tracks', 'items'])
+    # Any track in the catalog can be favorited; the recommendations are in it once /jam has been benchmarked
+    favorite_ids = load_track_ids('recommendations.json', ['tracks'])[:6]
+
+    return [
+        ('/', lambda user_id, n: ('GET', '/', {})),
+        ('/search-tracks', lambda user_id, n: ('GET', '/search-tracks', {})),
+        ('/search-tracks/search', lambda user_id, n: (
+            'POST', '/search-tracks/search', {'data': {'track_name': SEARCHES[n % len(SEARCHES)], 'artist_name': ''}})),
+        ('/jam/<track_id>', lambda user_id, n: ('GET', f'/jam/{jam_ids[n % len(jam_ids)]}', {})),
+        ('/profile/<user_id>', lambda user_id, n: ('GET', f'/profile/{user_id}', {})),
+        ('/track/favorite', lambda user_id, n: (
+            'POST', '/track/favorite', {'json': {'trackId': favorite_ids[n % len(favorite_ids)]}})),
+    ]
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list."""
+
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def run_route(base_url, clients, make_request, total, warmup):
+    """Send total requests (after warmup unrecorded ones) from all clients at once. Returns the sorted latencies in
+    seconds, the number of failed requests and the seconds taken."""
+
+    latencies, failures = [], []
+
+    def client_loop(user_id, http, counter, record):
+        for n in counter:
+            method, path, kwargs = make_request(user_id, n)
+            start = time.perf_counter()
+            try:
+                resp = http.request(method, base_url + path, allow_redirects=False, **kwargs)
+                failed = resp.status_code >= 400
+            except requests.RequestException:
+                failed = True
+            if record:
+                latencies.append(time.perf_counter() - start)
+                if failed:
+                    failures.append(n)
+
+    def run(count, record):
+        # count() hands out request numbers across threads; islice stops the clients once count have been taken
+        counter = itertools.islice(itertools.count(), count)
+        threads = [Thread(target=client_loop, args=(user_id, http, counter, record)) for user_id, http in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    run(warmup, record=False)
+    start = time.perf_counter()
+    run(total, record=True)
+    return sorted(latencies), len(failures), time.perf_counter() - start
+
+
+def reset_sequences(db):
+    """Move the id sequences of PostgreSQL tables past the ids seeded explicitly."""
+
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in db.metadata.sorted_tables:
+        if 'id' in table.c and table.c.id.autoincrement:
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), COALESCE(MAX(id), 1)) FROM {table.name}"))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('database_url', help='scratch database; all of its tables are dropped')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='unrecorded requests per route before measuring')
+    parser.add_argument('--concurrency', type=int, default=4, help='clients sending requests at once')
+    parser.add_argument('--spotify-latency', type=float, default=50, help='milliseconds per stand-in request')
+    parser.add_argument('--spotify-jitter', type=float, default=10)
+    parser.add_argument('--no-spotify-cache', action='store_true', help='send every Spotify request to the stand-in')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--melodies', type=int, default=20000)
+    parser.add_argument('--tracks', type=int, default=5000)
+    parser.add_argument('--favorites-per-user', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    standin_server, standin_url = start_server(create_app(latency=args.spotify_latency, jitter=args.spotify_jitter,
+                                                          seed=0))
+
+    # The app reads its configuration when it is imported
+    os.environ.update({
+        'DATABASE_URL': args.database_url,
+        'SPOTIFY_API_URL': f'{standin_url}/v1',
+        'SPOTIFY_AUTH_URL': f'{standin_url}/api/token',
+        'BCRYPT_LOG_ROUNDS': '4',
+        'SPOTIFY_CACHE': '0' if args.no_spotify_cache else '1',
+    })
+    from app import app
+    from hashing import hasher
+    from models import db, User
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    clients = list(range(1, min(args.concurrency, args.users) + 1))
+    with app.app_context():
+        seed(args.users, args.melodies, args.tracks, args.favorites_per_user)
+        reset_sequences(db)
+        User.query.filter(User.id.in_(clients)).update({'password': hasher.hash(PASSWORD)})
+        db.session.commit()
+
+    app_server, app_url = start_server(app)
+    sessions = []
+    for user_id in clients:
+        http = requests.Session()
+        resp = http.post(f'{app_url}/login', data={'username': f'user{user_id}', 'password': PASSWORD},
+                         allow_redirects=False)
+        if resp.status_code != 302:
+            raise SystemExit(f'logging in user{user_id} failed with {resp.status_code}')
+        sessions.append((user_id, http))
+
+    print(f'{args.requests} requests per route from {len(sessions)} clients, Spotify stand-in at '
+          f'{args.spotify_latency:g}±{args.spotify_jitter:g} ms, Spotify cache '
+          f'{"off" if args.no_spotify_cache else "on"}\n')
+    print(f'{"route":<24}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}{"errors":>8}')
+    for name, make_request in routes():
+        latencies, failures, seconds = run_route(app_url, sessions, make_request, args.requests, args.warmup)
+        p50, p95, p99 = (percentile(latencies, p) * 1000 for p in (50, 95, 99))
+        print(f'{name:<24}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{len(latencies) / seconds:>10.1f}{failures:>8}')
+
+    app_server.shutdown()
+    standin_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
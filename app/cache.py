@@ -0,0 +1,143 @@
+"""Bounded in-process caches for Melodic."""
+
+from collections import OrderedDict
+from functools import wraps
+from threading import Event, Lock, Thread
+
+import os
+import time
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a per-entry time-to-live.
+
+    Keeps hit/miss counters, and can be switched off (every lookup misses) by setting `enabled` to False.
+    """
+
+    def __init__(self, maxsize=512, ttl=300, enabled=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing, expired or the cache is disabled."""
+
+        with self._lock:
+            if self.enabled and key in self._data:
+                expires_at, value = self._data[key]
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entry if the cache is full."""
+
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove key from the cache if present."""
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove every entry and reset the hit/miss counters."""
+
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the current size and hit/miss counters."""
+
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def memoize(self, ttl=None):
+        """Decorator caching a function's return value keyed by its name and arguments.
+
+        The undecorated function stays reachable as `.uncached` for callers that must bypass the cache.
+        """
+
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    value = fn(*args, **kwargs)
+                    self.set(key, value, ttl)
+                return value
+
+            wrapper.uncached = fn
+            return wrapper
+
+        return decorator
+
+
+_MISSING = object()
+
+
+class PeriodicRefresh:
+    """Holds a value computed by `load` in a background thread, recomputed every `interval` seconds.
+
+    Readers are served the last computed value from memory and never wait on `load`. The thread is started on first
+    use in each process, so it also runs in workers forked after the value was created.
+    """
+
+    def __init__(self, load, interval=3600, retry_interval=30):
+        self.load = load
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.value = None
+        self._pid = None
+        self._lock = Lock()
+        self._wake = Event()
+
+    def start(self):
+        """Start the refresh thread for the current process if it isn't running yet."""
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        Thread(target=self._run, daemon=True).start()
+
+    def get(self, default=None):
+        """Return the most recently computed value, or default if it hasn't been computed yet."""
+
+        self.start()
+        return default if self.value is None else self.value
+
+    def refresh_now(self):
+        """Ask the refresh thread to recompute the value without waiting for the interval."""
+
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.value = self.load()
+                delay = self.interval
+            except Exception:
+                delay = self.retry_interval
+            self._wake.wait(delay)
+            self._wake.clear()
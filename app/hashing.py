@@ -0,0 +1,72 @@
+"""Password hashing for Melodic, run on a small bounded thread pool."""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+import bcrypt
+
+
+class HashingOverloaded(Exception):
+    """Raised when too many password hashes are already queued, so the request is turned away instead of waiting."""
+
+
+class PasswordHasher:
+    """Hashes and checks bcrypt passwords with a configurable work factor.
+
+    Hashing runs on a pool of `workers` threads, so at most that many bcrypt computations compete for the CPU at
+    once. At most `max_pending` hashes may be running or queued; beyond that HashingOverloaded is raised right away.
+    """
+
+    def __init__(self, rounds=12, workers=2, max_pending=8):
+        self.configure(rounds, workers, max_pending)
+
+    def configure(self, rounds=12, workers=2, max_pending=8):
+        """Set the work factor and the size of the hashing pool and its queue."""
+
+        if getattr(self, '_executor', None) is not None:
+            self._executor.shutdown(wait=False)
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = BoundedSemaphore(max_pending)
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HashingOverloaded()
+
+        def call():
+            try:
+                return fn(*args)
+            finally:
+                slots.release()
+
+        try:
+            future = self._executor.submit(call)
+        except BaseException:
+            slots.release()
+            raise
+        return future.result()
+
+    def hash(self, password):
+        """Return the bcrypt hash of password at the configured work factor."""
+
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+        return hashed.decode('utf-8')
+
+    def check(self, hashed, password):
+        """Return True if password matches the bcrypt hash."""
+
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """Return True if hashed was made with a different work factor than the configured one."""
+
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,64 @@
+"""Lazy stand-in for the logged-in user in g.user."""
+
+from models import User
+
+
+# User columns that can be answered from the identity cache without loading the users row
+CACHED_FIELDS = ('username',)
+
+
+class CurrentUser:
+    """Stands in for the logged-in User in g.user.
+
+    `id` comes straight from the session, and the fields in CACHED_FIELDS come from the per-worker identity cache when
+    they are in it. The users row is only loaded when a view reads (or sets) anything else, or checks whether there is
+    a user at all and the cache doesn't know. If the row has gone (the user was deleted), the stand-in is falsy, like
+    no user, and on_missing is called, e.g. to log the session out.
+    """
+
+    def __init__(self, user_id, cache=None, on_missing=None):
+        object.__setattr__(self, 'id', user_id)
+        object.__setattr__(self, '_user', None)
+        object.__setattr__(self, '_missing', False)
+        object.__setattr__(self, '_cache', cache)
+        object.__setattr__(self, '_on_missing', on_missing)
+
+    def _load(self):
+        user = self._user
+        if user is None and not self._missing:
+            user = User.query.get(self.id)
+            object.__setattr__(self, '_user', user)
+            if user is None:
+                object.__setattr__(self, '_missing', True)
+                if self._cache is not None:
+                    self._cache.delete(self.id)
+                if self._on_missing is not None:
+                    self._on_missing()
+            elif self._cache is not None:
+                self._cache.set(self.id, {field: getattr(user, field) for field in CACHED_FIELDS})
+        return user
+
+    def __bool__(self):
+        if self._user is not None:
+            return True
+        if not self._missing and self._cache is not None and self._cache.get(self.id) is not None:
+            return True
+        return self._load() is not None
+
+    def __getattr__(self, name):
+        if name in CACHED_FIELDS and self._user is None and self._cache is not None:
+            identity = self._cache.get(self.id)
+            if identity is not None:
+                return identity[name]
+        user = self._load()
+        if user is None:
+            raise AttributeError(f"user #{self.id} no longer exists, so it has no {name!r}")
+        return getattr(user, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+        if self._cache is not None:
+            self._cache.delete(self.id)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}>"
@@ -0,0 +1,143 @@
+"""Server-side rendering of saved melodies to WAV files, by mixing the piano samples with NumPy."""
+
+from audio_sprite import AUDIO_DIR, PIANO_NOTES
+
+import hashlib
+import io
+import os
+import tempfile
+import wave
+
+try:
+    import numpy as np
+except ImportError:  # rendering is unavailable, everything else works
+    np = None
+
+# Bump when rendering changes, so melodies rendered the old way are rendered again
+RENDER_VERSION = 1
+
+# Seconds skipped at the start of each sample, like the players in playback.js (currentTime = 0.01)
+SAMPLE_SKIP = 0.01
+
+# Notes mixed per vectorized pass; bounds the size of the index arrays for long melodies
+NOTES_PER_PASS = 64
+
+
+class RenderUnavailable(Exception):
+    """Raised when a melody can't be rendered because NumPy isn't installed."""
+
+
+class MelodyRenderer:
+    """Renders melodies to 16-bit WAV files and keeps them in a disk cache.
+
+    Like playback in the browser, each note plays its piano sample from SAMPLE_SKIP seconds in, until the sample ends or
+    the same note is played again. Rendered files are named after the melody id and a hash of its notes, so a cached
+    file is reused for as long as the melody exists.
+    """
+
+    def __init__(self, cache_dir=None, audio_dir=AUDIO_DIR):
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'melodic-renders')
+        self.audio_dir = audio_dir
+        self._samples = None
+
+    def _load_samples(self):
+        """Read every piano sample into one flat int16 bank. Returns the bank, the offset and frame count of each
+        note in it, the channels and the frame rate."""
+
+        if self._samples is None:
+            params = None
+            banks, offsets, lengths = [], {}, {}
+            position = 0
+            for name, filename in PIANO_NOTES.items():
+                with wave.open(os.path.join(self.audio_dir, 'piano', filename), 'rb') as note:
+                    note_params = (note.getnchannels(), note.getsampwidth(), note.getframerate())
+                    if note_params[1] != 2 or (params and note_params != params):
+                        raise ValueError(f'{filename} is {note_params} (channels, sample width, rate)')
+                    params = note_params
+                    lengths[name] = note.getnframes()
+                    frames = np.frombuffer(note.readframes(lengths[name]), dtype='<i2')
+                banks.append(frames)
+                offsets[name] = position
+                position += len(frames)
+            channels, _, rate = params
+            self._samples = (np.concatenate(banks).astype(np.float64), offsets, lengths, channels, rate)
+        return self._samples
+
+    def render(self, notes):
+        """Render a list of music-note objects ({'noteName': 'playPiano_a', 'time': ms}) to the bytes of a WAV file."""
+
+        if np is None:
+            raise RenderUnavailable('rendering melodies needs numpy')
+
+        bank, offsets, lengths, channels, rate = self._load_samples()
+        skip = int(SAMPLE_SKIP * rate)
+
+        names = [note['noteName'].replace('playPiano_', 'piano_', 1) for note in notes]
+        names = [name if name in offsets else None for name in names]
+        keep = np.array([name is not None for name in names], dtype=bool)
+        names = [name for name in names if name is not None]
+        starts = (np.array([note['time'] for note in notes], dtype=np.int64)[keep] * rate) // 1000
+
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]
+        names = [names[i] for i in order]
+
+        # Frames each note plays: the rest of its sample, cut short where the same note starts again
+        frames = np.array([lengths[name] - skip for name in names], dtype=np.int64)
+        for name in set(names):
+            same = np.flatnonzero([n == name for n in names])
+            frames[same[:-1]] = np.minimum(frames[same[:-1]], np.diff(starts[same]))
+        frames = np.maximum(frames, 0)
+        sources = np.array([offsets[name] for name in names], dtype=np.int64) + skip * channels
+
+        total = int((starts + frames).max()) * channels if len(names) else 0
+        mix = np.zeros(total, dtype=np.float64)
+        for i in range(0, len(names), NOTES_PER_PASS):
+            part = slice(i, i + NOTES_PER_PASS)
+            counts = frames[part] * channels
+            owner = np.repeat(np.arange(len(counts)), counts)
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            mix += np.bincount(starts[part][owner] * channels + within,
+                               weights=bank[sources[part][owner] + within], minlength=total)
+
+        out = io.BytesIO()
+        with wave.open(out, 'wb') as wav:
+            wav.setnchannels(channels)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(np.clip(mix, -32768, 32767).astype('<i2').tobytes())
+        return out.getvalue()
+
+    def cache_key(self, melody):
+        return hashlib.sha1(f'{RENDER_VERSION}:{melody.music_notes}'.encode()).hexdigest()[:16]
+
+    def path_for(self, melody):
+        """Path of the rendered WAV file of melody, rendering it first if it isn't in the cache."""
+
+        filename = f'{melody.id}-{self.cache_key(melody)}.wav'
+        path = os.path.join(self.cache_dir, filename)
+        if not os.path.exists(path):
+            data = self.render(melody.notes())
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # The new file is renamed into place before the melody's earlier render is removed, so the melody always
+            # has a complete file on disk
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self.forget(melody.id, keep=filename)
+        return path
+
+    def forget(self, melody_id, keep=None):
+        """Remove the rendered files of a melody from the cache, except the file named keep."""
+
+        try:
+            filenames = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+        for filename in filenames:
+            if filename.startswith(f'{melody_id}-') and filename.endswith('.wav') and filename != keep:
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,185 @@
+"""Latency histograms of requests, database queries and Spotify API calls, exposed in the Prometheus text format.
+
+Each process keeps its histograms in memory and regularly writes them to its own JSON file in a metrics directory.
+Files are named after the parent process as well (the gunicorn master, for workers), and rendering adds up the files
+of every process with the same parent, so any worker can answer a scrape for the whole server. Files of workers that
+have exited keep counting, so totals never go down while the server runs.
+"""
+
+from sqlalchemy import event
+from threading import Lock, local
+
+import json
+import os
+import tempfile
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the queries-per-request histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# Files left by servers that stopped this long ago (seconds) are removed
+STALE_AFTER = 24 * 60 * 60
+
+
+class Metrics:
+    """Registry of histograms, one series per metric name and set of label values."""
+
+    def __init__(self, directory=None, flush_interval=1):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'melodic-metrics')
+        self.flush_interval = flush_interval
+        self.definitions = {}
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._series = {}
+        self._flushed_at = 0
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        """Define a histogram; its bucket bounds must be in increasing order."""
+
+        self.definitions[name] = (help, tuple(buckets))
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram."""
+
+        buckets = self.definitions[name][1]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            # A worker forked after this process recorded something starts from zero, or it would be counted twice
+            if self._pid != os.getpid():
+                self._reset()
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics-{os.getppid()}-{pid}.json')
+
+    def flush(self, force=False):
+        """Write this process's histograms to its file, at most once per flush_interval unless forced."""
+
+        # One thread writes the file at a time, taking its snapshot once it has the write lock, so a file is never
+        # replaced half-written or by an older snapshot. An unforced flush skips if another thread is already writing.
+        if not self._write_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            if not force and now - self._flushed_at < self.flush_interval:
+                return
+            self._flushed_at = now
+
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+                snapshot = [[name, labels, list(buckets), total, count]
+                            for (name, labels), (buckets, total, count) in self._series.items()]
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(os.getpid())
+            tmp = f'{path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, path)
+        finally:
+            self._write_lock.release()
+
+    def collect(self):
+        """The histograms of every process of this server, summed: {(name, labels): [bucket counts, sum, count]}."""
+
+        self.flush(force=True)
+        prefix = f'metrics-{os.getppid()}-'
+        merged = {}
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith('.json'):
+                continue
+            if not filename.startswith(prefix):
+                try:
+                    if os.path.getmtime(path) < time.time() - STALE_AFTER:
+                        os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, buckets, total, count in snapshot:
+                if name not in self.definitions or len(buckets) != len(self.definitions[name][1]):
+                    continue
+                series = merged.setdefault((name, tuple(map(tuple, labels))), [[0] * len(buckets), 0.0, 0])
+                series[0] = [a + b for a, b in zip(series[0], buckets)]
+                series[1] += total
+                series[2] += count
+        return merged
+
+    def render(self):
+        """Every histogram of this server in the Prometheus text exposition format."""
+
+        series = self.collect()
+        lines = []
+        for name, (help, bounds) in sorted(self.definitions.items()):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), (buckets, total, count) in sorted(series.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(bounds, buckets):
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", float(bound)),))} {bucket_count}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total!r}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """Prometheus label set of (name, value) pairs, with backslashes, quotes and newlines in values escaped."""
+
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class QueryStats(local):
+    """Number and total seconds of the database queries made by the current thread since the last reset()."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+def track_queries(target, stats):
+    """Count and time, in stats, every query run through target: an Engine, or the Engine class for all engines."""
+
+    @event.listens_for(target, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(target, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats.count += 1
+        stats.seconds += time.perf_counter() - conn.info['query_started'].pop()
+
+    @event.listens_for(target, 'handle_error')
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
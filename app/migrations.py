@@ -0,0 +1,113 @@
+"""Data and schema migrations for the melodic database.
+
+Run a migration like:
+
+    python migrations.py tables
+    python migrations.py music-notes
+    python migrations.py indexes
+    python migrations.py search
+"""
+
+from models import db, Melody, User_Favorited_Track, encode_notes, decode_notes
+from search import create_search_indexes
+from sqlalchemy import func
+
+import sys
+
+
+def create_missing_tables():
+    """Create any table defined in models.py that doesn't exist yet. Existing tables are left untouched."""
+
+    db.create_all()
+    print('tables: all tables present')
+
+
+def migrate_music_notes(chunk_size=500):
+    """Re-encode melodies still stored as the legacy repr of their {'song': [...]} object in the compact melody encoding.
+
+    Melodies are read in id-ordered chunks and each chunk is committed on its own, so the migration streams through
+    the table with bounded memory and can be interrupted and re-run. A melody that can't be encoded (a note that isn't
+    a piano note, say) is reported and left in the legacy format, which decode_notes still reads.
+    """
+
+    last_id = 0
+    converted = skipped = 0
+    while True:
+        rows = (db.session.query(Melody.id, Melody.music_notes)
+                .filter(Melody.id > last_id)
+                .order_by(Melody.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            if not row.music_notes.lstrip().startswith('{'):
+                continue
+            try:
+                updates.append({'id': row.id, 'music_notes': encode_notes(decode_notes(row.music_notes))})
+            except (ValueError, TypeError) as e:
+                skipped += 1
+                print(f'music-notes: skipped melody {row.id}, left in the legacy format ({e})')
+        if updates:
+            db.session.bulk_update_mappings(Melody, updates)
+            db.session.commit()
+        converted += len(updates)
+        print(f'music-notes: converted {converted} melodies, skipped {skipped} (up to id {last_id})')
+
+    return converted
+
+
+def access_path_indexes():
+    """Indexes added for the favorites and melodies access paths."""
+
+    return [index for table in (User_Favorited_Track.__table__, Melody.__table__)
+            for index in table.indexes]
+
+
+def add_access_path_indexes():
+    """Add the unique (user_id, track_id) and (user_id, id) indexes on users_favorited_tracks and the melodies listing
+    indexes.
+
+    Duplicate favorites (the same track favorited twice by one user) are removed first, keeping the oldest row.
+    Indexes that already exist are skipped, so the migration can be re-run.
+    """
+
+    keep = (db.session.query(func.min(User_Favorited_Track.id))
+            .group_by(User_Favorited_Track.user_id, User_Favorited_Track.track_id))
+    duplicates = (User_Favorited_Track.query
+                  .filter(User_Favorited_Track.id.notin_(keep.scalar_subquery()))
+                  .delete(synchronize_session=False))
+    db.session.commit()
+    print(f'indexes: removed {duplicates} duplicate favorites')
+
+    for index in access_path_indexes():
+        index.create(db.engine, checkfirst=True)
+        print(f'indexes: {index.name} present')
+
+
+def add_search_indexes():
+    """Add the full-text and trigram search indexes (on SQLite, the FTS5 tables and their triggers, filled from the
+    existing rows). Indexes that already exist are skipped, so the migration can be re-run."""
+
+    create_search_indexes()
+    print(f'search: {db.engine.dialect.name} search indexes present')
+
+
+MIGRATIONS = {
+    'tables': create_missing_tables,
+    'music-notes': migrate_music_notes,
+    'indexes': add_access_path_indexes,
+    'search': add_search_indexes,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in MIGRATIONS:
+        sys.exit(f'usage: python migrations.py [{"|".join(MIGRATIONS)}]')
+
+    from app import app
+    with app.app_context():
+        MIGRATIONS[sys.argv[1]]()
@@ -1,10 +1,17 @@
 """SQLAlchemy models for Melodic."""
 
-from flask_bcrypt import Bcrypt
-
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from hashing import hasher
+
+from datetime import datetime, timedelta
+
+import ast
+import base64
+import binascii
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
@@ -29,6 +36,9 @@ class User(db.Model):
         nullable=False,
     )
 
+    favorite_tracks = db.relationship(
+        'Favorited_Track', secondary='users_favorited_tracks', viewonly=True)
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}>"
 
@@ -38,7 +48,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -55,13 +65,16 @@ class User(db.Model):
         It searches for a user whose password hash matches this password
         and, if it finds such a user, returns that user object.
         If can't find matching user (or if password is wrong), returns False.
+        If the password was hashed with a different work factor than the configured one, it is rehashed (the caller commits).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -107,12 +120,49 @@ class Favorited_Track(db.Model):
         unique=True
     )
 
+    @classmethod
+    def for_user(cls, user_id, before=None, per_page=20):
+        """One page of the tracks favorited by a user, most recently favorited first, loaded with a single joined query.
+        Each track's name, artist, album and photo come from the track catalog when it has the track, so they are as
+        fresh as the last time Spotify returned it. Returns rows with the spotify_track_id, track_name, artist_name,
+        album_name and track_photo of each track, and the cursor of the next page (None on the last page).
+        """
+
+        query = (db.session.query(cls.spotify_track_id,
+                                  func.coalesce(Catalog_Track.track_name, cls.track_name).label('track_name'),
+                                  func.coalesce(Catalog_Track.artist_name, cls.artist_name).label('artist_name'),
+                                  func.coalesce(Catalog_Track.album_name, cls.album_name).label('album_name'),
+                                  func.coalesce(Catalog_Track.album_image, cls.track_photo).label('track_photo'),
+                                  User_Favorited_Track.id.label('favorited_id'))
+                 .join(User_Favorited_Track, User_Favorited_Track.track_id == cls.id)
+                 .outerjoin(Catalog_Track, Catalog_Track.spotify_track_id == cls.spotify_track_id)
+                 .filter(User_Favorited_Track.user_id == user_id))
+        return keyset_page(query, User_Favorited_Track.id, before, per_page, cursor_of=lambda row: row.favorited_id)
+
+    @classmethod
+    def spotify_ids_for_user(cls, user_id):
+        """Spotify track ids of all tracks favorited by a user, loaded with a single joined query."""
+
+        rows = (db.session.query(cls.spotify_track_id)
+                .join(User_Favorited_Track, User_Favorited_Track.track_id == cls.id)
+                .filter(User_Favorited_Track.user_id == user_id)
+                .order_by(User_Favorited_Track.id))
+        return [row.spotify_track_id for row in rows]
+
 
 class User_Favorited_Track(db.Model):
     """Mapping users to their favorited Spotify tracks."""
 
     __tablename__ = 'users_favorited_tracks'
 
+    __table_args__ = (
+        # One mapping row per user and track. Also serves every lookup of a user's favorites.
+        db.Index('uq_users_favorited_tracks_user_track',
+                 'user_id', 'track_id', unique=True),
+        # The favorites page reads a user's favorites in the order they were favorited, newest first.
+        db.Index('ix_users_favorited_tracks_user_id_id', 'user_id', 'id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -130,6 +180,181 @@ class User_Favorited_Track(db.Model):
         nullable=False
     )
 
+    user = db.relationship(
+        'User', backref=db.backref('favorite_links', passive_deletes=True))
+
+    track = db.relationship(
+        'Favorited_Track', backref=db.backref('user_links', passive_deletes=True))
+
+    @classmethod
+    def add(cls, user_id, spotify_track_id, track=None):
+        """Favorite a Spotify track for a user within the current transaction.
+
+        If `track` (a track dict from the Spotify helpers) is given, the track is first upserted into favorited_tracks.
+        The mapping row is inserted with INSERT ... ON CONFLICT DO NOTHING, so repeating the request is harmless.
+        Returns True if the user has the track favorited afterwards, and False if nothing was saved because the track
+        isn't in favorited_tracks and no `track` details were given.
+        """
+
+        if track is not None:
+            db.session.execute(upsert(Favorited_Track)
+                               .values(track_name=track['track_name'],
+                                       artist_name=track['artist_name'],
+                                       album_name=track.get('album_name') or 'Not Available',
+                                       track_photo=track['album_image'],
+                                       spotify_track_id=spotify_track_id)
+                               .on_conflict_do_nothing(index_elements=['spotify_track_id']))
+
+        result = db.session.execute(upsert(cls)
+                                    .from_select(['user_id', 'track_id'],
+                                                 select(literal(user_id), Favorited_Track.id)
+                                                 .where(Favorited_Track.spotify_track_id == spotify_track_id))
+                                    .on_conflict_do_nothing(index_elements=['user_id', 'track_id']))
+        if track is not None or result.rowcount > 0:
+            return True
+        # Nothing inserted: either the user had already favorited the track, or the track isn't known
+        return db.session.query(Favorited_Track.id).filter_by(spotify_track_id=spotify_track_id).first() is not None
+
+    @classmethod
+    def remove(cls, user_id, spotify_track_id):
+        """Unfavorite a Spotify track for a user within the current transaction, with a single targeted delete."""
+
+        track_ids = (select(Favorited_Track.id)
+                     .where(Favorited_Track.spotify_track_id == spotify_track_id)
+                     .scalar_subquery())
+        db.session.execute(delete(cls)
+                           .where(cls.user_id == user_id, cls.track_id.in_(track_ids))
+                           .execution_options(synchronize_session=False))
+
+
+class Catalog_Track(db.Model):
+    """Metadata of every Spotify track returned by the Spotify helpers, refreshed each time a helper returns it again."""
+
+    __tablename__ = 'catalog_tracks'
+
+    spotify_track_id = db.Column(
+        db.Text,
+        primary_key=True
+    )
+
+    track_name = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    artist_name = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    artist_id = db.Column(
+        db.Text
+    )
+
+    album_name = db.Column(
+        db.Text
+    )
+
+    album_image = db.Column(
+        db.Text
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow
+    )
+
+    def as_track(self):
+        """The track as a track dict, like the ones the Spotify helpers return."""
+
+        return {'track_id': self.spotify_track_id,
+                'track_name': self.track_name,
+                'artist_name': self.artist_name,
+                'artist_id': self.artist_id,
+                'album_name': self.album_name,
+                'album_image': self.album_image}
+
+    @classmethod
+    def upsert_many(cls, tracks):
+        """Insert, or refresh the metadata of, a list of track dicts from the Spotify helpers with a single statement,
+        within the current transaction."""
+
+        now = datetime.utcnow()
+        # A statement can't insert and update the same row, so repeated tracks are only sent once
+        rows = {track['track_id']: {'spotify_track_id': track['track_id'],
+                                    'track_name': track['track_name'],
+                                    'artist_name': track['artist_name'],
+                                    'artist_id': track.get('artist_id'),
+                                    'album_name': track.get('album_name'),
+                                    'album_image': track.get('album_image'),
+                                    'updated_at': now} for track in tracks}
+        if not rows:
+            return
+        stmt = upsert(cls).values(list(rows.values()))
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['spotify_track_id'],
+            set_={column: stmt.excluded[column] for column in
+                  ('track_name', 'artist_name', 'artist_id', 'album_name', 'album_image', 'updated_at')}))
+
+    @classmethod
+    def lookup(cls, spotify_track_id):
+        """The track dict of a track, or None if it isn't in the catalog."""
+
+        track = db.session.get(cls, spotify_track_id)
+        return track.as_track() if track else None
+
+    @classmethod
+    def lookup_many(cls, spotify_track_ids):
+        """The track dicts of the tracks in the catalog among spotify_track_ids, in the same order."""
+
+        found = {track.spotify_track_id: track for track in
+                 cls.query.filter(cls.spotify_track_id.in_(spotify_track_ids)).all()}
+        return [found[track_id].as_track() for track_id in spotify_track_ids if track_id in found]
+
+
+class Track_Recommendation(db.Model):
+    """The tracks Spotify last recommended for a seed track, as space-separated ids of catalog tracks."""
+
+    __tablename__ = 'track_recommendations'
+
+    seed_track_id = db.Column(
+        db.Text,
+        primary_key=True
+    )
+
+    track_ids = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow
+    )
+
+    @classmethod
+    def save(cls, seed_track_id, tracks):
+        """Store the recommendations (track dicts) for a seed track within the current transaction."""
+
+        stmt = upsert(cls).values(seed_track_id=seed_track_id,
+                                  track_ids=' '.join(track['track_id'] for track in tracks),
+                                  updated_at=datetime.utcnow())
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['seed_track_id'],
+            set_={'track_ids': stmt.excluded.track_ids, 'updated_at': stmt.excluded.updated_at}))
+
+    @classmethod
+    def for_seed(cls, seed_track_id, max_age=None):
+        """The track dicts last recommended for a seed track, or None if there are none, or none from the last
+        max_age seconds."""
+
+        row = db.session.get(cls, seed_track_id)
+        if row is None or (max_age is not None and row.updated_at < datetime.utcnow() - timedelta(seconds=max_age)):
+            return None
+        return Catalog_Track.lookup_many(row.track_ids.split())
+
 
 class Melody(db.Model):
     """All recorded melodies that have been saved by a user."""
@@ -175,6 +400,198 @@ class Melody(db.Model):
 
     users = db.relationship("User")
 
+    def notes(self):
+        """The melody's list of music-note objects ({'noteName': ..., 'time': ...})."""
+
+        return decode_notes(self.music_notes)
+
+    @classmethod
+    def shared(cls, before=None, per_page=20):
+        """One page of the melodies shared with all users, newest first. Returns the melodies and the cursor of the next page."""
+
+        query = cls.query.filter(cls.visibility == True).options(
+            db.joinedload(cls.users))
+        return keyset_page(query, cls.id, before, per_page)
+
+    @classmethod
+    def for_user(cls, user_id, before=None, per_page=20):
+        """One page of a user's melodies, newest first. Returns the melodies and the cursor of the next page."""
+
+        return keyset_page(cls.query.filter(cls.user_id == user_id), cls.id, before, per_page)
+
+
+# The home feed reads shared melodies newest first, and the profile page reads a user's melodies newest first.
+db.Index('ix_melodies_shared_id', Melody.id.desc(),
+         postgresql_where=Melody.visibility == True,
+         sqlite_where=Melody.visibility == True)
+db.Index('ix_melodies_user_id_id', Melody.user_id, Melody.id.desc())
+
+
+class Server_Session(db.Model):
+    """Server-side session data. One row per session key, the cookie only holds the session id."""
+
+    __tablename__ = 'server_sessions'
+
+    session_id = db.Column(
+        db.Text,
+        primary_key=True
+    )
+
+    key = db.Column(
+        db.Text,
+        primary_key=True
+    )
+
+    value = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    expires = db.Column(
+        db.DateTime,
+        nullable=False
+    )
+
+
+class Cache_Version(db.Model):
+    """Version counters of cached content, shared by all workers. Write paths bump a version in the same transaction
+    as the change, which invalidates everything cached under the previous version.
+    """
+
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(
+        db.Text,
+        primary_key=True
+    )
+
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+
+    @classmethod
+    def get(cls, name):
+        """Current version of name (0 if it has never been bumped)."""
+
+        return db.session.query(cls.version).filter(cls.name == name).scalar() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """Increment the version of name within the current transaction."""
+
+        stmt = upsert(cls).values(name=name, version=1)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['name'], set_={'version': cls.version + 1}))
+
+
+# Piano notes that can be recorded, in the order of their index byte in the compact melody encoding.
+# The names are the recording.js/playback.js functions that play each note.
+NOTE_NAMES = ('playPiano_f', 'playPiano_fsh', 'playPiano_g', 'playPiano_gsh', 'playPiano_a', 'playPiano_bb',
+              'playPiano_b', 'playPiano_c', 'playPiano_csh', 'playPiano_d', 'playPiano_eb', 'playPiano_e')
+
+NOTES_VERSION = 1
+
+
+def encode_notes(notes):
+    """Encode a list of music-note objects ({'noteName': ..., 'time': ...}) in the compact melody format, as base64 text.
+
+    Version 1 is a version byte followed, for each note in time order, by the note's index in NOTE_NAMES and a varint
+    of the milliseconds since the previous note. Raises ValueError for a note that isn't a piano note.
+    """
+
+    out = bytearray([NOTES_VERSION])
+    previous = 0
+    for note in sorted(notes, key=lambda note: note['time']):
+        try:
+            out.append(NOTE_NAMES.index(note['noteName']))
+        except ValueError:
+            raise ValueError(f"Unknown note {note['noteName']!r}")
+
+        time = max(int(note['time']), 0)
+        delta = time - previous
+        previous = time
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return base64.b64encode(bytes(out)).decode('ascii')
+
+
+def decode_notes(music_notes):
+    """Parse a stored melody into its list of music-note objects.
+
+    Understands the compact format written by encode_notes and the legacy repr of the {'song': [...]} object posted by
+    recording.js. Anything that isn't a recorded song decodes to an empty list.
+    """
+
+    if music_notes.lstrip().startswith('{'):
+        return _decode_legacy_notes(music_notes)
+
+    try:
+        data = base64.b64decode(music_notes, validate=True)
+    except (ValueError, binascii.Error):
+        return []
+    if not data or data[0] != NOTES_VERSION:
+        return []
+
+    notes = []
+    time = 0
+    i = 1
+    try:
+        while i < len(data):
+            name = NOTE_NAMES[data[i]]
+            i += 1
+            delta = shift = 0
+            while True:
+                byte = data[i]
+                i += 1
+                delta |= (byte & 0x7f) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            time += delta
+            notes.append({'noteName': name, 'time': time})
+    except IndexError:
+        return []
+    return notes
+
+
+def _decode_legacy_notes(music_notes):
+    try:
+        data = ast.literal_eval(music_notes)
+    except (ValueError, SyntaxError):
+        return []
+    if not isinstance(data, dict) or not isinstance(data.get('song'), list):
+        return []
+    # Notes missing their name or time are dropped rather than failing the whole melody
+    return [{'noteName': note['noteName'], 'time': note['time']} for note in data['song']
+            if isinstance(note, dict) and 'noteName' in note and 'time' in note]
+
+
+def upsert(model):
+    """INSERT statement for model that supports ON CONFLICT clauses on the database in use (PostgreSQL or SQLite)."""
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def keyset_page(query, column, before=None, per_page=20, cursor_of=lambda row: row.id):
+    """Return one page of query ordered by column descending, starting below the cursor `before`, and the cursor of the
+    next page (None on the last page). Each page is a single indexed range read, however deep into the table it is.
+    """
+
+    if before is not None:
+        query = query.filter(column < before)
+    rows = query.order_by(column.desc()).limit(per_page + 1).all()
+
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, cursor_of(rows[-1])
+    return rows, None
+
 
 def connect_db(app):
     """Connect this database to provided Flask app. """
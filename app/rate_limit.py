@@ -0,0 +1,101 @@
+"""Token-bucket rate limiter shared by every worker process on a machine, kept in a small SQLite file."""
+
+from threading import local
+
+import os
+import sqlite3
+import tempfile
+import time
+
+
+class SharedTokenBucket:
+    """Lets through up to `rate` requests a second on average, and bursts of up to `burst`, across all processes
+    using the same `path`.
+
+    The bucket's state is one row, read and updated in an immediate (write-locked) SQLite transaction, so processes
+    take tokens one at a time. block() empties the bucket until a given time, e.g. for a Retry-After header; every
+    process then waits it out, and the bucket only starts refilling once the block is over, so requests resume at the
+    rate rather than in a burst.
+    """
+
+    def __init__(self, path=None, rate=10, burst=20, name='spotify'):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'melodic-rate-limit.sqlite3')
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self._local = local()
+
+    def _connection(self):
+        # One connection per thread and process; SQLite connections can't be shared across either
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # losing the bucket in a crash only resets it
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, '
+                         'blocked_until REAL NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _take(self, now):
+        """Take a token if there is one. Returns 0 if it was taken, otherwise the seconds until there is one."""
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated, blocked_until FROM buckets WHERE name = ?',
+                               (self.name,)).fetchone()
+            tokens, updated, blocked_until = row if row else (self.burst, now, 0)
+
+            # While blocked the bucket is left as block() set it: empty, refilling from the end of the block
+            if now < blocked_until:
+                conn.execute('COMMIT')
+                return blocked_until - now
+
+            tokens = min(self.burst, tokens + max(0, now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            conn.execute('INSERT OR REPLACE INTO buckets (name, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)',
+                         (self.name, tokens, now, blocked_until))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def acquire(self, timeout):
+        """Wait until a token can be taken and take it; give up (returning False) if that would take longer than
+        timeout seconds."""
+
+        deadline = time.time() + timeout
+        while True:
+            now = time.time()
+            wait = self._take(now)
+            if wait == 0:
+                return True
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Let no requests through for the next `seconds` seconds, and empty the bucket so that it refills from then."""
+
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR IGNORE INTO buckets (name, tokens, updated, blocked_until) VALUES (?, ?, ?, 0)',
+                         (self.name, self.burst, now))
+            conn.execute('UPDATE buckets SET tokens = 0, updated = MAX(blocked_until, ?), '
+                         'blocked_until = MAX(blocked_until, ?) WHERE name = ?',
+                         (now + seconds, now + seconds, self.name))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
@@ -0,0 +1,119 @@
+"""Refresh the names, album and photo stored with every favorited track from Spotify.
+
+Favorited tracks keep the metadata they had when first favorited. This job walks the favorited_tracks table in
+id-ordered chunks of 50, fetches each chunk with a single request to Spotify's several-tracks endpoint, and updates the
+chunk's rows in one statement, refreshing the track catalog too. Spotify requests go through the app's client, so they
+share the workers' rate limiter and back off on 429s like any other request. Run it like:
+
+    python refresh_tracks.py
+    python refresh_tracks.py --checkpoint /var/tmp/refresh-tracks.checkpoint
+    python refresh_tracks.py --after 12000
+
+Progress is printed after every chunk. An interrupted run is resumed from its checkpoint file, or from the id it last
+reported with --after.
+"""
+
+from models import db, Favorited_Track
+
+import argparse
+import os
+import sys
+
+# Most tracks Spotify's several-tracks endpoint returns in one request
+CHUNK_SIZE = 50
+
+
+def read_checkpoint(path):
+    """The id of the last favorited track refreshed by an earlier run, or 0 if there wasn't one."""
+
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, last_id):
+    # Written to a temporary file and renamed, so an interruption never leaves a half-written checkpoint
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(str(last_id))
+    os.replace(tmp, path)
+
+
+def refresh_favorited_tracks(fetch_tracks, after=0, chunk_size=CHUNK_SIZE, checkpoint=None):
+    """Refresh the favorited tracks with ids above `after` from fetch_tracks, a function that takes a list of Spotify
+    track ids and returns the track dicts of the ones Spotify still has (like API_several_tracks).
+
+    Each chunk is committed on its own, and its last id written to the checkpoint file (if given) once it is, so a
+    failed or interrupted run can be picked up where it stopped. Tracks Spotify no longer returns keep their metadata.
+    Returns the number of tracks refreshed.
+    """
+
+    last_id = after
+    refreshed = missing = 0
+    while True:
+        rows = (db.session.query(Favorited_Track.id, Favorited_Track.spotify_track_id)
+                .filter(Favorited_Track.id > last_id)
+                .order_by(Favorited_Track.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            break
+
+        tracks = {track['track_id']: track for track in fetch_tracks([row.spotify_track_id for row in rows])}
+        updates = []
+        for row in rows:
+            track = tracks.get(row.spotify_track_id)
+            if track is None:
+                missing += 1
+                continue
+            update = {'id': row.id,
+                      'track_name': track['track_name'],
+                      'artist_name': track['artist_name'],
+                      'album_name': track['album_name']}
+            if track['album_image']:
+                update['track_photo'] = track['album_image']
+            updates.append(update)
+
+        if updates:
+            db.session.bulk_update_mappings(Favorited_Track, updates)
+        db.session.commit()
+        last_id = rows[-1].id
+        if checkpoint:
+            write_checkpoint(checkpoint, last_id)
+        refreshed += len(updates)
+        print(f'refresh-tracks: refreshed {refreshed} tracks, {missing} not on Spotify (up to id {last_id})')
+
+    return refreshed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--after', type=int, help='only refresh favorited tracks with a higher id')
+    parser.add_argument('--checkpoint', help='file keeping the last id refreshed, to resume from; removed when done')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f'tracks per request (at most {CHUNK_SIZE})')
+    args = parser.parse_args()
+
+    if not 1 <= args.chunk_size <= CHUNK_SIZE:
+        sys.exit(f'--chunk-size must be between 1 and {CHUNK_SIZE}')
+    after = args.after
+    if after is None:
+        after = read_checkpoint(args.checkpoint) if args.checkpoint else 0
+
+    from app import app, API_several_tracks
+    from spotify import SpotifyUnavailable
+
+    with app.app_context():
+        try:
+            refresh_favorited_tracks(API_several_tracks, after, args.chunk_size, args.checkpoint)
+        except SpotifyUnavailable as e:
+            sys.exit(f'refresh-tracks: stopped, Spotify is unavailable ({e}); resume with the same --checkpoint, '
+                     f'or with --after the last id reported')
+
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Ranked full-text search over melodies (by name and username) and a user's favorited tracks (by track and artist).
+
+On PostgreSQL, names are matched word-prefix by word-prefix through tsvector expression indexes, and as substrings
+through pg_trgm trigram indexes (which also make ILIKE '%...%' an index scan). On SQLite, for local runs, the same
+columns are copied into FTS5 tables kept in step by triggers. The indexes (and FTS5 tables) are created with the
+tables; add them to an existing database with `python migrations.py search`.
+"""
+
+from models import db, User, Melody, Favorited_Track, User_Favorited_Track
+from sqlalchemy import DDL, Float, Integer, event, func, literal_column, or_, select, text, union
+
+import re
+
+SIMPLE = literal_column("'simple'")
+
+# At most this many words of a query are searched for
+MAX_TERMS = 8
+
+POSTGRESQL_DDL = {
+    User.__table__: [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_fts ON users USING gin (to_tsvector('simple', username))",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    ],
+    Melody.__table__: [
+        "CREATE INDEX IF NOT EXISTS ix_melodies_name_fts ON melodies USING gin (to_tsvector('simple', name))",
+        "CREATE INDEX IF NOT EXISTS ix_melodies_name_trgm ON melodies USING gin (name gin_trgm_ops)",
+    ],
+    Favorited_Track.__table__: [
+        "CREATE INDEX IF NOT EXISTS ix_favorited_tracks_track_name_fts "
+        "ON favorited_tracks USING gin (to_tsvector('simple', track_name))",
+        "CREATE INDEX IF NOT EXISTS ix_favorited_tracks_track_name_trgm "
+        "ON favorited_tracks USING gin (track_name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_favorited_tracks_artist_name_fts "
+        "ON favorited_tracks USING gin (to_tsvector('simple', artist_name))",
+        "CREATE INDEX IF NOT EXISTS ix_favorited_tracks_artist_name_trgm "
+        "ON favorited_tracks USING gin (artist_name gin_trgm_ops)",
+    ],
+}
+
+SQLITE_DDL = {
+    Melody.__table__: [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS melodies_search USING fts5(name, username, prefix='2 3')",
+        "CREATE TRIGGER IF NOT EXISTS melodies_search_insert AFTER INSERT ON melodies BEGIN "
+        "INSERT INTO melodies_search (rowid, name, username) "
+        "SELECT new.id, new.name, username FROM users WHERE id = new.user_id; END",
+        # Rows are keyed by the melody id, so a changed id (or owner) re-keys the row along with its name. Dropped
+        # first, so `python migrations.py search` replaces the trigger of databases created before it followed ids.
+        "DROP TRIGGER IF EXISTS melodies_search_update",
+        "CREATE TRIGGER melodies_search_update AFTER UPDATE OF id, user_id, name ON melodies BEGIN "
+        "UPDATE melodies_search SET rowid = new.id, name = new.name, "
+        "username = (SELECT username FROM users WHERE id = new.user_id) WHERE rowid = old.id; END",
+        "CREATE TRIGGER IF NOT EXISTS melodies_search_delete AFTER DELETE ON melodies BEGIN "
+        "DELETE FROM melodies_search WHERE rowid = old.id; END",
+        "CREATE TRIGGER IF NOT EXISTS melodies_search_username AFTER UPDATE OF username ON users BEGIN "
+        "UPDATE melodies_search SET username = new.username "
+        "WHERE rowid IN (SELECT id FROM melodies WHERE user_id = new.id); END",
+        "INSERT INTO melodies_search (rowid, name, username) "
+        "SELECT melodies.id, melodies.name, users.username FROM melodies JOIN users ON users.id = melodies.user_id "
+        "WHERE melodies.id NOT IN (SELECT rowid FROM melodies_search)",
+    ],
+    Favorited_Track.__table__: [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS favorited_tracks_search USING fts5(track_name, artist_name, prefix='2 3')",
+        "CREATE TRIGGER IF NOT EXISTS favorited_tracks_search_insert AFTER INSERT ON favorited_tracks BEGIN "
+        "INSERT INTO favorited_tracks_search (rowid, track_name, artist_name) "
+        "VALUES (new.id, new.track_name, new.artist_name); END",
+        "DROP TRIGGER IF EXISTS favorited_tracks_search_update",
+        "CREATE TRIGGER favorited_tracks_search_update "
+        "AFTER UPDATE OF id, track_name, artist_name ON favorited_tracks BEGIN "
+        "UPDATE favorited_tracks_search SET rowid = new.id, track_name = new.track_name, "
+        "artist_name = new.artist_name WHERE rowid = old.id; END",
+        "CREATE TRIGGER IF NOT EXISTS favorited_tracks_search_delete AFTER DELETE ON favorited_tracks BEGIN "
+        "DELETE FROM favorited_tracks_search WHERE rowid = old.id; END",
+        "INSERT INTO favorited_tracks_search (rowid, track_name, artist_name) "
+        "SELECT id, track_name, artist_name FROM favorited_tracks "
+        "WHERE id NOT IN (SELECT rowid FROM favorited_tracks_search)",
+    ],
+}
+
+SQLITE_DROP = {
+    Melody.__table__: "DROP TABLE IF EXISTS melodies_search",
+    Favorited_Track.__table__: "DROP TABLE IF EXISTS favorited_tracks_search",
+}
+
+for table, statements in POSTGRESQL_DDL.items():
+    for statement in statements:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for table, statements in SQLITE_DDL.items():
+    for statement in statements:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for table, statement in SQLITE_DROP.items():
+    event.listen(table, 'after_drop', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def create_search_indexes():
+    """Create the search indexes (or FTS5 tables and triggers) of the database in use, if they don't exist yet."""
+
+    ddl = POSTGRESQL_DDL if db.engine.dialect.name == 'postgresql' else SQLITE_DDL
+    with db.engine.begin() as conn:
+        for statements in ddl.values():
+            for statement in statements:
+                conn.execute(text(statement))
+
+
+def search_terms(q):
+    """The words of a search query, lowercased."""
+
+    return re.findall(r'\w+', q.lower())[:MAX_TERMS]
+
+
+def _postgresql_match(column, terms, q):
+    """Condition that column matches every term as a word prefix, or contains q; and the rank of the match."""
+
+    vector = func.to_tsvector(SIMPLE, column)
+    tsquery = func.to_tsquery(SIMPLE, ' & '.join(f'{term}:*' for term in terms))
+    pattern = '%' + re.sub(r'([\\%_])', r'\\\1', q) + '%'
+    match = or_(vector.op('@@')(tsquery), column.ilike(pattern, escape='\\'))
+    rank = func.coalesce(func.ts_rank(vector, tsquery) + func.similarity(column, q), 0)
+    return match, rank
+
+
+def _sqlite_match(fts_table, terms):
+    """Subquery of the (id, rank) of the rows of fts_table matching every term as a word prefix."""
+
+    query = ' '.join(f'"{term}"*' for term in terms)
+    return (text(f'SELECT rowid AS id, -bm25({fts_table}) AS rank FROM {fts_table} WHERE {fts_table} MATCH :query')
+            .bindparams(query=query)
+            .columns(id=Integer, rank=Float)
+            .subquery())
+
+
+def _page(query, page, per_page):
+    rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    if len(rows) > per_page:
+        return rows[:per_page], page + 1
+    return rows, None
+
+
+def search_melodies(q, user_id=None, page=1, per_page=20):
+    """One page of the shared melodies (and user_id's own melodies) whose name or username matches q, best match first.
+    Returns a list of (Melody, rank) and the number of the next page (None on the last page)."""
+
+    terms = search_terms(q)
+    if not terms:
+        return [], None
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        name_match, name_rank = _postgresql_match(Melody.name, terms, q)
+        user_match, user_rank = _postgresql_match(User.username, terms, q)
+        matched = union(select(Melody.id).where(name_match),
+                        select(Melody.id).join(User, User.id == Melody.user_id).where(user_match)).subquery()
+        rank = func.greatest(name_rank, user_rank)
+        query = db.session.query(Melody, rank).join(matched, matched.c.id == Melody.id)
+    else:
+        matched = _sqlite_match('melodies_search', terms)
+        rank = matched.c.rank
+        query = db.session.query(Melody, rank).join(matched, matched.c.id == Melody.id)
+
+    query = (query.join(Melody.users)
+             .options(db.contains_eager(Melody.users))
+             .filter(or_(Melody.visibility == True, Melody.user_id == user_id))
+             .order_by(rank.desc(), Melody.id.desc()))
+    return _page(query, page, per_page)
+
+
+def search_favorite_tracks(user_id, q, page=1, per_page=20):
+    """One page of user_id's favorited tracks whose track or artist name matches q, best match first.
+    Returns a list of (Favorited_Track, rank) and the number of the next page (None on the last page)."""
+
+    terms = search_terms(q)
+    if not terms:
+        return [], None
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        track_match, track_rank = _postgresql_match(Favorited_Track.track_name, terms, q)
+        artist_match, artist_rank = _postgresql_match(Favorited_Track.artist_name, terms, q)
+        rank = func.greatest(track_rank, artist_rank)
+        query = db.session.query(Favorited_Track, rank).filter(or_(track_match, artist_match))
+    else:
+        matched = _sqlite_match('favorited_tracks_search', terms)
+        rank = matched.c.rank
+        query = db.session.query(Favorited_Track, rank).join(matched, matched.c.id == Favorited_Track.id)
+
+    query = (query.join(User_Favorited_Track, User_Favorited_Track.track_id == Favorited_Track.id)
+             .filter(User_Favorited_Track.user_id == user_id)
+             .order_by(rank.desc(), User_Favorited_Track.id.desc()))
+    return _page(query, page, per_page)
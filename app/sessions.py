@@ -0,0 +1,349 @@
+"""Server-side session storage for Melodic.
+
+Only a signed session id is kept in the cookie. Small session values are stored together in one record, loaded the
+first time a request uses the session; the large track lists are each stored in their own record and only loaded from
+the store when a view reads them. Records are only written when their values change.
+"""
+
+from datetime import datetime
+from threading import Lock
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import and_, delete, insert, select
+
+import json
+import random
+import secrets
+
+# Session keys that hold large values and are stored and loaded separately from the rest of the session
+LAZY_KEYS = {'search_tracks', 'recommended_tracks', 'favorite_track_ids', 'melody'}
+
+# Store key of the record holding the small session values and the names of the lazily-loaded keys
+BASE_KEY = ''
+
+
+class ServerSideSession(dict, SessionMixin):
+    """Session dict whose small values are fetched from the store on first use, and each large value on first access.
+    A session that isn't new and whose stored record has gone (e.g. expired) continues as a new session."""
+
+    def __init__(self, sid, store, new=False):
+        super().__init__()
+        self.sid = sid
+        self.store = store
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.cleared = False
+        self.changed = set()
+        self.loaded = new
+        self.saved_base = None
+        self._unloaded = set()
+
+    def _load_base(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        base = self.store.load(self.sid, BASE_KEY)
+        if base is None:
+            self.sid = secrets.token_urlsafe(32)
+            self.new = True
+            return
+        dict.update(self, base['data'])
+        self._unloaded.update(base['lazy'])
+        self.saved_base = serialize_base(base)
+
+    def _load(self, key):
+        self._load_base()
+        if key in self._unloaded:
+            self._unloaded.discard(key)
+            value = self.store.load(self.sid, key)
+            if value is not None:
+                dict.__setitem__(self, key, value)
+
+    def _load_all(self):
+        self._load_base()
+        for key in list(self._unloaded):
+            self._load(key)
+
+    def _changed(self, key):
+        self.changed.add(key)
+        self.modified = True
+
+    def __contains__(self, key):
+        self.accessed = True
+        self._load_base()
+        return dict.__contains__(self, key) or key in self._unloaded
+
+    def __getitem__(self, key):
+        self.accessed = True
+        self._load(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._load_base()
+        self._unloaded.discard(key)
+        dict.__setitem__(self, key, value)
+        self._changed(key)
+
+    def __delitem__(self, key):
+        self._load_base()
+        if key in self._unloaded:
+            self._unloaded.discard(key)
+        else:
+            dict.__delitem__(self, key)
+        self._changed(key)
+
+    def __iter__(self):
+        self._load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load_base()
+        return dict.__len__(self) + len(self._unloaded)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self.loaded = True
+        self.saved_base = None  # the session is stored afresh under a new id
+        dict.clear(self)
+        self._unloaded.clear()
+        self.cleared = True
+        self.modified = True
+
+    def keys(self):
+        self._load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    def copy(self):
+        return dict(self.items())
+
+    def lazy_keys(self):
+        """Names of the large keys currently in the session, loaded or not."""
+
+        return sorted(key for key in LAZY_KEYS if key in self)
+
+
+def serialize_base(base):
+    """The stored form of a base record, to tell whether it changed."""
+
+    return json.dumps(base, sort_keys=True)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface that keeps session data in a session store and only the session id in the cookie.
+
+    Requests whose path starts with one of skip_prefixes (static files and the like) get an empty, read-only session
+    and never touch the store.
+    """
+
+    purge_probability = 0.01
+
+    def __init__(self, store, skip_prefixes=()):
+        self.store = store
+        self.skip_prefixes = tuple(skip_prefixes)
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='melodic-session')
+
+    def _new_session(self):
+        return ServerSideSession(secrets.token_urlsafe(32), self.store, new=True)
+
+    def open_session(self, app, request):
+        if request.path.startswith(self.skip_prefixes):
+            return self.make_null_session(app)
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self._new_session()
+
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return self._new_session()
+
+        return ServerSideSession(sid, self.store)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # The request never used the session, so there is nothing to save
+        if not session.loaded:
+            return
+
+        # A cleared session (login/logout) gets a new id, and everything stored under the old id is removed.
+        if session.cleared:
+            if not session.new:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        response.vary.add('Cookie')
+
+        if session.modified:
+            # The base record is only rewritten when its values changed, e.g. not when a view sets last_url to the
+            # value it already had. Unchanged sessions keep their expiry, which moves on with the next change.
+            base = {
+                'data': {key: value for key, value in dict.items(session) if key not in LAZY_KEYS},
+                'lazy': session.lazy_keys()
+            }
+            values = {}
+            if serialize_base(base) != session.saved_base:
+                values[BASE_KEY] = base
+            removed = []
+            for key in session.changed & LAZY_KEYS:
+                if dict.__contains__(session, key):
+                    values[key] = dict.__getitem__(session, key)
+                else:
+                    removed.append(key)
+
+            if values or removed:
+                self.store.save(session.sid, values, removed,
+                                datetime.utcnow() + app.permanent_session_lifetime)
+                session.saved_base = serialize_base(base)
+
+                if random.random() < self.purge_probability:
+                    self.store.purge_expired()
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(name, self._signer(app).sign(session.sid).decode(),
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain,
+                                path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+
+class MemorySessionStore:
+    """Session store kept in this process's memory. Meant for tests and local runs with a single worker."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = Lock()
+
+    def load(self, sid, key):
+        """Return the value stored for key in session sid, or None if there is none or it has expired."""
+
+        with self._lock:
+            record = self._data.get((sid, key))
+        if record is None or record[0] < datetime.utcnow():
+            return None
+        return json.loads(record[1])
+
+    def save(self, sid, values, removed, expires):
+        """Store each of values under session sid and remove the removed keys. Every record of the session gets the new expiry."""
+
+        with self._lock:
+            for key in removed:
+                self._data.pop((sid, key), None)
+            for (record_sid, key), (_, value) in list(self._data.items()):
+                if record_sid == sid:
+                    self._data[(sid, key)] = (expires, value)
+            for key, value in values.items():
+                self._data[(sid, key)] = (expires, json.dumps(value))
+
+    def delete(self, sid):
+        """Remove every record of session sid."""
+
+        with self._lock:
+            for key in [key for key in self._data if key[0] == sid]:
+                del self._data[key]
+
+    def purge_expired(self):
+        """Remove every expired record."""
+
+        now = datetime.utcnow()
+        with self._lock:
+            for key in [key for key, record in self._data.items() if record[0] < now]:
+                del self._data[key]
+
+
+class SQLSessionStore:
+    """Session store backed by the server_sessions table. The table is created on first use if it doesn't exist yet."""
+
+    def __init__(self, db, model):
+        self.db = db
+        self.table = model.__table__
+        self._created = False
+
+    def _engine(self):
+        engine = self.db.engine
+        if not self._created:
+            self.table.create(engine, checkfirst=True)
+            self._created = True
+        return engine
+
+    def load(self, sid, key):
+        """Return the value stored for key in session sid, or None if there is none or it has expired."""
+
+        table = self.table
+        with self._engine().connect() as conn:
+            value = conn.execute(select(table.c.value).where(and_(
+                table.c.session_id == sid,
+                table.c.key == key,
+                table.c.expires > datetime.utcnow()))).scalar()
+        return None if value is None else json.loads(value)
+
+    def save(self, sid, values, removed, expires):
+        """Store each of values under session sid and remove the removed keys, in one transaction. Every record of the session gets the new expiry."""
+
+        table = self.table
+        with self._engine().begin() as conn:
+            conn.execute(delete(table).where(and_(
+                table.c.session_id == sid,
+                table.c.key.in_(list(values) + removed))))
+            conn.execute(table.update().where(
+                table.c.session_id == sid).values(expires=expires))
+            if values:
+                conn.execute(insert(table), [{'session_id': sid, 'key': key, 'value': json.dumps(value),
+                                              'expires': expires} for key, value in values.items()])
+
+    def delete(self, sid):
+        """Remove every record of session sid."""
+
+        with self._engine().begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.session_id == sid))
+
+    def purge_expired(self):
+        """Remove every expired record."""
+
+        with self._engine().begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.expires < datetime.utcnow()))
@@ -0,0 +1,222 @@
+"""Melody similarity index, for finding shared melodies that resemble a given one."""
+
+from models import db, Melody, NOTE_NAMES, decode_notes
+from itertools import chain
+from sqlalchemy import func
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:  # the index is unavailable, everything else works
+    np = None
+
+AVAILABLE = np is not None
+
+# Piano notes in NOTE_NAMES run up the keyboard a semitone at a time, so a note's index is its pitch
+PITCHES = {name: pitch for pitch, name in enumerate(NOTE_NAMES)}
+
+# A melody vector is its pitch-class histogram followed by the histogram of its pairs of consecutive intervals
+# (in semitones, mod 12). Interval pairs describe the melody's shape whatever key it's played in.
+DIMENSIONS = 12 + 12 * 12
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def melody_vectors(songs):
+    """Feature vectors of a batch of melodies (lists of music-note objects), one unit-length row per melody (all zeros
+    for a melody without notes). The dot product of two melody vectors is their similarity, from 0 to 1.
+
+    The pitches of the whole batch are concatenated and the histograms of every melody counted at once.
+    """
+
+    pitch_lists = [[PITCHES[note['noteName']] for note in sorted(notes, key=lambda note: note['time'])
+                    if note['noteName'] in PITCHES] for notes in songs]
+    lengths = np.array([len(pitches) for pitches in pitch_lists], dtype=np.int64)
+    pitches = np.fromiter(chain.from_iterable(pitch_lists), dtype=np.int64, count=int(lengths.sum()))
+    owner = np.repeat(np.arange(len(songs)), lengths)
+
+    histograms = np.bincount(owner * 12 + pitches, minlength=len(songs) * 12).reshape(-1, 12)
+
+    # Interval i is from pitch i to pitch i + 1, and pair i is intervals i and i + 1; only count those within a melody
+    intervals = (pitches[1:] - pitches[:-1]) % 12
+    in_melody = owner[2:] == owner[:-2]
+    pairs = (intervals[:-1] * 12 + intervals[1:])[in_melody]
+    pairs = np.bincount(owner[2:][in_melody] * 144 + pairs, minlength=len(songs) * 144).reshape(-1, 144)
+
+    features = np.hstack([_unit_rows(histograms.astype(np.float32)), _unit_rows(pairs.astype(np.float32))])
+    return _unit_rows(features)
+
+
+def melody_vector(notes):
+    """Feature vector of one melody; see melody_vectors."""
+
+    return melody_vectors([notes])[0]
+
+
+class SimilarityIndex:
+    """In-memory matrix of melody vectors, one row per melody, answering nearest-neighbour queries with one
+    matrix-vector product.
+
+    Rows are added and removed one at a time as melodies are saved and deleted. `last_id` is the highest melody id
+    loaded in order from the database, so melodies saved by other workers can be caught up on by loading the ones
+    after it. build() loads every melody, and is meant to run in the background; `ready` is set once it has.
+    """
+
+    def __init__(self, capacity=1024):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.vectors = np.zeros((capacity, DIMENSIONS), dtype=np.float32)
+        self.size = 0
+        self.rows = {}
+        self.last_id = 0
+        self.ready = False
+        self.lock = Lock()
+        self._catch_up_lock = Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, melody_id):
+        return melody_id in self.rows
+
+    def _resize(self, capacity):
+        self.ids = np.resize(self.ids, capacity)
+        vectors = np.zeros((capacity, DIMENSIONS), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+
+    def _grow(self):
+        # Growing copies the matrix, so grow by half rather than doubling to keep the copy (and the spare rows) smaller
+        self._resize(len(self.ids) + len(self.ids) // 2 + 1)
+
+    def reserve(self, capacity):
+        """Make room for `capacity` melodies in one allocation."""
+
+        with self.lock:
+            if capacity > len(self.ids):
+                self._resize(capacity)
+
+    def add(self, melody_id, notes):
+        """Add (or replace) the vector of a melody."""
+
+        self.add_many([(melody_id, notes)])
+
+    def add_many(self, melodies):
+        """Add (or replace) the vectors of a batch of (melody id, notes) pairs."""
+
+        if not melodies:
+            return
+        vectors = melody_vectors([notes for melody_id, notes in melodies])
+        with self.lock:
+            for (melody_id, notes), vector in zip(melodies, vectors):
+                row = self.rows.get(melody_id)
+                if row is None:
+                    if self.size == len(self.ids):
+                        self._grow()
+                    row = self.size
+                    self.size += 1
+                    self.rows[melody_id] = row
+                    self.ids[row] = melody_id
+                self.vectors[row] = vector
+
+    def remove(self, melody_id):
+        """Remove the vector of a melody, moving the last row into its place."""
+
+        with self.lock:
+            row = self.rows.pop(melody_id, None)
+            if row is None:
+                return
+            self.size -= 1
+            if row != self.size:
+                self.ids[row] = self.ids[self.size]
+                self.vectors[row] = self.vectors[self.size]
+                self.rows[int(self.ids[row])] = row
+
+    def vector(self, melody_id):
+        """The stored vector of a melody, or None if it isn't in the index."""
+
+        with self.lock:
+            row = self.rows.get(melody_id)
+            return None if row is None else self.vectors[row].copy()
+
+    def nearest(self, vector, n, exclude=None):
+        """The (melody id, similarity) of the n melodies most similar to vector, most similar first. Melodies without
+        anything in common with vector are left out."""
+
+        with self.lock:
+            scores = self.vectors[:self.size] @ vector
+            ids = self.ids[:self.size].copy()
+        if exclude is not None:
+            scores[ids == exclude] = 0
+        n = min(n, len(scores))
+        if n == 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def catch_up(self, chunk_size=5000, limit=None, blocking=True):
+        """Add the melodies saved since `last_id` was loaded, in id-ordered chunks, up to `limit` of them if given.
+
+        One thread catches up at a time; with blocking=False, the call returns right away if another thread already
+        is. Returns True if the index has caught up with every melody.
+        """
+
+        if not self._catch_up_lock.acquire(blocking=blocking):
+            return False
+        try:
+            loaded = 0
+            while limit is None or loaded < limit:
+                rows = (db.session.query(Melody.id, Melody.music_notes)
+                        .filter(Melody.id > self.last_id)
+                        .order_by(Melody.id)
+                        .limit(chunk_size if limit is None else min(chunk_size, limit - loaded))
+                        .all())
+                if not rows:
+                    return True
+                self.add_many([(row.id, decode_notes(row.music_notes)) for row in rows if row.id not in self.rows])
+                self.last_id = rows[-1].id
+                loaded += len(rows)
+            return False
+        finally:
+            self._catch_up_lock.release()
+
+    def build(self, chunk_size=5000):
+        """Load every melody not loaded yet (all of them, the first time), making room for them in one allocation, and
+        mark the index ready."""
+
+        remaining = db.session.query(func.count(Melody.id)).filter(Melody.id > self.last_id).scalar()
+        self.reserve(self.size + remaining)
+        if self.catch_up(chunk_size):
+            self.ready = True
+
+    def similar(self, melody, k=10, catch_up_limit=1000):
+        """The k shared melodies most similar to melody, as (Melody, similarity) pairs, most similar first.
+
+        Up to catch_up_limit melodies saved since the index was last caught up are loaded first (none if build() or
+        another query is catching up), so a query never waits on a large backlog. Candidates are checked against the
+        database, so melodies deleted or unshared by other workers are never returned; deleted ones are dropped from
+        the index on the way.
+        """
+
+        self.catch_up(limit=catch_up_limit, blocking=False)
+        vector = self.vector(melody.id)
+        if vector is None:
+            vector = melody_vector(melody.notes())
+
+        n = k * 4
+        while True:
+            candidates = self.nearest(vector, n, exclude=melody.id)
+            ids = [melody_id for melody_id, score in candidates]
+            found = {found.id: found for found in
+                     Melody.query.filter(Melody.id.in_(ids)).options(db.joinedload(Melody.users)).all()}
+            for melody_id in set(ids) - set(found):
+                self.remove(melody_id)
+
+            similar = [(found[melody_id], score) for melody_id, score in candidates
+                       if melody_id in found and found[melody_id].visibility]
+            if len(similar) >= k or n >= len(self):
+                return similar[:k]
+            n *= 4
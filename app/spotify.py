@@ -0,0 +1,321 @@
+"""Pooled HTTP client and access-token manager for the Spotify Web API."""
+
+from threading import Lock, Thread, local
+
+import os
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TokenManager:
+    """Lazily fetches a client-credentials access token and keeps it fresh.
+
+    The first token is only requested when it is first needed. Once a token is within `refresh_margin` seconds of
+    its `expires_in`, the next caller starts a background refresh and keeps using the still-valid token. Concurrent
+    threads that find no valid token share a single blocking refresh.
+    """
+
+    def __init__(self, fetch, refresh_margin=60):
+        self._fetch = fetch
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0
+        self._lock = Lock()
+        # Guards _refreshing only; _lock is held for the whole of a fetch
+        self._refreshing_lock = Lock()
+        self._refreshing = False
+
+    def get(self):
+        """Return a valid access token, fetching one first if there is none."""
+
+        now = time.monotonic()
+        token = self._token
+        if token is None or now >= self._expires_at:
+            return self.refresh()
+
+        if now >= self._expires_at - self.refresh_margin and self._start_refreshing():
+            Thread(target=self._refresh_in_background, daemon=True).start()
+        return token
+
+    def _start_refreshing(self):
+        """Claim the background refresh. False if another thread already started one."""
+
+        with self._refreshing_lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    def refresh(self):
+        """Fetch a new token unless another thread already did while we were waiting for the lock."""
+
+        with self._lock:
+            if self._token is not None and time.monotonic() < self._expires_at:
+                return self._token
+            return self._store(self._fetch())
+
+    def expire(self, token):
+        """Mark token as expired (e.g. after Spotify rejected it) so the next caller fetches a new one."""
+
+        with self._lock:
+            if token == self._token:
+                self._expires_at = 0
+
+    def _refresh_in_background(self):
+        try:
+            with self._lock:
+                self._store(self._fetch())
+        except Exception:
+            pass
+        finally:
+            self._refreshing = False
+
+    def _store(self, data):
+        self._token = f'Bearer {data["access_token"]}'
+        self._expires_at = time.monotonic() + int(data.get('expires_in', 3600))
+        return self._token
+
+
+def retry_after(res, default=1):
+    """Seconds to wait before retrying, from the Retry-After header of a response."""
+
+    try:
+        return max(0.0, float(res.headers.get('Retry-After', default)))
+    except ValueError:  # an HTTP date; Spotify sends seconds
+        return default
+
+
+class SpotifyUnavailable(Exception):
+    """Raised when a Spotify API request failed on every attempt, or wasn't sent because its endpoint's circuit is open."""
+
+
+class CircuitBreaker:
+    """Fails requests to an unhealthy endpoint fast instead of letting each one wait out its timeouts and retries.
+
+    After `threshold` consecutive failed requests the circuit opens, and requests are refused for `reset_timeout`
+    seconds. Then a single trial request is let through: if it succeeds the circuit closes, otherwise it opens again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Whether a request may be sent now."""
+
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def cancel(self):
+        """Report that an allowed request didn't show whether the endpoint works (it wasn't sent, or was rate limited)."""
+
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class SpotifyClient:
+    """Owns one keep-alive requests.Session (per worker process) that every Spotify API request is sent through.
+
+    The session is created lazily and re-created if the process has been forked (gunicorn workers), so pooled
+    connections are never shared between processes.
+
+    Requests that time out, fail to connect or get a 5xx response are retried up to `max_retries` times, after a random
+    delay of up to `backoff` seconds, doubling with each retry up to `max_backoff`. Each endpoint has its own circuit
+    breaker, counting the requests that failed after all their retries. An optional `limiter` (see rate_limit.py)
+    spaces out the requests of every process sharing it.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, keep_alive=True, max_retries=2,
+                 backoff=0.25, max_backoff=2, breaker_threshold=5, breaker_reset=30, limiter=None, rate_limit_wait=5):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.breakers = {}
+        self.limiter = limiter
+        self.rate_limit_wait = rate_limit_wait
+        self.tokens = None
+        self.on_response = None
+        self._session = None
+        self._pid = None
+        self._local = local()
+        self._lock = Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a client from the SPOTIFY_POOL_SIZE, SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_READ_TIMEOUT, SPOTIFY_KEEP_ALIVE,
+        SPOTIFY_MAX_RETRIES, SPOTIFY_BACKOFF, SPOTIFY_BREAKER_THRESHOLD, SPOTIFY_BREAKER_RESET and
+        SPOTIFY_RATE_LIMIT_WAIT environment variables."""
+
+        return cls(
+            pool_size=int(os.environ.get('SPOTIFY_POOL_SIZE', 10)),
+            connect_timeout=float(os.environ.get('SPOTIFY_CONNECT_TIMEOUT', 3.05)),
+            read_timeout=float(os.environ.get('SPOTIFY_READ_TIMEOUT', 10)),
+            keep_alive=os.environ.get('SPOTIFY_KEEP_ALIVE', '1') != '0',
+            max_retries=int(os.environ.get('SPOTIFY_MAX_RETRIES', 2)),
+            backoff=float(os.environ.get('SPOTIFY_BACKOFF', 0.25)),
+            breaker_threshold=int(os.environ.get('SPOTIFY_BREAKER_THRESHOLD', 5)),
+            breaker_reset=float(os.environ.get('SPOTIFY_BREAKER_RESET', 30)),
+            rate_limit_wait=float(os.environ.get('SPOTIFY_RATE_LIMIT_WAIT', 5))
+        )
+
+    @property
+    def session(self):
+        """Return the pooled session for the current process, creating it on first use."""
+
+        if self._session is None or self._pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                  pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept': 'application/json',
+                                    'Content-Type': 'application/json'})
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._session = session
+            self._pid = os.getpid()
+        return self._session
+
+    def configure_auth(self, auth_url, client_id, client_secret, refresh_margin=60):
+        """Use client-credentials tokens from auth_url for all API requests. No token is requested until the first API request."""
+
+        def fetch():
+            res = self.session.post(auth_url, {
+                'grant_type': 'client_credentials',
+                'client_id': client_id,
+                'client_secret': client_secret
+            }, headers={'Content-Type': 'application/x-www-form-urlencoded'}, timeout=self.timeout)
+            return res.json()
+
+        self.tokens = TokenManager(fetch, refresh_margin=refresh_margin)
+
+    def breaker(self, endpoint):
+        """The circuit breaker of an endpoint, created on first use."""
+
+        with self._lock:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = self.breakers[endpoint] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+            return breaker
+
+    def get(self, url, params=None, endpoint=None):
+        """Make an authorized GET request to a Spotify API endpoint and return the decoded JSON body, retrying
+        timeouts, connection errors, 5xx and 429 responses. Raises SpotifyUnavailable if every attempt failed, or
+        without trying if the endpoint's circuit is open.
+
+        With a limiter, each attempt first waits for it to let the request through, and a 429 response holds up the
+        limiter for its Retry-After. The request gives up if it can't be sent within `rate_limit_wait` seconds.
+
+        endpoint names the request for its circuit breaker and for on_response (it defaults to url). If on_response is
+        set, it is called after each attempt with endpoint, the HTTP status ('error' if no response came back) and the
+        seconds the attempt took.
+        """
+
+        endpoint = endpoint or url
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise SpotifyUnavailable(f'{endpoint}: circuit open after {breaker.failures} failed requests')
+        deadline = time.monotonic() + self.rate_limit_wait
+        failed = False
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+            if self.limiter is not None and not self.limiter.acquire(max(0, deadline - time.monotonic())):
+                problem = 'rate limited'
+                break
+            try:
+                res = self._send(url, params, endpoint)
+            except (requests.RequestException, KeyError, ValueError) as e:  # KeyError, ValueError: no token
+                problem, failed = repr(e), True
+                continue
+            if res.status_code == 429:
+                problem = 'HTTP 429'
+                wait = retry_after(res)
+                if self.limiter is not None:
+                    self.limiter.block(wait)
+                elif time.monotonic() + wait <= deadline:
+                    time.sleep(wait)
+                else:
+                    break
+                continue
+            if res.status_code < 500:
+                breaker.success()
+                return res.json()
+            problem, failed = f'HTTP {res.status_code}', True
+
+        # Being rate limited (by the limiter or by Spotify) says nothing about whether the endpoint works, so the
+        # breaker is only told about attempts that failed
+        if failed:
+            breaker.failure()
+        else:
+            breaker.cancel()
+        raise SpotifyUnavailable(f'{endpoint}: {problem}')
+
+    def _send(self, url, params, endpoint):
+        token = self.tokens.get()
+        self._local.token = token
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            res = self.session.get(url,
+                                   headers={'Authorization': token},
+                                   params=params,
+                                   timeout=self.timeout)
+            status = res.status_code
+            return res
+        finally:
+            if self.on_response is not None:
+                self.on_response(endpoint, status, time.perf_counter() - started)
+
+    def token_expired(self):
+        """Report that Spotify rejected the token used by this thread's last request, so it is replaced."""
+
+        self.tokens.expire(getattr(self._local, 'token', None))
+
+    def close(self):
+        """Close the pooled connections held by this process."""
+
+        if self._session is not None and self._pid == os.getpid():
+            self._session.close()
+        self._session = None
+        self._pid = None
@@ -0,0 +1,203 @@
+"""Offline stand-in for the parts of the Spotify Web API that the app uses, serving recorded responses.
+
+Run it, and point the app at it, like:
+
+    python spotify_standin.py --port 5050 --latency 80 --jitter 30
+    SPOTIFY_API_URL=http://localhost:5050/v1 SPOTIFY_AUTH_URL=http://localhost:5050/api/token flask run
+
+Responses come from the JSON files in fixtures/spotify/, cut down to the requested limit. Each request is delayed by
+--latency milliseconds (give or take --jitter), and fails with a 503 with probability --error-rate. Beyond
+--rate-limit API requests in a second, requests get a 429 with a Retry-After. Tokens expire after --token-ttl seconds,
+after which requests made with them are rejected like Spotify does.
+
+Re-record the fixtures from the real API (the credentials are read from SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET)
+like:
+
+    python spotify_standin.py --record
+"""
+
+from flask import Flask, request, jsonify
+from threading import Thread
+from werkzeug.serving import make_server
+
+import argparse
+import json
+import math
+import os
+import random
+import secrets
+import time
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'spotify')
+FIXTURES = ['search-track.json', 'search-artist.json', 'artist-top-tracks.json', 'recommendations.json',
+            'playlist-tracks.json']
+
+# Playlist recorded into playlist-tracks.json: the one behind the Disney genre option
+RECORDED_PLAYLIST = '37i9dQZF1DX8C9xQcOrE6T'
+
+
+def error(status, message):
+    return jsonify(error={'status': status, 'message': message}), status
+
+
+def create_app(fixtures_dir=FIXTURES_DIR, latency=0, jitter=0, error_rate=0, rate_limit=0, token_ttl=3600, seed=None):
+    """The stand-in WSGI app. Latency and jitter are in milliseconds; rate_limit is API requests a second (0 for no
+    limit). They, error_rate and token_ttl can be changed later through app.config (LATENCY, JITTER, ERROR_RATE,
+    RATE_LIMIT, TOKEN_TTL)."""
+
+    app = Flask(__name__)
+    app.config.update(LATENCY=latency, JITTER=jitter, ERROR_RATE=error_rate, RATE_LIMIT=rate_limit,
+                      TOKEN_TTL=token_ttl)
+
+    fixtures = {}
+    for name in FIXTURES:
+        with open(os.path.join(fixtures_dir, name)) as f:
+            fixtures[name] = json.load(f)
+    # Every recorded track, for the several-tracks endpoint
+    catalog = {track['id']: track for track in
+               fixtures['search-track.json']['tracks']['items'] + fixtures['artist-top-tracks.json']['tracks'] +
+               fixtures['recommendations.json']['tracks'] +
+               [item['track'] for item in fixtures['playlist-tracks.json']['items']]}
+    tokens = {}
+    rand = random.Random(seed)
+    window = {'second': 0, 'requests': 0}
+
+    def limited(items, default=20):
+        limit = max(1, min(request.args.get('limit', default, type=int), 50))
+        return items[:limit]
+
+    @app.before_request
+    def inject_latency_and_errors():
+        delay = app.config['LATENCY'] + rand.uniform(-app.config['JITTER'], app.config['JITTER'])
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if rand.random() < app.config['ERROR_RATE']:
+            return error(503, 'Service unavailable')
+
+        if request.path.startswith('/v1/'):
+            now = time.time()
+            if int(now) != window['second']:
+                window.update(second=int(now), requests=0)
+            window['requests'] += 1
+            if app.config['RATE_LIMIT'] and window['requests'] > app.config['RATE_LIMIT']:
+                resp, status = error(429, 'API rate limit exceeded')
+                resp.headers['Retry-After'] = str(math.ceil(window['second'] + 1 - now))
+                return resp, status
+
+            token = request.headers.get('Authorization', '')
+            if not token.startswith('Bearer '):
+                return error(401, 'No token provided')
+            expires_at = tokens.get(token[len('Bearer '):])
+            if expires_at is None:
+                return error(401, 'Invalid access token')
+            if time.monotonic() >= expires_at:
+                return error(401, 'The access token expired')
+
+    @app.route('/api/token', methods=['POST'])
+    def token():
+        if request.form.get('grant_type') != 'client_credentials':
+            return jsonify(error='unsupported_grant_type'), 400
+        access_token = secrets.token_urlsafe(32)
+        tokens[access_token] = time.monotonic() + app.config['TOKEN_TTL']
+        return jsonify(access_token=access_token, token_type='Bearer', expires_in=app.config['TOKEN_TTL'])
+
+    @app.route('/v1/search')
+    def search():
+        if not request.args.get('q'):
+            return error(400, 'No search query')
+        kind = request.args.get('type')
+        if kind not in ('track', 'artist'):
+            return error(400, 'Unsupported type')
+        key = f'{kind}s'
+        results = fixtures[f'search-{kind}.json'][key]
+        items = limited(results['items'])
+        return jsonify({key: dict(results, items=items, limit=len(items))})
+
+    @app.route('/v1/recommendations')
+    def recommendations():
+        if not (request.args.get('seed_tracks') or request.args.get('seed_genres')):
+            return error(400, 'No seeds provided')
+        return jsonify(dict(fixtures['recommendations.json'],
+                            tracks=limited(fixtures['recommendations.json']['tracks'])))
+
+    @app.route('/v1/artists/<artist_id>/top-tracks')
+    def artist_top_tracks(artist_id):
+        return jsonify(fixtures['artist-top-tracks.json'])
+
+    @app.route('/v1/tracks')
+    def several_tracks():
+        ids = [track_id for track_id in request.args.get('ids', '').split(',') if track_id]
+        if not ids:
+            return error(400, 'No ids provided')
+        if len(ids) > 50:
+            return error(400, 'Too many ids requested')
+        # Like Spotify, unknown ids get a null in their place
+        return jsonify(tracks=[catalog.get(track_id) for track_id in ids])
+
+    @app.route('/v1/playlists/<playlist_id>/tracks')
+    def playlist_tracks(playlist_id):
+        items = limited(fixtures['playlist-tracks.json']['items'], default=100)
+        return jsonify(dict(fixtures['playlist-tracks.json'], items=items, limit=len(items)))
+
+    return app
+
+
+def start_server(app, host='127.0.0.1', port=0):
+    """Serve app from a background thread. Returns the server (stop it with shutdown()) and its base URL."""
+
+    server = make_server(host, port, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}'
+
+
+def record(client_id, client_secret, fixtures_dir=FIXTURES_DIR, query='piano'):
+    """Replace the fixtures with the real API's responses to the requests the app makes."""
+
+    from spotify import SpotifyClient
+
+    client = SpotifyClient()
+    client.configure_auth('https://accounts.spotify.com/api/token', client_id, client_secret)
+    api = 'https://api.spotify.com/v1'
+
+    responses = {
+        'search-track.json': client.get(f'{api}/search', params={'q': query, 'type': 'track', 'limit': 20}),
+        'search-artist.json': client.get(f'{api}/search', params={'q': query, 'type': 'artist', 'limit': 20}),
+    }
+    track_id = responses['search-track.json']['tracks']['items'][0]['id']
+    artist_id = responses['search-artist.json']['artists']['items'][0]['id']
+    responses['artist-top-tracks.json'] = client.get(f'{api}/artists/{artist_id}/top-tracks',
+                                                     params={'market': 'us'})
+    responses['recommendations.json'] = client.get(f'{api}/recommendations',
+                                                   params={'seed_tracks': track_id, 'limit': 20, 'market': 'us'})
+    responses['playlist-tracks.json'] = client.get(f'{api}/playlists/{RECORDED_PLAYLIST}/tracks',
+                                                   params={'limit': 100, 'market': 'us'})
+
+    for name, data in responses.items():
+        if 'error' in data:
+            raise RuntimeError(f'recording {name} failed: {data["error"]}')
+        with open(os.path.join(fixtures_dir, name), 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline stand-in for the Spotify Web API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0, help='random milliseconds added or taken off the latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests failing with a 503')
+    parser.add_argument('--rate-limit', type=int, default=0, help='API requests a second before 429s (0: no limit)')
+    parser.add_argument('--token-ttl', type=int, default=3600, help='seconds before an access token expires')
+    parser.add_argument('--record', action='store_true', help='re-record the fixtures from the real API and exit')
+    args = parser.parse_args()
+
+    if args.record:
+        record(os.environ['SPOTIFY_CLIENT_ID'], os.environ['SPOTIFY_CLIENT_SECRET'])
+        print(f'recorded {len(FIXTURES)} fixtures in {FIXTURES_DIR}')
+    else:
+        standin = create_app(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                             rate_limit=args.rate_limit, token_ttl=args.token_ttl)
+        print(f'SPOTIFY_API_URL=http://{args.host}:{args.port}/v1 '
+              f'SPOTIFY_AUTH_URL=http://{args.host}:{args.port}/api/token')
+        make_server(args.host, args.port, standin, threaded=True).serve_forever()
@@ -9,12 +9,12 @@ let favoriteButton = document.getElementsByClassName("fa");
 for (var i = 0; i < favoriteButton.length; i++) {
     favoriteButton[i].onclick = (e) => {
 
-        console.log('hello')
-        e.currentTarget.classList.toggle("fa-heart-o")
-        e.currentTarget.classList.toggle("fa-heart")
+        let button = e.currentTarget
+        button.classList.toggle("fa-heart-o")
+        button.classList.toggle("fa-heart")
 
 
-        let trackId = e.currentTarget.id
+        let trackId = button.id
 
 
 
@@ -33,6 +33,11 @@ for (var i = 0; i < favoriteButton.length; i++) {
                 trackId
             })
         }).then(function (response) { // At this point, Flask has printed our JSON
+            // Nothing was saved (an unknown track, or Spotify is down), so put the heart back the way it was
+            if (!response.ok) {
+                button.classList.toggle("fa-heart-o")
+                button.classList.toggle("fa-heart")
+            }
             return response.text();
         }).then(function (text) {
 
@@ -43,8 +48,8 @@ for (var i = 0; i < favoriteButton.length; i++) {
 
 
         });
-        if (e.currentTarget.classList.contains('user-page')) {
-            e.currentTarget.parentElement.remove()
+        if (button.classList.contains('user-page')) {
+            button.parentElement.remove()
         }
     };
 }
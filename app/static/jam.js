@@ -1,32 +1,7 @@
 //jam.js file is linked to the following templates: spotify-player.html, spotify-player-drums.html
 //It's function is to control the audio and playability for the piano
 
-//define audio instances as global variables for each piano note
-let piano_a = new Audio('../../static/audio//piano/a5.wav')
-let piano_bb = new Audio('../../static/audio//piano/a-5.wav')
-let piano_b = new Audio('../../static/audio//piano/b5.wav')
-let piano_c = new Audio('../../static/audio//piano/c5.wav')
-let piano_csh = new Audio('../../static/audio//piano/c-5.wav')
-let piano_d = new Audio('../../static/audio//piano/d5.wav')
-let piano_eb = new Audio('../../static/audio//piano/d-5.wav')
-let piano_e = new Audio('../../static/audio//piano/e5.wav')
-let piano_f = new Audio('../../static/audio//piano/f4.wav')
-let piano_fsh = new Audio('../../static/audio//piano/f-4.wav')
-let piano_g = new Audio('../../static/audio//piano/g4.wav')
-let piano_gsh = new Audio('../../static/audio//piano/g-4.wav')
-
-piano_a.volume = 0;
-piano_bb.volume = 0;
-piano_b.volume = 0;
-piano_c.volume = 0;
-piano_csh.volume = 0;
-piano_d.volume = 0;
-piano_eb.volume = 0;
-piano_e.volume = 0;
-piano_f.volume = 0;
-piano_fsh.volume = 0;
-piano_g.volume = 0;
-piano_gsh.volume = 0;
+//the piano note players (piano_a, piano_bb, ... piano_gsh) are defined in piano.js, which plays them from the piano audio sprite
 
 
 //define global variables for user-interavtive page elements 
@@ -49,22 +24,6 @@ const dKey = document.getElementById('d');
 const csKey = document.getElementById('cs');
 const cKey = document.getElementById('c');
 
-//Define a song array that is comprised of music-note objects.This array will be read by browser upon first piano key click. It results in a chromatic scale.
-let BufferSong1 =
-    [{ 'noteName': 'piano_f.play()', 'time': 0 },
-    { 'noteName': 'piano_fsh.play()', 'time': 25 },
-    { 'noteName': 'piano_g.play()', 'time': 50 },
-    { 'noteName': 'piano_gsh.play()', 'time': 75 },
-    { 'noteName': 'piano_a.play()', 'time': 100 },
-    { 'noteName': 'piano_bb.play()', 'time': 125 },
-    { 'noteName': 'piano_b.play()', 'time': 150 },
-    { 'noteName': 'piano_c.play()', 'time': 175 },
-    { 'noteName': 'piano_csh.play()', 'time': 200 },
-    { 'noteName': 'piano_d.play()', 'time': 225 },
-    { 'noteName': 'piano_e.play()', 'time': 250 },
-    { 'noteName': 'piano_eb.play()', 'time': 275 },
-    { 'noteName': 'returnAudio()', 'time': 2500 }]
-
 
 
 //Initialize gobal varibles used to track conditions for audio playback
@@ -214,14 +173,6 @@ function returnAudio() {
 }
 
 
-//Function that is similar to "playSong", but instead it will only produce timeouts for the "buffer" song array.
-//This function results in the browser playing the audio of a chromatic scale
-function playBuffer1() {
-    for (let note in BufferSong1) {
-        setTimeout(BufferSong1[note].noteName, BufferSong1[note].time);
-    }
-    enableClickEvents();
-}
 
 //Click event listener set on the view-keyboard icon. Toggles the display for the an image that illustrates which keyboard keys are associated with which piano key.
 viewKeyboardIcon.addEventListener('click', () => {
@@ -287,15 +238,17 @@ function enableClickEvents() {
 
 
 //Keydown event listeners for each key that corresponds to a piano note element. If pressed, the "click" on that piano piano note element is simulated.
-//If no key has been pushed yet, the first push will result in "buffering", where the browser reads the buffer arrray to play the audio chomatic scale. 
-//The buffering is done to help the browser speed, where subsequently played notes will have the audio lag less.
+//If no key has been pushed yet, the first push will result in "buffering", where the piano audio sprite is loaded and the browser's audio is started.
+//The piano keys are enabled once every note can be played.
 window.addEventListener('keydown', function (e) {
 
     if (buffer === true) {
 
         jamCue.innerText = 'Buffering -- Just a Moment!'
-        playBuffer1()
-        setTimeout(() => { jamCue.innerText = '( Buffering Finished -- Click in browser window to jam along)' }, 2000)
+        loadPianoSprite().then(() => {
+            enableClickEvents()
+            jamCue.innerText = '( Buffering Finished -- Click in browser window to jam along)'
+        })
 
         buffer = false
 
@@ -0,0 +1,74 @@
+//piano.js file is linked (through piano-sprite.html) to the templates that load recording.js, playback.js or jam.js, ahead of them.
+//It's function is to load the piano audio sprite, one audio file holding every piano note, and define a player for each piano note.
+
+//The sprite manifest inlined in the page: the sprite's URL, and the start time and duration of each note in it (see audio_sprite.py)
+const pianoSprite = JSON.parse(document.getElementById('piano-sprite').textContent)
+const pianoContext = new (window.AudioContext || window.webkitAudioContext)()
+let pianoBuffer = null
+let pianoLoading = null
+
+
+//Function to fetch and decode the sprite (only once). The returned promise resolves when every note can be played.
+//Browsers keep audio suspended until the user interacts with the page, so call it from a click or keydown listener.
+function loadPianoSprite() {
+    if (pianoLoading === null) {
+        pianoLoading = fetch(pianoSprite.url)
+            .then(response => response.arrayBuffer())
+            .then(data => new Promise((resolve, reject) => pianoContext.decodeAudioData(data, resolve, reject)))
+            .then(decoded => { pianoBuffer = decoded })
+    }
+    return Promise.all([pianoLoading, pianoContext.resume()])
+}
+
+//Player for one note of the sprite, with the play(), pause(), currentTime and volume of the Audio element it replaces
+function PianoNote(name) {
+    this.start = pianoSprite.notes[name].start
+    this.duration = pianoSprite.notes[name].duration
+    this.currentTime = 0
+    this.source = null
+    this.gain = pianoContext.createGain()
+    this.gain.connect(pianoContext.destination)
+}
+
+PianoNote.prototype.play = function () {
+    if (pianoBuffer === null) {
+        return loadPianoSprite()
+    }
+    this.pause()
+    const offset = Math.min(this.currentTime, this.duration)
+    this.source = pianoContext.createBufferSource()
+    this.source.buffer = pianoBuffer
+    this.source.connect(this.gain)
+    this.source.start(0, this.start + offset, this.duration - offset)
+    return Promise.resolve()
+}
+
+PianoNote.prototype.pause = function () {
+    if (this.source !== null) {
+        this.source.stop()
+        this.source = null
+    }
+}
+
+Object.defineProperty(PianoNote.prototype, 'volume', {
+    get() { return this.gain.gain.value },
+    set(volume) { this.gain.gain.value = volume }
+})
+
+
+//define a player as a global variable for each piano note
+let piano_a = new PianoNote('piano_a')
+let piano_bb = new PianoNote('piano_bb')
+let piano_b = new PianoNote('piano_b')
+let piano_c = new PianoNote('piano_c')
+let piano_csh = new PianoNote('piano_csh')
+let piano_d = new PianoNote('piano_d')
+let piano_eb = new PianoNote('piano_eb')
+let piano_e = new PianoNote('piano_e')
+let piano_f = new PianoNote('piano_f')
+let piano_fsh = new PianoNote('piano_fsh')
+let piano_g = new PianoNote('piano_g')
+let piano_gsh = new PianoNote('piano_gsh')
+
+//Start downloading the sprite right away, so it is usually decoded by the time the user first plays a note
+loadPianoSprite()
@@ -1,63 +1,7 @@
 //playback.js file is linked to the following templates: home.html, user-profile.html
 //It's function is to control the playback audio of user-saved melodies.
 
-//define audio instances as global variables for each piano note
-let piano_a = new Audio('../../static/audio//piano/a5.wav')
-let piano_bb = new Audio('../../static/audio//piano/a-5.wav')
-let piano_b = new Audio('../../static/audio//piano/b5.wav')
-let piano_c = new Audio('../../static/audio//piano/c5.wav')
-let piano_csh = new Audio('../../static/audio//piano/c-5.wav')
-let piano_d = new Audio('../../static/audio//piano/d5.wav')
-let piano_eb = new Audio('../../static/audio//piano/d-5.wav')
-let piano_e = new Audio('../../static/audio//piano/e5.wav')
-let piano_f = new Audio('../../static/audio//piano/f4.wav')
-let piano_fsh = new Audio('../../static/audio//piano/f-4.wav')
-let piano_g = new Audio('../../static/audio//piano/g4.wav')
-let piano_gsh = new Audio('../../static/audio//piano/g-4.wav')
-
-piano_a.volume = 0;
-piano_bb.volume = 0;
-piano_b.volume = 0;
-piano_c.volume = 0;
-piano_csh.volume = 0;
-piano_d.volume = 0;
-piano_eb.volume = 0;
-piano_e.volume = 0;
-piano_f.volume = 0;
-piano_fsh.volume = 0;
-piano_g.volume = 0;
-piano_gsh.volume = 0;
-
-
-
-//Define two identical song arrays that are comprised of music-note objects.This array will be read by browser upon first piano key click. It results in a chromatic scale.
-let BufferSong1 =
-    [{ 'noteName': 'piano_f.play()', 'time': 0 },
-    { 'noteName': 'piano_fsh.play()', 'time': 25 },
-    { 'noteName': 'piano_g.play()', 'time': 50 },
-    { 'noteName': 'piano_gsh.play()', 'time': 75 },
-    { 'noteName': 'piano_a.play()', 'time': 100 },
-    { 'noteName': 'piano_bb.play()', 'time': 125 },
-    { 'noteName': 'piano_b.play()', 'time': 150 },
-    { 'noteName': 'piano_c.play()', 'time': 175 },
-    { 'noteName': 'piano_csh.play()', 'time': 200 },
-    { 'noteName': 'piano_d.play()', 'time': 225 },
-    { 'noteName': 'piano_e.play()', 'time': 250 },
-    { 'noteName': 'piano_eb.play()', 'time': 275 }, { 'noteName': 'stopAllAudio', 'time': 275 }]
-
-let BufferSong2 = [{ 'noteName': 'piano_f.play()', 'time': 0 },
-{ 'noteName': 'piano_fsh.play()', 'time': 25 },
-{ 'noteName': 'piano_g.play()', 'time': 50 },
-{ 'noteName': 'piano_gsh.play()', 'time': 75 },
-{ 'noteName': 'piano_a.play()', 'time': 100 },
-{ 'noteName': 'piano_bb.play()', 'time': 125 },
-{ 'noteName': 'piano_b.play()', 'time': 150 },
-{ 'noteName': 'piano_c.play()', 'time': 175 },
-{ 'noteName': 'piano_csh.play()', 'time': 200 },
-{ 'noteName': 'piano_d.play()', 'time': 225 },
-{ 'noteName': 'piano_e.play()', 'time': 250 },
-{ 'noteName': 'piano_eb.play()', 'time': 275 }, { 'noteName': 'stopAllAudio', 'time': 275 }]
-
+//the piano note players (piano_a, piano_bb, ... piano_gsh) are defined in piano.js, which plays them from the piano audio sprite
 
 
 //Initialize gobal varibles used to track conditions for audio playback
@@ -201,30 +145,11 @@ function togglePlayButton() {
 }
 
 
-//Functions that are similar to "playSong", but instead they will only produce timeouts for the "buffer" song array.
-//This function results in the browser playing the audio of a chromatic scale
-function playBuffer2() {
-    for (let note in BufferSong2) {
-        setTimeout(BufferSong2[note].noteName, BufferSong2[note].time);
-    }
-}
-
-function playBuffer1() {
-    for (let note in BufferSong1) {
-        setTimeout(BufferSong1[note].noteName, BufferSong1[note].time);
-    }
-}
-
-
-
-
-
 //Click event listener for all the play-recording buttons. This button is toggled between showing a play-symbol and a stop-symbol. 
-//When clicked the first time, the play-symbol changes to a stop-symbol, the song array text that's located on the target elements div is saved, the playSong function is called, 
+//When clicked the first time, the play-symbol changes to a stop-symbol, the melody's song array is fetched from the server, the playSong function is called, 
 //and a timeout is set to convert the stop-symbol back to a play-symbol when shortly after the last note of the song is played.
 //If clicked before a song has finsihed playing, all timeouts for note audio are cleared, all audio is paused, and the play-button reappears.
-//The first time any play-button is pushed will result in "buffering", where the browser reads a buffer arrray x3 to play the audio chomatic scale at 3 different timeouts. 
-//The buffering is done to help the browser speed, where subsequently played melodies will have the audio lag less.
+//The first time any play-button is pushed will result in "buffering", where the piano audio sprite is loaded and the browser's audio is started.
 for (let i = 0; i < playMelodyButton.length; i++) {
     playMelodyButton[i].onclick = (e) => {
 
@@ -232,11 +157,10 @@ for (let i = 0; i < playMelodyButton.length; i++) {
         if (buffer === true) {
             e.currentTarget.firstChild.src = "/static/images/buffering.png"
             bufferingAnnouncement.innerText = 'Buffering -- Just a Moment!'
-            playBuffer1()
-            setTimeout(playBuffer2, 3500)
-            setTimeout(playBuffer1, 6000)
-            setTimeout(togglePlayButton, 6000)
-            setTimeout(() => { bufferingAnnouncement.innerText = 'Buffering Finished. Please Click again' }, 6000)
+            loadPianoSprite().then(() => {
+                togglePlayButton()
+                bufferingAnnouncement.innerText = 'Buffering Finished. Please Click again'
+            })
             buffer = false
 
         }
@@ -260,18 +184,27 @@ for (let i = 0; i < playMelodyButton.length; i++) {
                 audioIsPlaying = true
                 e.currentTarget.firstChild.src = "/static/images/stop-button.png"
 
-                songData = e.currentTarget.nextElementSibling.textContent
-                song = songData.split("{'song': ").pop();
-                song = eval(song.slice(0, -1));
-                song.forEach(note => {
-                    note.noteName = eval(note.noteName)
-                })
-
-                const time = song[song.length - 1].time
-                playSong()
-
-                togglePlay = setTimeout(togglePlayButton, time + 1000)
-                timeouts.push(togglePlay)
+                //The melody's music-note objects are only fetched when it is played, instead of being inlined in the page for every melody.
+                //If the stop-button was clicked while they were being fetched, nothing is played.
+                fetch(`/melodies/${e.currentTarget.dataset.melodyId}/notes`)
+                    .then(response => response.json())
+                    .then(data => {
+                        if (audioIsPlaying === false || !data.song || data.song.length === 0) {
+                            togglePlayButton()
+                            return
+                        }
+
+                        song = data.song
+                        song.forEach(note => {
+                            note.noteName = window[note.noteName]
+                        })
+
+                        const time = song[song.length - 1].time
+                        playSong()
+
+                        togglePlay = setTimeout(togglePlayButton, time + 1000)
+                        timeouts.push(togglePlay)
+                    })
             }
         }
     }
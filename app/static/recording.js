@@ -1,33 +1,7 @@
 //recording.js file is linked to the instrument.html template. 
 //It's function is to control the audio and playability for the piano, along with recording, playing back, and saving melodies created by the user.
 
-//define audio instances as global variables for each piano note
-let piano_a = new Audio('../../static/audio//piano/a5.wav')
-let piano_bb = new Audio('../../static/audio//piano/a-5.wav')
-let piano_b = new Audio('../../static/audio//piano/b5.wav')
-let piano_c = new Audio('../../static/audio//piano/c5.wav')
-let piano_csh = new Audio('../../static/audio//piano/c-5.wav')
-let piano_d = new Audio('../../static/audio//piano/d5.wav')
-let piano_eb = new Audio('../../static/audio//piano/d-5.wav')
-let piano_e = new Audio('../../static/audio//piano/e5.wav')
-let piano_f = new Audio('../../static/audio//piano/f4.wav')
-let piano_fsh = new Audio('../../static/audio//piano/f-4.wav')
-let piano_g = new Audio('../../static/audio//piano/g4.wav')
-let piano_gsh = new Audio('../../static/audio//piano/g-4.wav')
-
-piano_a.volume = 0;
-piano_bb.volume = 0;
-piano_b.volume = 0;
-piano_c.volume = 0;
-piano_csh.volume = 0;
-piano_d.volume = 0;
-piano_eb.volume = 0;
-piano_e.volume = 0;
-piano_f.volume = 0;
-piano_fsh.volume = 0;
-piano_g.volume = 0;
-piano_gsh.volume = 0;
-
+//the piano note players (piano_a, piano_bb, ... piano_gsh) are defined in piano.js, which plays them from the piano audio sprite
 
 
 //define global variables for user-interavtive page elements 
@@ -72,23 +46,6 @@ let timeouts = []
 let audioIsPlaying = false
 let buffer = true
 
-//Define a song array that is comprised of music-note objects.This array will be read by browser upon first piano key click. It results in a chromatic scale.
-let BufferSong1 =
-    [{ 'noteName': 'piano_f.play()', 'time': 0 },
-    { 'noteName': 'piano_fsh.play()', 'time': 25 },
-    { 'noteName': 'piano_g.play()', 'time': 50 },
-    { 'noteName': 'piano_gsh.play()', 'time': 75 },
-    { 'noteName': 'piano_a.play()', 'time': 100 },
-    { 'noteName': 'piano_bb.play()', 'time': 125 },
-    { 'noteName': 'piano_b.play()', 'time': 150 },
-    { 'noteName': 'piano_c.play()', 'time': 175 },
-    { 'noteName': 'piano_csh.play()', 'time': 200 },
-    { 'noteName': 'piano_d.play()', 'time': 225 },
-    { 'noteName': 'piano_e.play()', 'time': 250 },
-    { 'noteName': 'piano_eb.play()', 'time': 275 },
-    { 'noteName': 'returnAudio()', 'time': 2500 }
-    ]
-
 
 //functions for animating/playing the audio for each piano key after clicked by a user, or when called from a music-note object
 function playPiano_a() {
@@ -273,14 +230,6 @@ function togglePlayButton() {
     audioIsPlaying = false
 }
 
-//Function that is similar to "playSong", but instead it will only produce timeouts for the "buffer" song array.
-//This function results in the browser playing the audio of a chromatic scale
-function playBuffer1() {
-    for (let note in BufferSong1) {
-        setTimeout(BufferSong1[note].noteName, BufferSong1[note].time);
-    }
-    enableClickEvents();
-}
 
 
 
@@ -500,8 +449,8 @@ function enableClickEvents() {
 
 
 //Keydown event listeners for each key that corresponds to a piano note element. If pressed, the "click" on that piano piano note element is simulated.
-//If no key has been pushed yet, the first push will result in "buffering", where the browser reads the buffer arrray to play the audio chomatic scale. 
-//The buffering is done to help the browser speed, where subsequently played notes will have the audio lag less.
+//If no key has been pushed yet, the first push will result in "buffering", where the piano audio sprite is loaded and the browser's audio is started.
+//The piano keys are enabled once every note can be played.
 
 window.addEventListener('keydown', function (e) {
 
@@ -509,10 +458,11 @@ window.addEventListener('keydown', function (e) {
     if (buffer === true) {
         startRecordButton.firstChild.src = "/static/images/buffering.png"
         pageHeader.innerText = 'Buffering -- Just a Moment!'
-        playBuffer1()
-
-        setTimeout(() => { pageHeader.innerText = 'Make A Melody' }, 2000)
-        setTimeout(() => { startRecordButton.firstChild.src = "/static/images/record-button.png" }, 2000)
+        loadPianoSprite().then(() => {
+            enableClickEvents()
+            pageHeader.innerText = 'Make A Melody'
+            startRecordButton.firstChild.src = "/static/images/record-button.png"
+        })
 
         buffer = false
 
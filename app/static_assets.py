@@ -0,0 +1,119 @@
+"""Fingerprinted, precompressed copies of the files under static/, for serving with far-future caching.
+
+Build (or rebuild) the assets like:
+
+    python static_assets.py
+
+Each file is copied to static/build/ with a hash of its content in its name (stylesheets/style.css becomes
+stylesheets/style.<hash>.css), and text assets get a gzipped .gz copy next to it. /static/ paths in stylesheets are
+rewritten to the fingerprinted paths. static/build/manifest.json maps each original path to its fingerprinted one;
+templates turn paths into URLs with static_url(). Copies from earlier builds are kept, so pages rendered before a
+rebuild can still load them.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BUILD_DIR_NAME = 'build'
+ASSETS_URL = '/assets/'
+
+# Directories under static/ that aren't fingerprinted: the build output itself, and the piano audio, which is served
+# as one sprite (see audio_sprite.py)
+SKIP_DIRS = {BUILD_DIR_NAME, 'audio'}
+
+# Extensions of files worth gzipping; images and audio are compressed already
+COMPRESSIBLE = {'.js', '.css', '.json', '.svg', '.txt', '.ttf', '.otf'}
+
+STATIC_REFERENCE = re.compile(r'''url\((['"]?)/static/([^'")]+)\1\)''')
+
+
+def manifest_path(static_dir=STATIC_DIR):
+    return os.path.join(static_dir, BUILD_DIR_NAME, 'manifest.json')
+
+
+def source_files(static_dir=STATIC_DIR):
+    """Paths, relative to static_dir and with / separators, of the files to fingerprint."""
+
+    paths = []
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir:
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for filename in files:
+            paths.append(os.path.relpath(os.path.join(root, filename), static_dir).replace(os.sep, '/'))
+    return sorted(paths)
+
+
+def fingerprinted(path, data):
+    base, ext = os.path.splitext(path)
+    return f'{base}.{hashlib.sha1(data).hexdigest()[:12]}{ext}'
+
+
+def write_atomic(path, data):
+    """Write data to path through a temporary file, so workers building the assets at once never read a partial file."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_assets(static_dir=STATIC_DIR):
+    """Write the fingerprinted (and, for text assets, gzipped) copy of every static file and the manifest.
+
+    Stylesheets are done last, so /static/ paths in their url()s can be rewritten to fingerprinted paths.
+    Returns the manifest.
+    """
+
+    build_dir = os.path.join(static_dir, BUILD_DIR_NAME)
+    paths = source_files(static_dir)
+    manifest = {}
+
+    def rewrite(match):
+        path = manifest.get(match.group(2))
+        if path is None:
+            return match.group(0)
+        return f'url({match.group(1)}{ASSETS_URL}{path}{match.group(1)})'
+
+    for path in sorted(paths, key=lambda path: path.endswith('.css')):
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            data = f.read()
+        if path.endswith('.css'):
+            data = STATIC_REFERENCE.sub(rewrite, data.decode('utf-8')).encode('utf-8')
+
+        manifest[path] = fingerprinted(path, data)
+        target = os.path.join(build_dir, manifest[path])
+        if not os.path.exists(target):
+            write_atomic(target, data)
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE and not os.path.exists(f'{target}.gz'):
+            write_atomic(f'{target}.gz', gzip.compress(data, compresslevel=9, mtime=0))
+
+    write_atomic(manifest_path(static_dir), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_assets(static_dir=STATIC_DIR):
+    """Return the asset manifest, rebuilding the assets first if any static file is newer than the manifest (or
+    if they haven't been built)."""
+
+    try:
+        built = os.path.getmtime(manifest_path(static_dir))
+        with open(manifest_path(static_dir)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return build_assets(static_dir)
+
+    paths = source_files(static_dir)
+    if (set(paths) != set(manifest)
+            or any(os.path.getmtime(os.path.join(static_dir, path)) > built for path in paths)):
+        return build_assets(static_dir)
+    return manifest
+
+
+if __name__ == '__main__':
+    manifest = build_assets()
+    print(f'built {len(manifest)} assets in {os.path.join(STATIC_DIR, BUILD_DIR_NAME)}')
@@ -0,0 +1,83 @@
+"""Piano audio sprite tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_audio_sprite.py
+
+
+from unittest import TestCase
+from audio_sprite import build_sprite, load_sprite, PIANO_NOTES, AUDIO_DIR, SPRITE_URL
+
+import os
+import shutil
+import tempfile
+import wave
+
+
+class AudioSpriteTestCase(TestCase):
+    """Test building the piano audio sprite and its manifest."""
+
+    def setUp(self):
+        self.audio_dir = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(AUDIO_DIR, 'piano'), os.path.join(self.audio_dir, 'piano'))
+
+    def tearDown(self):
+        shutil.rmtree(self.audio_dir)
+
+    def sprite_path(self, manifest):
+        return os.path.join(self.audio_dir, manifest['url'][len(SPRITE_URL):])
+
+    def test_build(self):
+        """Does the sprite hold every note, back to back, where the manifest says?"""
+
+        manifest = build_sprite(self.audio_dir)
+
+        with wave.open(self.sprite_path(manifest), 'rb') as sprite:
+            rate = sprite.getframerate()
+            self.assertEqual(sprite.getnframes(), sum(
+                wave.open(os.path.join(self.audio_dir, 'piano', filename)).getnframes()
+                for filename in PIANO_NOTES.values()))
+            frames = sprite.readframes(sprite.getnframes())
+
+        self.assertEqual(list(manifest['notes']), list(PIANO_NOTES))
+        note = manifest['notes']['piano_g']
+        with wave.open(os.path.join(self.audio_dir, 'piano', 'g4.wav'), 'rb') as g:
+            width = g.getsampwidth() * g.getnchannels()
+            start = round(note['start'] * rate) * width
+            self.assertEqual(frames[start:start + round(note['duration'] * rate) * width],
+                             g.readframes(g.getnframes()))
+
+    def test_content_hash(self):
+        """Does the sprite's name change with its content, replacing the old sprite?"""
+
+        first = build_sprite(self.audio_dir)
+        self.assertEqual(build_sprite(self.audio_dir)['url'], first['url'])
+
+        shutil.copy(os.path.join(self.audio_dir, 'piano', 'a5.wav'), os.path.join(self.audio_dir, 'piano', 'b5.wav'))
+        second = build_sprite(self.audio_dir)
+
+        self.assertNotEqual(second['url'], first['url'])
+        self.assertFalse(os.path.exists(self.sprite_path(first)))
+        self.assertTrue(os.path.exists(self.sprite_path(second)))
+
+    def test_load(self):
+        """Is the sprite built when loaded for the first time, and rebuilt if its file went missing?"""
+
+        manifest = load_sprite(self.audio_dir)
+        self.assertEqual(load_sprite(self.audio_dir), manifest)
+
+        os.remove(self.sprite_path(manifest))
+        self.assertEqual(load_sprite(self.audio_dir), manifest)
+        self.assertTrue(os.path.exists(self.sprite_path(manifest)))
+
+    def test_mismatched_notes(self):
+        """Is a note recorded in a different format rejected?"""
+
+        with wave.open(os.path.join(self.audio_dir, 'piano', 'c5.wav'), 'wb') as note:
+            note.setnchannels(1)
+            note.setsampwidth(2)
+            note.setframerate(22050)
+            note.writeframes(b'\0\0' * 100)
+
+        with self.assertRaises(ValueError):
+            build_sprite(self.audio_dir)
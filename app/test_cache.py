@@ -0,0 +1,114 @@
+"""In-process cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+from threading import Event
+from cache import TTLCache, PeriodicRefresh
+
+import time
+
+
+class TTLCacheTestCase(TestCase):
+    """Test the TTL + LRU cache."""
+
+    def test_hit_and_miss(self):
+        """Are hits and misses counted?"""
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted when the cache is full?"""
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expiry(self):
+        """Do entries expire after their ttl?"""
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        with patch('cache.time.monotonic', return_value=0):
+            cache.set('a', 1, ttl=5)
+        with patch('cache.time.monotonic', return_value=4):
+            self.assertEqual(cache.get('a'), 1)
+        with patch('cache.time.monotonic', return_value=6):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_memoize(self):
+        """Does a memoized function only run once per set of arguments, and can the cache be bypassed?"""
+
+        cache = TTLCache()
+        calls = []
+
+        @cache.memoize(ttl=60)
+        def recommendations(track_id, limit):
+            calls.append(track_id)
+            return [track_id] * limit
+
+        self.assertEqual(recommendations('abc', limit=2), ['abc', 'abc'])
+        self.assertEqual(recommendations('abc', limit=2), ['abc', 'abc'])
+        self.assertEqual(len(calls), 1)
+
+        recommendations.uncached('abc', limit=2)
+        self.assertEqual(len(calls), 2)
+
+        cache.enabled = False
+        recommendations('abc', limit=2)
+        self.assertEqual(len(calls), 3)
+
+
+class PeriodicRefreshTestCase(TestCase):
+    """Test the background-refreshed value holder."""
+
+    def test_value_loaded_in_background(self):
+        """Is the value served from memory once the background load finishes, without readers waiting on it?"""
+
+        release = Event()
+        loaded = Event()
+
+        def load():
+            release.wait(2)
+            loaded.set()
+            return ['track']
+
+        starter = PeriodicRefresh(load, interval=60)
+        self.assertEqual(starter.get([]), [])
+
+        release.set()
+        self.assertTrue(loaded.wait(2))
+        for i in range(100):
+            if starter.value is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(starter.get([]), ['track'])
+
+    def test_failed_load_keeps_default(self):
+        """Does a failing load leave readers with the default value?"""
+
+        called = Event()
+
+        def load():
+            called.set()
+            raise ConnectionError
+
+        starter = PeriodicRefresh(load, retry_interval=60)
+        starter.start()
+        self.assertTrue(called.wait(2))
+        self.assertIsNone(starter.get())
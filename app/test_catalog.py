@@ -0,0 +1,91 @@
+"""Track catalog tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_catalog.py
+
+
+from unittest import TestCase
+from flask import Flask
+from datetime import datetime, timedelta
+from models import db, User, Favorited_Track, User_Favorited_Track, Catalog_Track, Track_Recommendation
+
+
+def track(track_id, name, artist='Artist', album='Album'):
+    return {'track_id': track_id, 'track_name': name, 'artist_name': artist, 'artist_id': f'a-{artist}',
+            'album_name': album, 'album_image': f'{track_id}.png'}
+
+
+class CatalogTestCase(TestCase):
+    """Test the track catalog and stored recommendations, on SQLite."""
+
+    def setUp(self):
+        self.db_app = Flask(__name__)
+        self.db_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.db_app)
+        self.ctx = self.db_app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_upsert(self):
+        """Are new tracks added and known ones refreshed, in a single statement even with repeats?"""
+
+        Catalog_Track.upsert_many([track('s1', 'Old Name'), track('s2', 'Second')])
+        Catalog_Track.upsert_many([track('s1', 'New Name', album='Remaster'), track('s3', 'Third'),
+                                   track('s3', 'Third')])
+        db.session.commit()
+
+        self.assertEqual(Catalog_Track.query.count(), 3)
+        self.assertEqual(Catalog_Track.lookup('s1'), track('s1', 'New Name', album='Remaster'))
+        self.assertIsNone(Catalog_Track.lookup('missing'))
+        self.assertEqual([t['track_id'] for t in Catalog_Track.lookup_many(['s3', 'missing', 's1'])], ['s3', 's1'])
+
+    def test_recommendations(self):
+        """Are stored recommendations returned while fresh enough, and always without a max_age?"""
+
+        tracks = [track('s1', 'First'), track('s2', 'Second')]
+        Catalog_Track.upsert_many(tracks)
+        Track_Recommendation.save('seed', tracks)
+        db.session.commit()
+
+        self.assertEqual(Track_Recommendation.for_seed('seed', max_age=60), tracks)
+        self.assertIsNone(Track_Recommendation.for_seed('other'))
+
+        Track_Recommendation.query.update({'updated_at': datetime.utcnow() - timedelta(hours=1)})
+        self.assertIsNone(Track_Recommendation.for_seed('seed', max_age=60))
+        self.assertEqual(Track_Recommendation.for_seed('seed'), tracks)
+
+        Track_Recommendation.save('seed', tracks[1:])
+        self.assertEqual(Track_Recommendation.for_seed('seed', max_age=60), tracks[1:])
+
+    def test_favorites_read_from_catalog(self):
+        """Do a user's favorites show the catalog's metadata, and their own where the catalog lacks the track?"""
+
+        db.session.add(User(id=1, username='phoenix', password='HASHED_PASSWORD'))
+        User_Favorited_Track.add(1, 's1', track('s1', 'Favorited Name'))
+        User_Favorited_Track.add(1, 's2', track('s2', 'Not In Catalog', album='Album Two'))
+        Catalog_Track.upsert_many([track('s1', 'Catalog Name')])
+        db.session.commit()
+
+        tracks, older = Favorited_Track.for_user(1)
+        self.assertIsNone(older)
+        self.assertEqual([(t.spotify_track_id, t.track_name, t.album_name) for t in tracks],
+                         [('s2', 'Not In Catalog', 'Album Two'), ('s1', 'Catalog Name', 'Album')])
+
+    def test_add_favorite(self):
+        """Does adding a favorite report whether it was saved, including when it already was?"""
+
+        db.session.add(User(id=1, username='phoenix', password='HASHED_PASSWORD'))
+        db.session.commit()
+
+        self.assertFalse(User_Favorited_Track.add(1, 'unknown'))
+        self.assertTrue(User_Favorited_Track.add(1, 's1', track('s1', 'First')))
+        self.assertTrue(User_Favorited_Track.add(1, 's1'))
+        db.session.commit()
+
+        self.assertEqual(Favorited_Track.spotify_ids_for_user(1), ['s1'])
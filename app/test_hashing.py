@@ -0,0 +1,54 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+
+from unittest import TestCase
+from threading import Event, Thread
+from hashing import PasswordHasher, HashingOverloaded
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the bcrypt password hasher and its bounded pool."""
+
+    def test_hash_and_check(self):
+        """Does a password check against its own hash, and only its own?"""
+
+        hasher = PasswordHasher(rounds=4)
+        hashed = hasher.hash('HASHED_PASSWORD')
+
+        self.assertTrue(hashed.startswith('$2b$04$'))
+        self.assertTrue(hasher.check(hashed, 'HASHED_PASSWORD'))
+        self.assertFalse(hasher.check(hashed, 'WRONG_PASSWORD'))
+
+    def test_needs_rehash(self):
+        """Is a hash made at another cost flagged for rehashing?"""
+
+        old = PasswordHasher(rounds=4).hash('HASHED_PASSWORD')
+
+        self.assertFalse(PasswordHasher(rounds=4).needs_rehash(old))
+        self.assertTrue(PasswordHasher(rounds=5).needs_rehash(old))
+        self.assertTrue(PasswordHasher(rounds=5).needs_rehash('not a hash'))
+
+    def test_sheds_load(self):
+        """Is a hash turned away when the queue is full, and accepted again once it drains?"""
+
+        hasher = PasswordHasher(rounds=4, workers=1, max_pending=1)
+        started, release = Event(), Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+
+        busy = Thread(target=hasher._run, args=(slow,))
+        busy.start()
+        started.wait(5)
+
+        with self.assertRaises(HashingOverloaded):
+            hasher.hash('HASHED_PASSWORD')
+
+        release.set()
+        busy.join()
+        self.assertTrue(hasher.check(hasher.hash('HASHED_PASSWORD'), 'HASHED_PASSWORD'))
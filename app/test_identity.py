@@ -0,0 +1,58 @@
+"""Current user stand-in tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_identity.py
+
+
+from unittest import TestCase
+from flask import Flask
+from models import db, User
+from identity import CurrentUser
+from cache import TTLCache
+
+
+class CurrentUserTestCase(TestCase):
+    """Test the lazy g.user stand-in, on SQLite."""
+
+    def setUp(self):
+        self.db_app = Flask(__name__)
+        self.db_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.db_app)
+        self.ctx = self.db_app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        db.session.add(User(id=1, username='phoenix', password='HASHED_PASSWORD'))
+        db.session.commit()
+        self.cache = TTLCache()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_cached_identity(self):
+        """Are the id and cached fields answered without loading the users row?"""
+
+        CurrentUser(1, self.cache).password
+        user = CurrentUser(1, self.cache)
+
+        self.assertTrue(user)
+        self.assertEqual((user.id, user.username), (1, 'phoenix'))
+        self.assertIsNone(user._user)
+
+    def test_deleted_user(self):
+        """Is the stand-in of a deleted user falsy, with on_missing called once?"""
+
+        missing = []
+        User.query.delete()
+        db.session.commit()
+        user = CurrentUser(1, self.cache, on_missing=lambda: missing.append(1))
+
+        self.assertFalse(user)
+        self.assertFalse(user)
+        self.assertEqual(user.id, 1)
+        with self.assertRaises(AttributeError):
+            user.username
+        self.assertEqual(missing, [1])
@@ -0,0 +1,137 @@
+"""Melody rendering tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_melody_audio.py
+
+
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from melody_audio import MelodyRenderer, SAMPLE_SKIP, np
+from models import encode_notes, decode_notes, NOTE_NAMES
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import wave
+
+
+class FakeMelody:
+    def __init__(self, id, notes):
+        self.id = id
+        self.music_notes = encode_notes(notes)
+
+    def notes(self):
+        return decode_notes(self.music_notes)
+
+
+def read_wav(data):
+    with wave.open(io.BytesIO(data), 'rb') as wav:
+        frames = np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2')
+        return frames.reshape(-1, wav.getnchannels()).astype(np.int64), wav.getframerate()
+
+
+@skipIf(np is None, 'numpy is not installed')
+class MelodyRendererTestCase(TestCase):
+    """Test mixing melodies to WAV files and the render cache."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.renderer = MelodyRenderer(self.cache_dir)
+        bank, offsets, lengths, channels, self.rate = self.renderer._load_samples()
+        self.skip = int(SAMPLE_SKIP * self.rate)
+        self.samples = {name: bank[offsets[name]:offsets[name] + lengths[name] * channels]
+                        .reshape(-1, channels).astype(np.int64)
+                        for name in offsets}
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def expected(self, notes):
+        """Mix notes one at a time, the slow way."""
+
+        starts = {}
+        for note in sorted(notes, key=lambda note: note['time']):
+            starts.setdefault(note['noteName'].replace('playPiano_', 'piano_'), []).append(note['time'] * self.rate // 1000)
+        parts = []
+        for name, times in starts.items():
+            for i, start in enumerate(times):
+                sample = self.samples[name][self.skip:]
+                if i + 1 < len(times):
+                    sample = sample[:times[i + 1] - start]
+                parts.append((start, sample))
+        out = np.zeros((max(start + len(sample) for start, sample in parts), 2), dtype=np.int64)
+        for start, sample in parts:
+            out[start:start + len(sample)] += sample
+        return np.clip(out, -32768, 32767)
+
+    def test_single_note(self):
+        """Is a single note its piano sample, from SAMPLE_SKIP seconds in?"""
+
+        frames, rate = read_wav(self.renderer.render([{'noteName': 'playPiano_c', 'time': 0}]))
+
+        self.assertEqual(rate, self.rate)
+        self.assertTrue(np.array_equal(frames, self.samples['piano_c'][self.skip:]))
+
+    def test_repeated_note(self):
+        """Is a note cut short when the same note is played again?"""
+
+        notes = [{'noteName': 'playPiano_c', 'time': 0}, {'noteName': 'playPiano_c', 'time': 100}]
+        frames, rate = read_wav(self.renderer.render(notes))
+
+        self.assertEqual(len(frames), self.rate // 10 + len(self.samples['piano_c']) - self.skip)
+        self.assertTrue(np.array_equal(frames, self.expected(notes)))
+
+    def test_mix(self):
+        """Does a long melody mix to the same audio as mixing one note at a time?"""
+
+        rand = random.Random(0)
+        notes = [{'noteName': rand.choice(NOTE_NAMES), 'time': rand.randint(0, 20000)} for i in range(150)]
+        frames, rate = read_wav(self.renderer.render(notes))
+
+        self.assertTrue(np.array_equal(frames, self.expected(notes)))
+
+    def test_empty(self):
+        """Does a melody without notes render to an empty WAV file?"""
+
+        frames, rate = read_wav(self.renderer.render([]))
+
+        self.assertEqual(len(frames), 0)
+
+    def test_cache(self):
+        """Is a melody rendered once, and its file removed when it is forgotten?"""
+
+        melody = FakeMelody(7, [{'noteName': 'playPiano_a', 'time': 0}, {'noteName': 'playPiano_b', 'time': 250}])
+
+        with patch.object(self.renderer, 'render', wraps=self.renderer.render) as render:
+            path = self.renderer.path_for(melody)
+            self.assertEqual(self.renderer.path_for(melody), path)
+            self.assertEqual(render.call_count, 1)
+
+        with open(path, 'rb') as f:
+            self.assertTrue(np.array_equal(read_wav(f.read())[0], self.expected(melody.notes())))
+
+        self.renderer.forget(7)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_rerender_replaces_old_file(self):
+        """Is an edited melody's earlier render only removed once the new one is in place?"""
+
+        melody = FakeMelody(7, [{'noteName': 'playPiano_a', 'time': 0}])
+        old_path = self.renderer.path_for(melody)
+        melody.music_notes = encode_notes([{'noteName': 'playPiano_b', 'time': 0}])
+        new_path = os.path.join(self.cache_dir, f'7-{self.renderer.cache_key(melody)}.wav')
+
+        forget = self.renderer.forget
+        def check_forget(melody_id, keep=None):
+            self.assertTrue(os.path.exists(new_path))
+            self.assertTrue(os.path.exists(old_path))
+            forget(melody_id, keep)
+
+        with patch.object(self.renderer, 'forget', side_effect=check_forget) as forgotten:
+            self.assertEqual(self.renderer.path_for(melody), new_path)
+            self.assertEqual(forgotten.call_count, 1)
+
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(new_path)])
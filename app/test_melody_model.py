@@ -183,3 +183,28 @@ class MelodyModelTestCase(TestCase):
 
             # No melodies should be in table after user is deleted
             self.assertEqual(len(Melody.query.all()), 0)
+
+    def test_shared_pagination(self):
+        """Are shared melodies paged newest first, with a cursor for the next page?"""
+        with app.app_context():
+            u = User(
+                username="testuser",
+                password="HASHED_PASSWORD"
+            )
+
+            db.session.add(u)
+            db.session.commit()
+
+            melodies = [Melody(user_id=u.id, name=f"test{i}", timestamp="1/18/22 10:40",
+                               music_notes="sample notes", visibility=i % 2 == 0) for i in range(10)]
+            db.session.add_all(melodies)
+            db.session.commit()
+
+            page1, cursor = Melody.shared(per_page=3)
+            self.assertEqual([mel.name for mel in page1],
+                             ["test8", "test6", "test4"])
+            self.assertEqual(cursor, melodies[4].id)
+
+            page2, cursor = Melody.shared(before=cursor, per_page=3)
+            self.assertEqual([mel.name for mel in page2], ["test2", "test0"])
+            self.assertIsNone(cursor)
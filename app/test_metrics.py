@@ -0,0 +1,119 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+from unittest import TestCase
+from metrics import Metrics, QueryStats, track_queries, format_labels
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from threading import Thread
+
+import json
+import os
+import shutil
+import tempfile
+
+
+class MetricsTestCase(TestCase):
+    """Test recording histograms, merging the files of several workers and the Prometheus output."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.metrics = Metrics(self.dir)
+        self.metrics.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_render(self):
+        """Are observations counted in every bucket they fit in, with a sum and a count?"""
+
+        self.metrics.observe('latency_seconds', 0.05, endpoint='home')
+        self.metrics.observe('latency_seconds', 0.5, endpoint='home')
+        self.metrics.observe('latency_seconds', 5, endpoint='home')
+
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines, [
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{endpoint="home",le="0.1"} 1',
+            'latency_seconds_bucket{endpoint="home",le="1.0"} 2',
+            'latency_seconds_bucket{endpoint="home",le="+Inf"} 3',
+            'latency_seconds_sum{endpoint="home"} 5.55',
+            'latency_seconds_count{endpoint="home"} 3',
+        ])
+
+    def test_workers_are_merged(self):
+        """Are the files of the other workers of the same server added up, and those of other servers left out?"""
+
+        self.metrics.observe('latency_seconds', 0.05, endpoint='home')
+        sibling = [['latency_seconds', [['endpoint', 'home']], [0, 1], 0.5, 1]]
+        with open(os.path.join(self.dir, f'metrics-{os.getppid()}-999999.json'), 'w') as f:
+            json.dump(sibling, f)
+        with open(os.path.join(self.dir, 'metrics-1-999999.json'), 'w') as f:
+            json.dump(sibling, f)
+
+        series = self.metrics.collect()
+        self.assertEqual(series[('latency_seconds', (('endpoint', 'home'),))], [[1, 2], 0.55, 2])
+
+    def test_forked_worker_starts_empty(self):
+        """Does a process forked after observations were recorded start counting from zero?"""
+
+        self.metrics.observe('latency_seconds', 0.05, endpoint='home')
+        self.metrics._pid = -1
+        self.metrics.observe('latency_seconds', 0.05, endpoint='home')
+
+        self.assertEqual(self.metrics.collect()[('latency_seconds', (('endpoint', 'home'),))][2], 1)
+
+    def test_concurrent_flushes(self):
+        """Do threads observing and flushing at once always leave a complete file, with every observation in it?"""
+
+        def work():
+            for i in range(200):
+                self.metrics.observe('latency_seconds', 0.05, endpoint='home')
+                self.metrics.flush(force=i % 2 == 0)
+                self.metrics.collect()
+
+        threads = [Thread(target=work) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(self.metrics._path(os.getpid())) as f:
+            json.load(f)
+        self.assertEqual(self.metrics.collect()[('latency_seconds', (('endpoint', 'home'),))][2], 1600)
+
+    def test_label_escaping(self):
+        """Are quotes, backslashes and newlines in label values escaped?"""
+
+        self.assertEqual(format_labels((('path', 'a"b\\c\nd'),)), '{path="a\\"b\\\\c\\nd"}')
+        self.assertEqual(format_labels(()), '')
+
+
+class QueryStatsTestCase(TestCase):
+    """Test counting and timing queries through engine events."""
+
+    def test_queries_counted(self):
+        """Are successful and failed queries counted, and their time added up?"""
+
+        engine = create_engine('sqlite://')
+        stats = QueryStats()
+        track_queries(engine, stats)
+
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            conn.execute(text('SELECT 2'))
+            self.assertEqual(stats.count, 2)
+            self.assertGreater(stats.seconds, 0)
+
+            with self.assertRaises(OperationalError):
+                conn.execute(text('SELECT * FROM missing'))
+            self.assertEqual(conn.info['query_started'], [])
+
+        stats.reset()
+        self.assertEqual((stats.count, stats.seconds), (0, 0.0))
@@ -0,0 +1,107 @@
+"""Compact melody encoding tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_music_notes.py
+
+
+from unittest import TestCase
+from contextlib import redirect_stdout
+from io import StringIO
+from flask import Flask
+from models import db, User, Melody, encode_notes, decode_notes, NOTE_NAMES
+from migrations import migrate_music_notes
+
+
+class MusicNotesTestCase(TestCase):
+    """Test encoding and decoding of melody notes."""
+
+    def test_round_trip(self):
+        """Does a melody decode to the notes it was encoded from?"""
+
+        notes = [{'noteName': name, 'time': i * 137} for i, name in enumerate(NOTE_NAMES)]
+        notes.append({'noteName': 'playPiano_a', 'time': 600000})
+
+        self.assertEqual(decode_notes(encode_notes(notes)), notes)
+
+    def test_compact(self):
+        """Is the encoding much smaller than the legacy repr?"""
+
+        notes = [{'noteName': 'playPiano_c', 'time': i * 250} for i in range(100)]
+        legacy = str({'song': notes})
+
+        self.assertLess(len(encode_notes(notes)) * 5, len(legacy))
+
+    def test_unordered_notes(self):
+        """Are notes stored in time order?"""
+
+        notes = [{'noteName': 'playPiano_c', 'time': 500}, {'noteName': 'playPiano_d', 'time': 100}]
+
+        self.assertEqual(decode_notes(encode_notes(notes)), [notes[1], notes[0]])
+
+    def test_unknown_note(self):
+        """Is a note that isn't a piano note rejected?"""
+
+        with self.assertRaises(ValueError):
+            encode_notes([{'noteName': 'alert', 'time': 0}])
+
+    def test_legacy(self):
+        """Are melodies stored in the legacy format still decoded?"""
+
+        legacy = "{'song': [{'noteName': 'playPiano_a', 'time': 0}, {'noteName': 'playPiano_b', 'time': 250}]}"
+
+        self.assertEqual(decode_notes(legacy), [{'noteName': 'playPiano_a', 'time': 0},
+                                                {'noteName': 'playPiano_b', 'time': 250}])
+
+    def test_invalid(self):
+        """Does anything that isn't a recorded melody decode to no notes?"""
+
+        for music_notes in [' ', '-', 'sample notes', encode_notes([]), 'AQ==', '{1: 2', "{'song': 1}"]:
+            self.assertEqual(decode_notes(music_notes), [])
+
+    def test_malformed_legacy_notes(self):
+        """Are legacy notes missing their name or time dropped, keeping the rest of the melody?"""
+
+        legacy = "{'song': [{'noteName': 'playPiano_a', 'time': 0}, {'time': 100}, 'playPiano_b']}"
+
+        self.assertEqual(decode_notes(legacy), [{'noteName': 'playPiano_a', 'time': 0}])
+
+
+class MigrateMusicNotesTestCase(TestCase):
+    """Test the legacy melody migration, on SQLite."""
+
+    def setUp(self):
+        self.db_app = Flask(__name__)
+        self.db_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.db_app)
+        self.ctx = self.db_app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        db.session.add(User(id=1, username='phoenix', password='HASHED_PASSWORD'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_bad_rows_skipped(self):
+        """Does a melody that can't be encoded stay in the legacy format without stopping the migration?"""
+
+        good = "{'song': [{'noteName': 'playPiano_a', 'time': 0}]}"
+        bad = "{'song': [{'noteName': 'alert', 'time': 0}]}"
+        for i, music_notes in enumerate([good, bad, good], 1):
+            db.session.add(Melody(id=i, user_id=1, timestamp='now', music_notes=music_notes))
+        db.session.commit()
+
+        out = StringIO()
+        with redirect_stdout(out):
+            converted = migrate_music_notes(chunk_size=2)
+
+        self.assertEqual(converted, 2)
+        self.assertIn('skipped melody 2', out.getvalue())
+        self.assertIn('converted 2 melodies, skipped 1', out.getvalue())
+        self.assertEqual(db.session.get(Melody, 1).music_notes, encode_notes(decode_notes(good)))
+        self.assertEqual(db.session.get(Melody, 2).music_notes, bad)
+        self.assertEqual(db.session.get(Melody, 3).notes(), [{'noteName': 'playPiano_a', 'time': 0}])
@@ -0,0 +1,97 @@
+"""Rate limiter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_rate_limit.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+from multiprocessing import get_context
+from rate_limit import SharedTokenBucket
+
+import os
+import shutil
+import tempfile
+import time
+
+
+def take_tokens(path, count, results):
+    bucket = SharedTokenBucket(path, rate=0.001, burst=10)
+    results.put(sum(bucket.acquire(timeout=0) for i in range(count)))
+
+
+class SharedTokenBucketTestCase(TestCase):
+    """Test the token bucket shared through SQLite."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'rate-limit.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_burst_then_rate(self):
+        """Are burst requests let through at once, then the rest spaced out at the rate?"""
+
+        bucket = SharedTokenBucket(self.path, rate=100, burst=3)
+        start = time.perf_counter()
+        for i in range(3):
+            self.assertTrue(bucket.acquire(timeout=0))
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+        self.assertFalse(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.005)
+
+    def test_block(self):
+        """Are requests held up until the end of a block, and given up on if that's past their timeout?"""
+
+        bucket = SharedTokenBucket(self.path, rate=100, burst=3)
+        bucket.block(0.1)
+        self.assertFalse(bucket.acquire(timeout=0.05))
+
+        start = time.perf_counter()
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.03)
+
+    def test_no_burst_after_block(self):
+        """Does the bucket stay empty through a block, so requests resume at the rate instead of in a burst?"""
+
+        bucket = SharedTokenBucket(self.path, rate=10, burst=5)
+        with patch('rate_limit.time.time', return_value=1000):
+            bucket.block(3)
+        self.assertEqual(bucket._take(1001), 2)
+        self.assertEqual(bucket._take(1002.5), 0.5)
+
+        self.assertAlmostEqual(bucket._take(1003), 0.1)
+        self.assertEqual(bucket._take(1003.1), 0)
+        self.assertGreater(bucket._take(1003.1), 0)
+
+    def test_shared(self):
+        """Do limiters using the same file share one bucket, and ones using other names not?"""
+
+        first = SharedTokenBucket(self.path, rate=0.001, burst=2)
+        second = SharedTokenBucket(self.path, rate=0.001, burst=2)
+        other = SharedTokenBucket(self.path, rate=0.001, burst=2, name='other')
+
+        self.assertTrue(first.acquire(timeout=0))
+        self.assertTrue(second.acquire(timeout=0))
+        self.assertFalse(first.acquire(timeout=0))
+        self.assertTrue(other.acquire(timeout=0))
+
+        second.block(60)
+        self.assertFalse(first.acquire(timeout=1))
+
+    def test_processes(self):
+        """Do processes taking tokens at once never take more than the bucket holds?"""
+
+        context = get_context('fork')
+        results = context.Queue()
+        processes = [context.Process(target=take_tokens, args=(self.path, 5, results)) for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self.assertEqual(sum(results.get() for process in processes), 10)
@@ -0,0 +1,82 @@
+"""Favorited track refresh tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_refresh_tracks.py
+
+
+from unittest import TestCase
+from flask import Flask
+from models import db, Favorited_Track, Catalog_Track
+from refresh_tracks import refresh_favorited_tracks, read_checkpoint
+
+import os
+import tempfile
+
+
+class RefreshTracksTestCase(TestCase):
+    """Test refreshing favorited tracks in chunks, on SQLite."""
+
+    def setUp(self):
+        self.db_app = Flask(__name__)
+        self.db_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.db_app)
+        self.ctx = self.db_app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        db.session.add_all([Favorited_Track(id=i, track_name=f'Old {i}', artist_name='Old Artist',
+                                            track_photo='old.png', spotify_track_id=f's{i}') for i in range(1, 6)])
+        db.session.commit()
+        self.requests = []
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def fetch(self, track_ids):
+        """Stands in for API_several_tracks: s4 is no longer on Spotify, and s2 has lost its album image."""
+
+        self.requests.append(track_ids)
+        tracks = [{'track_id': track_id, 'track_name': f'New {track_id}', 'artist_name': 'New Artist',
+                   'artist_id': 'a1', 'album_name': 'New Album', 'album_image': None if track_id == 's2' else 'new.png'}
+                  for track_id in track_ids if track_id != 's4']
+        Catalog_Track.upsert_many(tracks)
+        return tracks
+
+    def test_refresh(self):
+        """Is each chunk fetched with one request and its rows updated, leaving tracks Spotify lacks as they were?"""
+
+        self.assertEqual(refresh_favorited_tracks(self.fetch, chunk_size=2), 4)
+        self.assertEqual(self.requests, [['s1', 's2'], ['s3', 's4'], ['s5']])
+
+        tracks = {track.id: track for track in Favorited_Track.query}
+        self.assertEqual((tracks[1].track_name, tracks[1].artist_name, tracks[1].album_name, tracks[1].track_photo),
+                         ('New s1', 'New Artist', 'New Album', 'new.png'))
+        self.assertEqual(tracks[2].track_photo, 'old.png')
+        self.assertEqual(tracks[4].track_name, 'Old 4')
+        self.assertEqual(Catalog_Track.query.count(), 4)
+
+    def test_resume(self):
+        """Does a run pick up after the given id, and record its progress in the checkpoint file?"""
+
+        fd, checkpoint = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, checkpoint)
+
+        failing = iter([True, False])
+
+        def fetch(track_ids):
+            if len(self.requests) == 1 and next(failing):
+                raise RuntimeError('Spotify is down')
+            return self.fetch(track_ids)
+
+        with self.assertRaises(RuntimeError):
+            refresh_favorited_tracks(fetch, chunk_size=2, checkpoint=checkpoint)
+        self.assertEqual(read_checkpoint(checkpoint), 2)
+
+        refresh_favorited_tracks(fetch, after=read_checkpoint(checkpoint), chunk_size=2, checkpoint=checkpoint)
+        self.assertEqual(self.requests, [['s1', 's2'], ['s3', 's4'], ['s5']])
+        self.assertEqual(read_checkpoint(checkpoint), 5)
+        self.assertEqual(Favorited_Track.query.get(3).track_name, 'New s3')
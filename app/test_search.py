@@ -0,0 +1,127 @@
+"""Melody and favorited track search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+from unittest import TestCase
+from flask import Flask
+from models import db, User, Melody, Favorited_Track, User_Favorited_Track
+from search import search_melodies, search_favorite_tracks, create_search_indexes
+
+
+class SearchTestCase(TestCase):
+    """Test search on SQLite, through the FTS5 tables."""
+
+    def setUp(self):
+        self.db_app = Flask(__name__)
+        self.db_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.db_app)
+        self.ctx = self.db_app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        db.session.add_all([User(id=1, username='phoenix', password='HASHED_PASSWORD'),
+                            User(id=2, username='moonlight', password='HASHED_PASSWORD')])
+        db.session.add_all([
+            Melody(id=1, user_id=1, name='Sunny Morning', timestamp='now', music_notes='AQ==', visibility=True),
+            Melody(id=2, user_id=1, name='Morning Rain', timestamp='now', music_notes='AQ==', visibility=False),
+            Melody(id=3, user_id=2, name='Evening Song', timestamp='now', music_notes='AQ==', visibility=True),
+            Melody(id=4, user_id=2, name='Morning Morning', timestamp='now', music_notes='AQ==', visibility=True),
+        ])
+        db.session.add_all([
+            Favorited_Track(id=1, track_name='Moonlight Sonata', artist_name='Beethoven', spotify_track_id='s1'),
+            Favorited_Track(id=2, track_name='Clair de Lune', artist_name='Debussy', spotify_track_id='s2'),
+            Favorited_Track(id=3, track_name='Moon River', artist_name='Henry Mancini', spotify_track_id='s3'),
+        ])
+        db.session.add_all([User_Favorited_Track(user_id=1, track_id=1), User_Favorited_Track(user_id=1, track_id=2),
+                            User_Favorited_Track(user_id=2, track_id=3)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_melodies(self):
+        """Are shared melodies found by name prefix, best match first?"""
+
+        melodies, next_page = search_melodies('morn')
+
+        self.assertEqual([melody.id for melody, rank in melodies], [4, 1])
+        self.assertIsNone(next_page)
+
+    def test_own_melodies(self):
+        """Are a user's own private melodies found, and nobody else's?"""
+
+        self.assertEqual({melody.id for melody, rank in search_melodies('rain', user_id=1)[0]}, {2})
+        self.assertEqual(search_melodies('rain', user_id=2)[0], [])
+
+    def test_username(self):
+        """Are melodies found by their user's name, also after it changes?"""
+
+        self.assertEqual({melody.id for melody, rank in search_melodies('moonlight')[0]}, {3, 4})
+
+        User.query.get(2).username = 'stargazer'
+        db.session.commit()
+
+        self.assertEqual(search_melodies('moonlight')[0], [])
+        self.assertEqual({melody.id for melody, rank in search_melodies('star')[0]}, {3, 4})
+
+    def test_pages(self):
+        """Are results split into pages?"""
+
+        melodies, next_page = search_melodies('morning', per_page=1)
+        self.assertEqual([melody.id for melody, rank in melodies], [4])
+        self.assertEqual(next_page, 2)
+
+        melodies, next_page = search_melodies('morning', page=2, per_page=1)
+        self.assertEqual([melody.id for melody, rank in melodies], [1])
+        self.assertIsNone(next_page)
+
+    def test_deleted_melody(self):
+        """Is a deleted melody no longer found?"""
+
+        Melody.query.filter_by(id=1).delete()
+        db.session.commit()
+
+        self.assertEqual([melody.id for melody, rank in search_melodies('sunny')[0]], [])
+
+    def test_renumbered_rows(self):
+        """Do renumbered melodies and tracks keep being found under their new ids, freeing their old ones?"""
+
+        Melody.query.filter_by(id=1).update({'id': 11, 'user_id': 2})
+        Favorited_Track.query.filter_by(id=1).update({'id': 11})
+        User_Favorited_Track.query.filter_by(track_id=1).update({'track_id': 11})
+        db.session.add(Melody(id=1, user_id=1, name='Quiet Night', timestamp='now', music_notes='AQ==', visibility=True))
+        db.session.add(Favorited_Track(id=1, track_name='Nocturne', artist_name='Chopin', spotify_track_id='s4'))
+        db.session.commit()
+
+        self.assertEqual([melody.id for melody, rank in search_melodies('sunny moonlight')[0]], [11])
+        self.assertEqual([melody.id for melody, rank in search_melodies('quiet')[0]], [1])
+        self.assertEqual([track.id for track, rank in search_favorite_tracks(1, 'sonata')[0]], [11])
+
+    def test_favorite_tracks(self):
+        """Are only the user's own favorited tracks found, by track or artist name?"""
+
+        self.assertEqual([track.id for track, rank in search_favorite_tracks(1, 'moon')[0]], [1])
+        self.assertEqual([track.id for track, rank in search_favorite_tracks(1, 'debussy')[0]], [2])
+        self.assertEqual([track.id for track, rank in search_favorite_tracks(2, 'moon')[0]], [3])
+
+    def test_no_terms(self):
+        """Does a query without any words find nothing?"""
+
+        self.assertEqual(search_melodies(' %" ')[0], [])
+        self.assertEqual(search_favorite_tracks(1, '')[0], [])
+
+    def test_create_indexes(self):
+        """Does adding the search tables to an existing database index its rows, and can it be re-run?"""
+
+        db.session.execute(db.text('DROP TABLE melodies_search'))
+        db.session.commit()
+
+        create_search_indexes()
+        create_search_indexes()
+
+        self.assertEqual({melody.id for melody, rank in search_melodies('morning')[0]}, {1, 4})
@@ -0,0 +1,232 @@
+"""Server-side session tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sessions.py
+
+
+from unittest import TestCase
+from datetime import datetime, timedelta
+from flask import Flask, session
+from models import db, Server_Session
+from sessions import ServerSideSessionInterface, MemorySessionStore, SQLSessionStore
+
+
+class CountingStore(MemorySessionStore):
+    """Memory store that records which keys were loaded and saved."""
+
+    def __init__(self):
+        super().__init__()
+        self.loaded = []
+        self.saved = []
+
+    def load(self, sid, key):
+        self.loaded.append(key)
+        return super().load(sid, key)
+
+    def save(self, sid, values, removed, expires):
+        self.saved.append(sorted(values))
+        return super().save(sid, values, removed, expires)
+
+
+def make_app(store):
+    """Build a small app using the server-side session interface."""
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'testing'
+    app.session_interface = ServerSideSessionInterface(store, skip_prefixes=('/assets/',))
+
+    @app.route('/set')
+    def set_tracks():
+        session['last_url'] = '/set'
+        session['search_tracks'] = [{'track_id': str(i)} for i in range(200)]
+        return 'OK'
+
+    @app.route('/small')
+    def small():
+        session['last_url'] = '/small'
+        return session['last_url']
+
+    @app.route('/tracks')
+    def tracks():
+        return str(len(session['search_tracks']))
+
+    @app.route('/plain')
+    def plain():
+        return 'OK'
+
+    @app.route('/assets/<name>')
+    def asset(name):
+        return str(session.get('last_url'))
+
+    @app.route('/clear')
+    def clear():
+        session.clear()
+        session['curr_user'] = 1
+        return 'OK'
+
+    @app.route('/reset')
+    def reset():
+        last_url = session.get('last_url')
+        session.clear()
+        session['last_url'] = last_url
+        return 'OK'
+
+    return app
+
+
+class ServerSideSessionTestCase(TestCase):
+    """Test the server-side session interface with the in-memory store."""
+
+    def setUp(self):
+        self.store = CountingStore()
+        self.app = make_app(self.store)
+        self.client = self.app.test_client()
+
+    def test_cookie_only_holds_session_id(self):
+        """Is the track list kept out of the cookie?"""
+
+        resp = self.client.get('/set')
+        cookie = resp.headers['Set-Cookie']
+
+        self.assertNotIn('track_id', cookie)
+        self.assertLess(len(cookie), 200)
+
+    def test_large_keys_loaded_lazily(self):
+        """Are large keys only loaded when a view reads them?"""
+
+        self.client.get('/set')
+
+        self.store.loaded = []
+        self.assertEqual(self.client.get('/small').get_data(as_text=True), '/small')
+        self.assertNotIn('search_tracks', self.store.loaded)
+
+        self.store.loaded = []
+        self.assertEqual(self.client.get('/tracks').get_data(as_text=True), '200')
+        self.assertIn('search_tracks', self.store.loaded)
+
+    def test_base_loaded_on_first_use(self):
+        """Is the store left alone by requests that don't use the session, and by skipped paths?"""
+
+        self.client.get('/set')
+
+        self.store.loaded = []
+        self.assertEqual(self.client.get('/plain').get_data(as_text=True), 'OK')
+        self.assertEqual(self.client.get('/assets/app.js').get_data(as_text=True), 'None')
+        self.assertEqual(self.store.loaded, [])
+
+        self.assertEqual(self.client.get('/small').get_data(as_text=True), '/small')
+        self.assertEqual(self.store.loaded, [''])
+
+    def test_unchanged_base_not_saved(self):
+        """Is the base record only written when its values change?"""
+
+        self.client.get('/set')
+        self.client.get('/small')
+
+        self.store.saved = []
+        self.client.get('/small')
+        self.client.get('/tracks')
+        self.assertEqual(self.store.saved, [])
+
+        self.client.get('/set')
+        self.assertEqual(self.store.saved, [['', 'search_tracks']])
+
+    def test_expired_session_starts_over(self):
+        """Does a cookie whose stored session has gone get a new, empty session?"""
+
+        self.client.get('/set')
+        with self.client.session_transaction() as sess:
+            old_sid = sess.sid
+        self.store.delete(old_sid)
+
+        self.assertEqual(self.client.get('/small').get_data(as_text=True), '/small')
+        with self.client.session_transaction() as sess:
+            self.assertNotEqual(sess.sid, old_sid)
+            self.assertEqual(sess['last_url'], '/small')
+            self.assertNotIn('search_tracks', sess)
+
+    def test_clear_rotates_session_id(self):
+        """Does clearing the session (login/logout) drop the stored data and issue a new session id?"""
+
+        self.client.get('/set')
+        with self.client.session_transaction() as sess:
+            old_sid = sess.sid
+
+        self.client.get('/clear')
+        with self.client.session_transaction() as sess:
+            self.assertNotEqual(sess.sid, old_sid)
+            self.assertEqual(sess['curr_user'], 1)
+            self.assertNotIn('search_tracks', sess)
+
+        self.assertIsNone(self.store.load(old_sid, 'search_tracks'))
+
+    def test_clear_saves_same_values_under_new_id(self):
+        """Is a cleared session stored under its new id even when it ends up holding the same values?"""
+
+        self.client.get('/small')
+        self.client.get('/reset')
+        with self.client.session_transaction() as sess:
+            sid = sess.sid
+
+        self.assertEqual(self.store.load(sid, '')['data'], {'last_url': '/small'})
+
+    def test_session_transaction(self):
+        """Can tests still prepare the session with session_transaction?"""
+
+        with self.client.session_transaction() as sess:
+            sess['search_tracks'] = [{'track_id': 'abc'}]
+
+        self.assertEqual(self.client.get('/tracks').get_data(as_text=True), '1')
+
+
+class SQLSessionStoreTestCase(TestCase):
+    """Test the database-backed session store."""
+
+    def setUp(self):
+        self.db_app = Flask(__name__)
+        self.db_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.db_app)
+        self.ctx = self.db_app.app_context()
+        self.ctx.push()
+        self.store = SQLSessionStore(db, Server_Session)
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def test_save_load_delete(self):
+        """Can session values be saved, replaced, removed and deleted?"""
+
+        expires = datetime.utcnow() + timedelta(days=1)
+
+        self.store.save('sid', {'': {'data': {}, 'lazy': ['melody']}, 'melody': 'notes'}, [], expires)
+        self.assertEqual(self.store.load('sid', 'melody'), 'notes')
+
+        self.store.save('sid', {'melody': 'new notes'}, [], expires)
+        self.assertEqual(self.store.load('sid', 'melody'), 'new notes')
+
+        self.store.save('sid', {'': {'data': {}, 'lazy': []}}, ['melody'], expires)
+        self.assertIsNone(self.store.load('sid', 'melody'))
+
+        self.store.delete('sid')
+        self.assertIsNone(self.store.load('sid', ''))
+
+    def test_save_only_removals(self):
+        """Can a save that only removes keys be stored?"""
+
+        expires = datetime.utcnow() + timedelta(days=1)
+
+        self.store.save('sid', {'': {'data': {}, 'lazy': ['melody']}, 'melody': 'notes'}, [], expires)
+        self.store.save('sid', {}, ['melody'], expires)
+
+        self.assertIsNone(self.store.load('sid', 'melody'))
+        self.assertEqual(self.store.load('sid', ''), {'data': {}, 'lazy': ['melody']})
+
+    def test_expired_records_ignored(self):
+        """Are expired records neither loaded nor kept after a purge?"""
+
+        self.store.save('sid', {'melody': 'notes'}, [], datetime.utcnow() - timedelta(seconds=1))
+
+        self.assertIsNone(self.store.load('sid', 'melody'))
+        self.store.purge_expired()
+        self.assertEqual(db.session.query(Server_Session).count(), 0)
@@ -0,0 +1,145 @@
+"""Melody similarity index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_similarity.py
+
+
+from unittest import TestCase, skipIf
+from flask import Flask
+from models import db, User, Melody, NOTE_NAMES, encode_notes
+from similarity import SimilarityIndex, melody_vector, melody_vectors, np
+
+
+def song(*names, step=250):
+    return [{'noteName': f'playPiano_{name}', 'time': i * step} for i, name in enumerate(names)]
+
+
+SCALE = song('f', 'g', 'a', 'bb', 'c', 'd', 'e')
+SCALE_UP_A_TONE = song('g', 'a', 'b', 'c', 'd', 'e', 'fsh')
+REPEATED = song('c', 'c', 'c', 'c', 'c')
+
+
+@skipIf(np is None, 'numpy is not installed')
+class SimilarityIndexTestCase(TestCase):
+    """Test melody vectors and the in-memory index."""
+
+    def test_vector(self):
+        """Is a melody most similar to itself, and a melody without notes similar to nothing?"""
+
+        self.assertAlmostEqual(float(melody_vector(SCALE) @ melody_vector(SCALE)), 1, places=5)
+        self.assertGreater(float(melody_vector(SCALE) @ melody_vector(SCALE_UP_A_TONE)),
+                           float(melody_vector(SCALE) @ melody_vector(REPEATED)))
+        self.assertFalse(melody_vector([]).any())
+
+    def test_batch(self):
+        """Are the vectors of a batch the vectors of each of its melodies?"""
+
+        songs = [SCALE, [], REPEATED, song('c'), SCALE_UP_A_TONE]
+
+        self.assertTrue(np.allclose(melody_vectors(songs), [melody_vector(notes) for notes in songs]))
+
+    def test_nearest(self):
+        """Are melodies ranked by similarity, leaving out the melody itself and unrelated melodies?"""
+
+        index = SimilarityIndex(capacity=2)
+        index.add(1, SCALE)
+        index.add(2, SCALE_UP_A_TONE)
+        index.add(3, REPEATED)
+        index.add(4, song('fsh', 'gsh'))
+
+        ids = [melody_id for melody_id, score in index.nearest(melody_vector(SCALE), 10, exclude=1)]
+
+        self.assertEqual(ids[:2], [2, 3])
+        self.assertNotIn(1, ids)
+        self.assertNotIn(4, ids)
+
+    def test_remove(self):
+        """Is a removed melody never returned, while the others keep their vectors?"""
+
+        index = SimilarityIndex()
+        for melody_id, notes in [(1, SCALE), (2, SCALE_UP_A_TONE), (3, REPEATED)]:
+            index.add(melody_id, notes)
+
+        index.remove(1)
+        index.remove(1)
+
+        self.assertEqual(len(index), 2)
+        self.assertNotIn(1, index)
+        self.assertTrue(np.array_equal(index.vector(3), melody_vector(REPEATED)))
+        self.assertEqual([melody_id for melody_id, score in index.nearest(melody_vector(SCALE), 10)], [2, 3])
+
+
+@skipIf(np is None, 'numpy is not installed')
+class SimilarMelodiesTestCase(TestCase):
+    """Test finding similar shared melodies in the database."""
+
+    def setUp(self):
+        self.db_app = Flask(__name__)
+        self.db_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.db_app)
+        self.ctx = self.db_app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        db.session.add(User(id=1, username='testuser', password='HASHED_PASSWORD'))
+        for melody_id, notes, visibility in [(1, SCALE, True), (2, SCALE_UP_A_TONE, True), (3, SCALE, False),
+                                             (4, REPEATED, True)]:
+            db.session.add(Melody(id=melody_id, user_id=1, name=f'melody{melody_id}', timestamp='now',
+                                  music_notes=encode_notes(notes), visibility=visibility))
+        db.session.commit()
+        self.index = SimilarityIndex()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_similar(self):
+        """Are only shared melodies returned, most similar first?"""
+
+        similar = self.index.similar(Melody.query.get(1), k=5)
+
+        self.assertEqual([melody.id for melody, score in similar], [2, 4])
+        self.assertEqual(self.index.last_id, 4)
+
+    def test_catch_up(self):
+        """Are melodies saved or deleted elsewhere picked up at the next query?"""
+
+        self.index.similar(Melody.query.get(1))
+
+        db.session.add(Melody(id=5, user_id=1, name='melody5', timestamp='now',
+                              music_notes=encode_notes(SCALE), visibility=True))
+        Melody.query.filter_by(id=2).delete()
+        db.session.commit()
+
+        similar = self.index.similar(Melody.query.get(1), k=1)
+
+        self.assertEqual([melody.id for melody, score in similar], [5])
+        self.assertNotIn(2, self.index)
+
+    def test_build(self):
+        """Does build() load every melody with a single allocation, and mark the index ready?"""
+
+        self.assertFalse(self.index.ready)
+        self.index.build()
+
+        self.assertTrue(self.index.ready)
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(len(self.index.ids), 1024)
+
+        index = SimilarityIndex(capacity=2)
+        index.build()
+        self.assertEqual(len(index.ids), 4)
+
+    def test_catch_up_limit(self):
+        """Does a query catch up on at most catch_up_limit melodies, and none while another thread is catching up?"""
+
+        self.index.similar(Melody.query.get(1), catch_up_limit=2)
+        self.assertEqual((len(self.index), self.index.last_id), (2, 2))
+
+        with self.index._catch_up_lock:
+            self.index.similar(Melody.query.get(1), catch_up_limit=2)
+        self.assertEqual(len(self.index), 2)
+
+        self.assertTrue(self.index.catch_up(limit=5))
+        self.assertEqual(len(self.index), 4)
@@ -0,0 +1,267 @@
+"""Spotify client tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_spotify.py
+
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from threading import Thread, Event
+from spotify import SpotifyClient, SpotifyUnavailable, CircuitBreaker, TokenManager
+
+import requests
+
+
+class SpotifyClientTestCase(TestCase):
+    """Test the pooled Spotify client."""
+
+    def test_session_is_reused(self):
+        """Does every request from the same process share one pooled session?"""
+
+        client = SpotifyClient(pool_size=4, connect_timeout=1, read_timeout=2)
+        session = client.session
+
+        self.assertIs(client.session, session)
+        self.assertEqual(client.timeout, (1, 2))
+
+        adapter = session.get_adapter('https://api.spotify.com/v1/search')
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+    def test_session_recreated_after_fork(self):
+        """Is a new session created when the client is used from a different process?"""
+
+        client = SpotifyClient()
+        session = client.session
+        client._pid = -1
+
+        self.assertIsNot(client.session, session)
+
+    def test_keep_alive_disabled(self):
+        """Are connections closed after each request when keep-alive is turned off?"""
+
+        client = SpotifyClient(keep_alive=False)
+        self.assertEqual(client.session.headers['Connection'], 'close')
+
+    def test_on_response(self):
+        """Is on_response told the endpoint, status and duration of each request, or 'error' when it failed?"""
+
+        client = SpotifyClient(max_retries=0)
+        client.tokens = TokenManager(lambda: {'access_token': 'token'})
+        responses = []
+        client.on_response = lambda endpoint, status, seconds: responses.append((endpoint, status))
+
+        with patch.object(client.session, 'get') as get:
+            get.return_value.status_code = 404
+            get.return_value.json.return_value = {}
+            client.get('https://api.spotify.com/v1/search', endpoint='search_by_track')
+
+            get.side_effect = requests.ConnectionError
+            with self.assertRaises(SpotifyUnavailable):
+                client.get('https://api.spotify.com/v1/search')
+
+        self.assertEqual(responses, [('search_by_track', 404), ('https://api.spotify.com/v1/search', 'error')])
+
+    def response(self, status):
+        res = requests.Response()
+        res.status_code = status
+        res._content = b'{"tracks": []}'
+        return res
+
+    def test_retries(self):
+        """Are connection errors and 5xx responses retried, and 4xx responses returned as they are?"""
+
+        client = SpotifyClient(max_retries=2, backoff=0)
+        client.tokens = TokenManager(lambda: {'access_token': 'token'})
+
+        with patch.object(client.session, 'get') as get:
+            get.side_effect = [requests.Timeout(), self.response(503), self.response(200)]
+            self.assertEqual(client.get('https://api.spotify.com/v1/search'), {'tracks': []})
+            self.assertEqual(get.call_count, 3)
+
+            get.reset_mock(side_effect=True)
+            get.side_effect = [self.response(404)]
+            client.get('https://api.spotify.com/v1/search')
+            self.assertEqual(get.call_count, 1)
+
+            get.reset_mock(side_effect=True)
+            get.side_effect = [self.response(500)] * 3
+            with self.assertRaises(SpotifyUnavailable):
+                client.get('https://api.spotify.com/v1/search')
+            self.assertEqual(get.call_count, 3)
+
+    def test_rate_limited(self):
+        """Does a 429 hold up the limiter for its Retry-After before the request is retried, leaving the circuit breaker
+        alone if it never gets through, and does a request that can't get through the limiter in time give up?"""
+
+        client = SpotifyClient(max_retries=2, backoff=0)
+        client.tokens = TokenManager(lambda: {'access_token': 'token'})
+        client.limiter = Mock()
+        client.limiter.acquire.return_value = True
+
+        limited = self.response(429)
+        limited.headers['Retry-After'] = '3'
+        with patch.object(client.session, 'get') as get:
+            get.side_effect = [limited, self.response(200)]
+            self.assertEqual(client.get('https://api.spotify.com/v1/search'), {'tracks': []})
+        client.limiter.block.assert_called_once_with(3.0)
+        self.assertEqual(client.limiter.acquire.call_count, 2)
+
+        breaker = client.breaker('https://api.spotify.com/v1/search')
+        breaker.failure()
+        with patch.object(client.session, 'get') as get:
+            get.side_effect = [limited] * 3
+            with self.assertRaises(SpotifyUnavailable):
+                client.get('https://api.spotify.com/v1/search')
+        self.assertEqual(breaker.failures, 1)
+
+        client.limiter.acquire.return_value = False
+        with patch.object(client.session, 'get') as get:
+            with self.assertRaises(SpotifyUnavailable):
+                client.get('https://api.spotify.com/v1/search', endpoint='search_by_track')
+            get.assert_not_called()
+        self.assertEqual(client.breaker('search_by_track').failures, 0)
+
+    def test_circuit_breaker(self):
+        """Does an endpoint that keeps failing fail fast, without affecting other endpoints?"""
+
+        client = SpotifyClient(max_retries=0, breaker_threshold=2, breaker_reset=60)
+        client.tokens = TokenManager(lambda: {'access_token': 'token'})
+
+        with patch.object(client.session, 'get') as get:
+            get.side_effect = requests.ConnectionError
+            for i in range(2):
+                with self.assertRaises(SpotifyUnavailable):
+                    client.get('https://api.spotify.com/v1/search', endpoint='search_by_track')
+            self.assertEqual(get.call_count, 2)
+
+            with self.assertRaises(SpotifyUnavailable):
+                client.get('https://api.spotify.com/v1/search', endpoint='search_by_track')
+            self.assertEqual(get.call_count, 2)
+
+            get.side_effect = [self.response(200)]
+            client.get('https://api.spotify.com/v1/recommendations', endpoint='recommended_tracks')
+            self.assertEqual(get.call_count, 3)
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test opening, half-opening and closing the circuit."""
+
+    def test_states(self):
+        """Is one trial request let through after the reset timeout, closing the circuit if it succeeds?"""
+
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        with patch('spotify.time.monotonic', return_value=breaker._opened_at + 60):
+            self.assertEqual(breaker.state, 'half-open')
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.failure()
+            self.assertFalse(breaker.allow())
+
+        with patch('spotify.time.monotonic', return_value=breaker._opened_at + 60):
+            self.assertTrue(breaker.allow())
+            breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow())
+
+
+class TokenManagerTestCase(TestCase):
+    """Test the lazy, self-refreshing access-token manager."""
+
+    def setUp(self):
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        return {'access_token': f'token{self.calls}', 'expires_in': 3600}
+
+    def test_lazy_fetch(self):
+        """Is no token requested until one is needed, and then only once?"""
+
+        tokens = TokenManager(self.fetch)
+        self.assertEqual(self.calls, 0)
+
+        self.assertEqual(tokens.get(), 'Bearer token1')
+        self.assertEqual(tokens.get(), 'Bearer token1')
+        self.assertEqual(self.calls, 1)
+
+    def test_refresh_before_expiry(self):
+        """Is a token near expiry refreshed in the background while the current one is still served?"""
+
+        done = Event()
+
+        def fetch():
+            token = self.fetch()
+            if self.calls == 2:
+                done.set()
+            return token
+
+        tokens = TokenManager(fetch, refresh_margin=60)
+        with patch('spotify.time.monotonic', return_value=0):
+            tokens.get()
+        with patch('spotify.time.monotonic', return_value=3550):
+            self.assertEqual(tokens.get(), 'Bearer token1')
+            self.assertTrue(done.wait(2))
+            self.assertEqual(tokens.get(), 'Bearer token2')
+
+    def test_expire(self):
+        """Is a rejected token replaced, but only once when several threads report it?"""
+
+        tokens = TokenManager(self.fetch)
+        rejected = tokens.get()
+        tokens.expire(rejected)
+        self.assertEqual(tokens.get(), 'Bearer token2')
+
+        tokens.expire(rejected)
+        self.assertEqual(tokens.get(), 'Bearer token2')
+        self.assertEqual(self.calls, 2)
+
+    def test_concurrent_refresh(self):
+        """Do concurrent threads without a valid token share a single refresh?"""
+
+        release = Event()
+
+        def slow_fetch():
+            release.wait(2)
+            return self.fetch()
+
+        tokens = TokenManager(slow_fetch)
+        results = []
+        threads = [Thread(target=lambda: results.append(tokens.get())) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['Bearer token1'] * 5)
+
+    def test_single_background_refresh(self):
+        """Do concurrent threads finding a token near expiry start a single background refresh?"""
+
+        release = Event()
+
+        def slow_fetch():
+            if self.calls:
+                release.wait(2)
+            return self.fetch()
+
+        tokens = TokenManager(slow_fetch, refresh_margin=60)
+        with patch('spotify.time.monotonic', return_value=0):
+            tokens.get()
+        with patch('spotify.time.monotonic', return_value=3550), patch('spotify.Thread', wraps=Thread) as started:
+            threads = [Thread(target=tokens.get) for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            release.set()
+
+        self.assertEqual(started.call_count, 1)
@@ -0,0 +1,104 @@
+"""Spotify stand-in tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_spotify_standin.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+from spotify import SpotifyClient
+from spotify_standin import create_app, start_server
+
+import time
+
+
+class SpotifyStandinTestCase(TestCase):
+    """Test the offline stand-in for the Spotify Web API."""
+
+    def setUp(self):
+        self.standin = create_app(seed=0)
+        self.client = self.standin.test_client()
+
+    def token(self):
+        resp = self.client.post('/api/token', data={'grant_type': 'client_credentials'})
+        return {'Authorization': f'Bearer {resp.json["access_token"]}'}
+
+    def test_fixtures_served(self):
+        """Are the recorded responses served for every endpoint the app uses, cut down to the limit?"""
+
+        headers = self.token()
+
+        resp = self.client.get('/v1/search?q=piano&type=track&limit=12', headers=headers)
+        self.assertEqual(len(resp.json['tracks']['items']), 12)
+        resp = self.client.get('/v1/search?q=piano&type=artist&limit=1', headers=headers)
+        self.assertEqual(len(resp.json['artists']['items']), 1)
+
+        artist_id = resp.json['artists']['items'][0]['id']
+        resp = self.client.get(f'/v1/artists/{artist_id}/top-tracks?market=us', headers=headers)
+        self.assertTrue(resp.json['tracks'])
+        resp = self.client.get('/v1/recommendations?seed_tracks=abc&limit=6', headers=headers)
+        self.assertEqual(len(resp.json['tracks']), 6)
+        resp = self.client.get('/v1/playlists/37i9dQZF1DX8C9xQcOrE6T/tracks?limit=12', headers=headers)
+        self.assertEqual(len(resp.json['items']), 12)
+        self.assertIn('album', resp.json['items'][0]['track'])
+
+    def test_several_tracks(self):
+        """Are recorded tracks returned by id in the order asked for, with a null for unknown ids, up to 50 at once?"""
+
+        headers = self.token()
+        resp = self.client.get('/v1/search?q=piano&type=track&limit=1', headers=headers)
+        track_id = resp.json['tracks']['items'][0]['id']
+
+        resp = self.client.get(f'/v1/tracks?ids=unknown,{track_id}', headers=headers)
+        self.assertEqual(resp.json['tracks'][0], None)
+        self.assertEqual(resp.json['tracks'][1]['id'], track_id)
+        resp = self.client.get(f'/v1/tracks?ids={",".join([track_id] * 51)}', headers=headers)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_tokens(self):
+        """Are requests without a valid token rejected, and expired tokens reported like Spotify does?"""
+
+        resp = self.client.get('/v1/recommendations?seed_tracks=abc')
+        self.assertEqual(resp.status_code, 401)
+        resp = self.client.get('/v1/recommendations?seed_tracks=abc', headers={'Authorization': 'Bearer nope'})
+        self.assertEqual(resp.status_code, 401)
+
+        self.standin.config['TOKEN_TTL'] = 0
+        resp = self.client.get('/v1/recommendations?seed_tracks=abc', headers=self.token())
+        self.assertEqual(resp.json['error']['message'], 'The access token expired')
+
+    def test_latency_and_errors(self):
+        """Are requests delayed by the configured latency, and failed at the configured rate?"""
+
+        self.standin.config['LATENCY'] = 50
+        start = time.perf_counter()
+        self.client.post('/api/token', data={'grant_type': 'client_credentials'})
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+        self.standin.config.update(LATENCY=0, ERROR_RATE=1)
+        resp = self.client.get('/v1/recommendations?seed_tracks=abc')
+        self.assertEqual(resp.status_code, 503)
+
+    def test_rate_limit(self):
+        """Are API requests beyond the rate limit rejected with a 429 and a Retry-After?"""
+
+        self.standin.config['RATE_LIMIT'] = 2
+        headers = self.token()
+        with patch('spotify_standin.time.time', return_value=1000.5):
+            statuses = [self.client.get('/v1/recommendations?seed_tracks=abc', headers=headers) for i in range(3)]
+        self.assertEqual([resp.status_code for resp in statuses], [200, 200, 429])
+        self.assertEqual(statuses[2].headers['Retry-After'], '1')
+
+    def test_spotify_client(self):
+        """Can the app's Spotify client get a token from the stand-in and make requests with it?"""
+
+        server, url = start_server(self.standin)
+        try:
+            spotify = SpotifyClient()
+            spotify.configure_auth(f'{url}/api/token', 'client-id', 'client-secret')
+            data = spotify.get(f'{url}/v1/search', params={'q': 'piano', 'type': 'track', 'limit': 3})
+            self.assertEqual(len(data['tracks']['items']), 3)
+            spotify.close()
+        finally:
+            server.shutdown()
@@ -0,0 +1,74 @@
+"""Fingerprinted static asset tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_static_assets.py
+
+
+from unittest import TestCase
+from static_assets import build_assets, load_assets, BUILD_DIR_NAME
+
+import gzip
+import os
+import shutil
+import tempfile
+import time
+
+
+class StaticAssetsTestCase(TestCase):
+    """Test building the fingerprinted static assets and their manifest."""
+
+    def setUp(self):
+        self.static_dir = tempfile.mkdtemp()
+        self.write('app.js', b'console.log("melodic")')
+        self.write('images/bkg.jpg', b'JPEG')
+        self.write('stylesheets/style.css', b"body { background-image: url('/static/images/bkg.jpg'); }\n"
+                                            b"h1 { background-image: url(/static/images/missing.png); }")
+        self.write('audio/piano/a5.wav', b'RIFF')
+
+    def tearDown(self):
+        shutil.rmtree(self.static_dir)
+
+    def write(self, path, data):
+        path = os.path.join(self.static_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, path):
+        with open(os.path.join(self.static_dir, BUILD_DIR_NAME, path), 'rb') as f:
+            return f.read()
+
+    def test_build(self):
+        """Is every static file copied under a content-hashed name, and text files gzipped too?"""
+
+        manifest = build_assets(self.static_dir)
+
+        self.assertEqual(sorted(manifest), ['app.js', 'images/bkg.jpg', 'stylesheets/style.css'])
+        self.assertRegex(manifest['app.js'], r'^app\.[0-9a-f]{12}\.js$')
+        self.assertEqual(self.read(manifest['app.js']), b'console.log("melodic")')
+        self.assertEqual(gzip.decompress(self.read(manifest['app.js'] + '.gz')), b'console.log("melodic")')
+        self.assertFalse(os.path.exists(os.path.join(self.static_dir, BUILD_DIR_NAME, manifest['images/bkg.jpg'] + '.gz')))
+
+    def test_stylesheet_references(self):
+        """Are /static/ paths in stylesheets rewritten to fingerprinted ones?"""
+
+        manifest = build_assets(self.static_dir)
+        css = self.read(manifest['stylesheets/style.css']).decode()
+
+        self.assertIn(f"url('/assets/{manifest['images/bkg.jpg']}')", css)
+        self.assertIn("url(/static/images/missing.png)", css)
+
+    def test_load(self):
+        """Are the assets rebuilt when a static file changes, and only then?"""
+
+        manifest = load_assets(self.static_dir)
+        self.assertEqual(load_assets(self.static_dir), manifest)
+
+        self.write('images/bkg.jpg', b'PNG')
+        os.utime(os.path.join(self.static_dir, 'images/bkg.jpg'), (time.time() + 5, time.time() + 5))
+        changed = load_assets(self.static_dir)
+
+        self.assertNotEqual(changed['images/bkg.jpg'], manifest['images/bkg.jpg'])
+        self.assertNotEqual(changed['stylesheets/style.css'], manifest['stylesheets/style.css'])
+        self.assertEqual(changed['app.js'], manifest['app.js'])
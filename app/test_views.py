@@ -6,8 +6,16 @@
 # python3 -m unittest test_views.py
 
 
-from app import app, CURR_USER_KEY, do_login
-from unittest import TestCase
+from app import app, CURR_USER_KEY, HASHING_OVERLOADED_MESSAGE, do_login, feed_cache, identity_cache, piano_sprite, static_url, similarity_index, refresh_similarity_index
+from flask import session
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from threading import Event, Thread
+from hashing import hasher
+from spotify import SpotifyUnavailable
+from melody_audio import np
+from contextlib import contextmanager
+from sqlalchemy import event
 from models import db, connect_db, Melody, User, Favorited_Track, User_Favorited_Track
 
 
@@ -23,6 +31,22 @@ with app.app_context():
 app.config['WTF_CSRF_ENABLED'] = False
 
 
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed inside the with-block."""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
 class AllViewsTestCase(TestCase):
     """Test views."""
 
@@ -113,6 +137,10 @@ class AllViewsTestCase(TestCase):
             db.session.add_all([self.mel1, self.mel2, self.mel3, self.mel4])
             db.session.commit()
 
+            # users and melodies were changed without going through the views, so drop anything cached about them
+            feed_cache.clear()
+            identity_cache.clear()
+
             self.client = app.test_client()
 
     def tearDown(self):
@@ -204,7 +232,7 @@ class AllViewsTestCase(TestCase):
 
             self.assertEqual(resp.status_code, 302)
             melodies = Melody.query.filter(
-                Melody.user_id == self.mainuser_id).all()
+                Melody.user_id == self.mainuser_id).order_by(Melody.id).all()
 
             # there should be 3 melodies after adding one
             self.assertEqual(len(melodies), 3)
@@ -253,6 +281,289 @@ class AllViewsTestCase(TestCase):
                 self.assertNotIn("trackName2", html)
 
 
+    def test_melody_notes(self):
+        """Are a melody's notes served as JSON with caching headers, and only to users allowed to see them?"""
+
+        with self.client as c:
+            resp = c.get(f'/melodies/{self.mel1_id}/notes')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['id'], self.mel1_id)
+            self.assertIn('public', resp.headers['Cache-Control'])
+
+            resp = c.get(f'/melodies/{self.mel1_id}/notes',
+                         headers={'If-None-Match': resp.headers['ETag']})
+            self.assertEqual(resp.status_code, 304)
+
+            # a private melody is only served to its owner
+            resp = c.get(f'/melodies/{self.mel2_id}/notes')
+            self.assertEqual(resp.status_code, 403)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.mainuser_id
+            resp = c.get(f'/melodies/{self.mel2_id}/notes')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('private', resp.headers['Cache-Control'])
+
+    @skipIf(np is None, 'numpy is not installed')
+    def test_melody_audio(self):
+        """Is a melody rendered to a WAV file, and only for users allowed to hear it?"""
+
+        with self.client as c:
+            resp = c.get(f'/melodies/{self.mel1_id}/audio.wav?download=1')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'audio/wav')
+            self.assertIn('attachment', resp.headers['Content-Disposition'])
+            self.assertIn('public', resp.headers['Cache-Control'])
+
+            resp = c.get(f'/melodies/{self.mel2_id}/audio.wav')
+            self.assertEqual(resp.status_code, 403)
+
+    @skipIf(np is None, 'numpy is not installed')
+    def test_similar_melodies(self):
+        """Are only other shared melodies listed as similar, and only for users allowed to see the melody?"""
+
+        refresh_similarity_index()
+        with self.client as c:
+            resp = c.get(f'/melodies/{self.mel1_id}/similar')
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn(self.mel1_id, [melody['id'] for melody in resp.json['similar']])
+            self.assertNotIn(self.mel2_id, [melody['id'] for melody in resp.json['similar']])
+
+            resp = c.get(f'/melodies/{self.mel2_id}/similar')
+            self.assertEqual(resp.status_code, 403)
+
+    @skipIf(np is None, 'numpy is not installed')
+    def test_similar_melodies_loading(self):
+        """Are similar melodies turned away with a 503 until the index has loaded?"""
+
+        with patch.object(similarity_index, 'ready', False):
+            resp = self.client.get(f'/melodies/{self.mel1_id}/similar')
+        self.assertEqual(resp.status_code, 503)
+
+    def test_search(self):
+        """Are shared melodies, the user's own melodies and the user's favorited tracks found?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.mainuser_id
+
+            resp = c.get('/search?q=test')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual({melody['id'] for melody in resp.json['results']},
+                             {self.mel1_id, self.mel2_id, self.mel3_id})
+
+            resp = c.get('/search?q=trackname&type=tracks')
+            self.assertEqual([track['track_id'] for track in resp.json['results']], ['12345'])
+
+    def test_metrics(self):
+        """Are request latencies and query counts exposed on /metrics?"""
+
+        with self.client as c:
+            c.get('/')
+            resp = c.get('/metrics')
+            self.assertEqual(resp.status_code, 200)
+            text = resp.get_data(as_text=True)
+            self.assertIn('melodic_request_duration_seconds_count{endpoint="home",method="GET",status="200"}', text)
+            self.assertIn('melodic_request_db_queries_count{endpoint="home"}', text)
+
+    def test_piano_sprite(self):
+        """Is the piano audio sprite linked from pages that play notes, and served with immutable caching?"""
+
+        with self.client as c:
+            resp = c.get('/')
+            self.assertIn(piano_sprite['url'], resp.get_data(as_text=True))
+
+            resp = c.get(piano_sprite['url'])
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+
+            resp = c.get('/audio/app.py')
+            self.assertEqual(resp.status_code, 404)
+
+    def test_static_assets(self):
+        """Are pages linked to fingerprinted assets, served gzipped when accepted and cached forever?"""
+
+        with self.client as c:
+            url = static_url('stylesheets/style.css')
+            self.assertTrue(url.startswith('/assets/stylesheets/style.'))
+            self.assertIn(url, c.get('/').get_data(as_text=True))
+
+            resp = c.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+
+            resp = c.get(url)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertIn(b'/assets/images/', resp.data)
+
+    def test_toggle_favorite(self):
+        """Does toggling a favorite only add or remove the current user's favorite, and keep the session's favorite ids in step?"""
+
+        with app.app_context():
+            with self.client as c:
+                # user1 favorites track1, which mainuser has already favorited
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user1_id
+                    sess['favorite_track_ids'] = ['123456']
+
+                resp = c.post('/track/favorite', json={'trackId': '12345'})
+                self.assertEqual(resp.status_code, 200)
+                with c.session_transaction() as sess:
+                    self.assertEqual(sess['favorite_track_ids'], ['123456', '12345'])
+
+                # mainuser unfavorites track1
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.mainuser_id
+                    sess['favorite_track_ids'] = ['12345']
+
+                resp = c.post('/track/favorite', json={'trackId': '12345'})
+                self.assertEqual(resp.status_code, 200)
+                with c.session_transaction() as sess:
+                    self.assertEqual(sess['favorite_track_ids'], [])
+
+                self.assertEqual(Favorited_Track.spotify_ids_for_user(self.mainuser_id), [])
+                self.assertEqual(Favorited_Track.spotify_ids_for_user(self.user1_id), ['123456', '12345'])
+
+    def test_hashing_overloaded(self):
+        """Is a signup turned away with a 503 while the hashing pool is full, and let through once it drains?"""
+
+        rounds, workers, max_pending = hasher.rounds, hasher.workers, hasher.max_pending
+        hasher.configure(rounds=4, workers=1, max_pending=1)
+        self.addCleanup(hasher.configure, rounds, workers, max_pending)
+
+        started, release = Event(), Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+
+        busy = Thread(target=hasher._run, args=(slow,))
+        busy.start()
+        started.wait(5)
+
+        signup = {'username': 'newuser', 'password': 'password', 'password_confirm': 'password'}
+        with self.client as c:
+            resp = c.post('/signup', data=signup)
+            self.assertEqual(resp.status_code, 503)
+            self.assertIn(HASHING_OVERLOADED_MESSAGE, resp.get_data(as_text=True))
+
+            release.set()
+            busy.join()
+            resp = c.post('/signup', data=signup)
+            self.assertEqual(resp.status_code, 302)
+
+    def test_favorite_unknown_track(self):
+        """Is favoriting a track that is in neither table looked up on Spotify, and refused if Spotify doesn't have it?"""
+
+        track_id = '6tHtqQ2VYGqgcjh5TAMunF'
+        track = {'track_id': track_id, 'track_name': 'trackName3', 'artist_name': 'artistName3', 'artist_id': 'a3',
+                 'album_name': 'albumName3', 'album_image': 'photo3.png'}
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1_id
+                sess['favorite_track_ids'] = []
+
+            with patch('app.API_several_tracks', return_value=[]):
+                resp = c.post('/track/favorite', json={'trackId': track_id})
+            self.assertEqual(resp.status_code, 404)
+            resp = c.post('/track/favorite', json={'trackId': 'not-a-track'})
+            self.assertEqual(resp.status_code, 404)
+            with c.session_transaction() as sess:
+                self.assertEqual(sess['favorite_track_ids'], [])
+
+            with patch('app.API_several_tracks', return_value=[track]):
+                resp = c.post('/track/favorite', json={'trackId': track_id})
+            self.assertEqual(resp.status_code, 200)
+            with c.session_transaction() as sess:
+                self.assertEqual(sess['favorite_track_ids'], [track_id])
+
+        with app.app_context():
+            self.assertEqual(Favorited_Track.spotify_ids_for_user(self.user1_id), ['123456', track_id])
+
+    def test_deleted_user(self):
+        """Is a session whose user has been deleted treated as logged out, instead of failing?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 999
+
+            resp = c.get('/save-melody')
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, '/login')
+
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+            resp = c.get('/')
+            self.assertEqual(resp.status_code, 200)
+
+    def test_get_melody_skips_user_query(self):
+        """Does a request that only needs the logged-in user's id avoid querying the users table?"""
+
+        with app.app_context():
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.mainuser_id
+
+                with count_queries() as statements:
+                    resp = c.post('/get-melody', json={'song': []})
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertFalse([statement for statement in statements if 'FROM users' in statement])
+
+    def add_favorites(self, count):
+        """Give mainuser count more favorited tracks."""
+
+        tracks = [Favorited_Track(track_name=f"extraTrack{i}", spotify_track_id=f'extra{i}')
+                  for i in range(count)]
+        db.session.add_all(tracks)
+        db.session.commit()
+        db.session.add_all([User_Favorited_Track(track_id=track.id, user_id=self.mainuser_id)
+                            for track in tracks])
+        db.session.commit()
+
+    def test_login_query_count(self):
+        """Does loading favorites at login take the same number of queries however many favorites a user has?"""
+
+        with app.app_context():
+            user = User.query.get(self.mainuser_id)
+            with app.test_request_context('/login'):
+                with count_queries() as few_favorites:
+                    do_login(user)
+
+            self.add_favorites(20)
+            user = User.query.get(self.mainuser_id)
+            with app.test_request_context('/login'):
+                with count_queries() as many_favorites:
+                    do_login(user)
+                self.assertEqual(len(session['favorite_track_ids']), 21)
+
+            self.assertEqual(len(few_favorites), len(many_favorites))
+            self.assertEqual(len(many_favorites), 1)
+
+    def test_user_profile_query_count(self):
+        """Does the profile page take the same number of queries however many favorites a user has?"""
+
+        with app.app_context():
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.mainuser_id
+
+                # the first request puts the user in the identity cache
+                c.get(f"/profile/{self.mainuser_id}")
+                with count_queries() as few_favorites:
+                    c.get(f"/profile/{self.mainuser_id}")
+
+                self.add_favorites(20)
+                with count_queries() as many_favorites:
+                    html = c.get(f"/profile/{self.mainuser_id}").get_data(as_text=True)
+
+                self.assertIn("extraTrack19", html)
+                self.assertEqual(len(few_favorites), len(many_favorites))
+
 ############################################################################
 # Testing when user is logged out
 
@@ -286,6 +597,23 @@ class AllViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertNotIn("fa fa-heart", html)
 
+    def test_spotify_unavailable(self):
+        """Does the /jam page still render, and a search go back to the search page, when Spotify is unavailable?"""
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session['favorite_track_ids'] = []
+
+            with patch('app.API_recommended_tracks', side_effect=SpotifyUnavailable('recommended_tracks')):
+                resp = c.get("/jam/6tHtqQ2VYGqgcjh5TAMunF")
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Spotify isn", resp.get_data(as_text=True))
+
+            with patch('app.API_search_by_track', side_effect=SpotifyUnavailable('search_by_track')):
+                resp = c.post('/search-tracks/search', data={'track_name': 'song', 'artist_name': ''})
+                self.assertEqual(resp.status_code, 302)
+                self.assertEqual(resp.location, '/search-tracks')
+
     def test_delete_melody_logged_out(self):
         """Can a user delete melody when logged out?"""
         with self.client as c: